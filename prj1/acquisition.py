@@ -0,0 +1,264 @@
+"""
+Sensor acquisition off the GUI thread
+
+Generating a reading is cheap, but storing it is a committing INSERT that
+can stall for as long as the disk does. AcquisitionWorker does both on its
+own QThread with its own database connection and hands every stored
+reading back to the GUI thread through a queued signal, so a slow disk
+delays readings instead of freezing the window
+
+For high rates the worker can also stream: a set number of samples at a
+set rate, generated with generate_batch and stored with insert_many a tick
+at a time, and handed back as whole arrays
+
+With a RetentionPolicy the worker also expires old readings, since its
+connection is the one that writes. A pass deletes one chunk per event loop
+turn, so reads and stream ticks queued meanwhile run between chunks
+
+The worker also reads the pages of the history view, so scrolling through
+it never waits on the disk on the GUI thread either
+"""
+
+import datetime
+import time
+
+import numpy as np
+from PySide6.QtCore import QDateTime, QObject, QThread, QTimer, Signal, Slot
+
+import pseudoSensor
+from db import PseudoSensorDb, RowArchive
+from history import END_MS, START_MS
+
+
+class AcquisitionWorker(QObject):
+    """
+    AcquisitionWorker generates and stores readings. It lives on the
+    acquisition thread, so its slots run there when connected to signals
+    from the GUI thread
+    """
+
+    # humidity, temperature, datetime text, and who asked for the reading
+    reading = Signal(float, float, str, str)
+    # humidity, temperature and epoch-ms arrays of one stream tick
+    batch = Signal(object, object, object)
+    # samples stored so far, samples requested
+    progress = Signal(int, int)
+    # tag of a history page request and its rows
+    page = Signal(object, object)
+
+    # How often a stream stores and hands back what is due
+    tick_ms = 50
+
+    def __init__(self, sensor: pseudoSensor.PseudoSensor, db_name: str,
+                 db_class=PseudoSensorDb, retention=None):
+        super().__init__()
+        self.sensor = sensor
+        self.db_name = db_name
+        self.db_class = db_class
+        self.db = None
+        self.timer = None
+        self.retention = retention
+        self.retention_timer = None
+        # Archive of the retention pass in progress, if it archives
+        self.archive = None
+        self.expiring = False
+        self.rate_hz = 0
+        self.total = 0
+        self.produced = 0
+        self.started = 0.0
+        self.start_ms = 0.0
+
+    @Slot()
+    def open(self):
+        """
+        open creates the worker's connection. sqlite connections belong to
+        the thread that made them, so this runs once the thread has started
+        """
+        self.db = self.db_class(self.db_name)
+        # WAL lets the GUI thread's connection read while this one commits
+        self.db.create_connection(wal=True)
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+        if self.retention is not None:
+            self.retention_timer = QTimer()
+            self.retention_timer.timeout.connect(self.start_retention)
+            self.retention_timer.start(int(self.retention.interval_s * 1000))
+
+    @Slot(str)
+    def read(self, source):
+        """
+        read generates one reading, stores it and emits it back tagged with
+        `source`
+        """
+        hum, temp = self.sensor.generate_values()
+        current_time = QDateTime.currentDateTime()
+        formatted_time = current_time.toString('yyyy-MM-dd hh:mm:ss dddd')
+        self.db.insert_data((temp, hum, formatted_time))
+        self.reading.emit(hum, temp, formatted_time, source)
+
+    @Slot(object, object, int)
+    def read_page(self, tag, after, limit):
+        """
+        read_page reads up to `limit` stored readings after the keyset key
+        `after` and emits them back tagged with `tag`
+        """
+        if self.db is None:
+            return
+        self.page.emit(tag, self.db.get_page(START_MS, END_MS, after, limit))
+
+    @Slot(float, int)
+    def start_stream(self, rate_hz, count):
+        """
+        start_stream begins storing `count` samples at rate_hz, replacing
+        any stream already running
+        """
+        self.rate_hz = rate_hz
+        self.total = count
+        self.produced = 0
+        self.started = time.monotonic()
+        self.start_ms = time.time() * 1000
+        self.timer.start(max(self.tick_ms, int(1000 / rate_hz)))
+        self.tick()
+
+    @Slot()
+    def stop_stream(self):
+        if self.timer is not None and self.timer.isActive():
+            self.timer.stop()
+            self.progress.emit(self.produced, self.produced)
+
+    @Slot()
+    def tick(self):
+        """
+        tick stores every sample that is due by now. The count comes from
+        the time since the stream started, so a tick delayed by a slow
+        commit makes up for it with a bigger batch and no sample is lost
+        """
+        elapsed = time.monotonic() - self.started
+        due = min(self.total, int(elapsed * self.rate_hz) + 1) - self.produced
+        if due <= 0:
+            return
+
+        period_ms = 1000 / self.rate_hz
+        hums, temps, _ = self.sensor.generate_batch(due)
+        # Spaced from the stream start rather than from now, so the
+        # timestamps do not drift with tick jitter
+        stamps = (self.start_ms + (self.produced + np.arange(due))
+                  * period_ms).astype(np.int64)
+
+        # Samples in the same second share their datetime text
+        texts = {}
+        for second in np.unique(stamps // 1000).tolist():
+            texts[second] = datetime.datetime.fromtimestamp(second)\
+                .strftime('%Y-%m-%d %H:%M:%S %A')
+        ms_list = stamps.tolist()
+        self.db.insert_many(zip(temps.tolist(), hums.tolist(),
+                                [texts[ms // 1000] for ms in ms_list],
+                                ms_list))
+
+        self.produced += due
+        self.batch.emit(hums, temps, stamps)
+        self.progress.emit(self.produced, self.total)
+        if self.produced >= self.total:
+            self.timer.stop()
+
+    @Slot()
+    def start_retention(self):
+        """
+        start_retention begins a retention pass unless one is in progress
+        """
+        if self.db is None or self.expiring:
+            return
+        self.expiring = True
+        if self.retention.archive_dir:
+            self.archive = RowArchive(self.retention.archive_dir)
+        self.expire()
+
+    @Slot()
+    def expire(self):
+        """
+        expire expires one chunk and schedules itself again until nothing
+        is due, then ends the pass and gives the freed space back
+        """
+        if self.db is None:
+            return
+        policy = self.retention
+        if self.db.expire_chunk(policy.max_age_ms, policy.max_rows,
+                                policy.chunk_rows, self.archive):
+            QTimer.singleShot(0, self.expire)
+            return
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        self.expiring = False
+        while self.db.incremental_vacuum(policy.chunk_rows):
+            pass
+
+    @Slot()
+    def close(self):
+        if self.timer is not None:
+            self.timer.stop()
+        if self.retention_timer is not None:
+            self.retention_timer.stop()
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self.db is not None and self.db.conn:
+            self.db.close_db()
+            self.db = None
+
+
+class Acquisition(QObject):
+    """
+    Acquisition owns the acquisition thread and its worker. request() can
+    be called from the GUI thread at any time; the reading arrives later
+    through the `reading` signal
+    """
+
+    read_requested = Signal(str)
+    page_requested = Signal(object, object, int)
+    stream_requested = Signal(float, int)
+    stop_requested = Signal()
+
+    def __init__(self, sensor: pseudoSensor.PseudoSensor, db_name: str,
+                 parent=None, db_class=PseudoSensorDb, retention=None):
+        super().__init__(parent)
+        self.thread = QThread()
+        self.worker = AcquisitionWorker(sensor, db_name, db_class,
+                                        retention)
+        self.worker.moveToThread(self.thread)
+        self.reading = self.worker.reading
+        self.batch = self.worker.batch
+        self.progress = self.worker.progress
+        self.page = self.worker.page
+
+        self.thread.started.connect(self.worker.open)
+        self.thread.finished.connect(self.worker.close)
+        self.read_requested.connect(self.worker.read)
+        self.page_requested.connect(self.worker.read_page)
+        self.stream_requested.connect(self.worker.start_stream)
+        self.stop_requested.connect(self.worker.stop_stream)
+
+    def start(self):
+        self.thread.start()
+
+    def request(self, source):
+        self.read_requested.emit(source)
+
+    @Slot(object, object, int)
+    def request_page(self, tag, after, limit):
+        self.page_requested.emit(tag, after, limit)
+
+    def start_stream(self, rate_hz, count):
+        self.stream_requested.emit(rate_hz, count)
+
+    def stop_stream(self):
+        self.stop_requested.emit()
+
+    def stop(self):
+        """
+        stop ends the thread once the worker is done with the reading it
+        is storing, then closes the worker's connection
+        """
+        if self.thread.isRunning():
+            self.thread.quit()
+            self.thread.wait()
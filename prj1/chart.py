@@ -0,0 +1,225 @@
+"""
+Live temperature/humidity chart
+
+Samples are kept in a RingBuffer: preallocated numpy arrays holding the
+latest `capacity` samples, plus the min and max of every block of
+block_size samples. Drawing reduces the buffer to one min/max pair per
+pixel column and draws a vertical line between them, so the painter's
+work depends on the widget width, not on how many samples are shown. Once
+there are many samples per pixel the columns are built from the block
+summaries, so even the reduction only touches capacity / block_size values
+"""
+
+import numpy as np
+from PySide6.QtCore import QLineF, QPointF, QRectF, Qt
+from PySide6.QtGui import QColor, QPainter, QPen, QPolygonF
+from PySide6.QtWidgets import QSizePolicy, QWidget
+
+
+class RingBuffer:
+    """
+    RingBuffer stores the latest `capacity` samples of `channels` float32
+    channels. capacity is rounded up to a whole number of blocks
+    """
+
+    def __init__(self, capacity, channels=2, block_size=256):
+        self.block_size = block_size
+        self.capacity = -(-capacity // block_size) * block_size
+        self.channels = channels
+        self.data = np.zeros((channels, self.capacity), dtype=np.float32)
+        blocks = self.capacity // block_size
+        self.block_min = np.zeros((channels, blocks), dtype=np.float32)
+        self.block_max = np.zeros((channels, blocks), dtype=np.float32)
+        # Samples ever written; the newest one is at (count - 1) % capacity
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.block_min.nbytes + self.block_max.nbytes
+
+    def extend(self, values):
+        """
+        extend appends a (channels, n) array of samples, overwriting the
+        oldest ones once the buffer is full
+        """
+        values = np.asarray(values, dtype=np.float32)
+        n = values.shape[1]
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.count += n - self.capacity
+            values = values[:, -self.capacity:]
+            n = self.capacity
+
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.write(start, values[:, :first])
+        if first < n:
+            self.write(0, values[:, first:])
+        self.count += n
+
+    def write(self, start, values):
+        end = start + values.shape[1]
+        self.data[:, start:end] = values
+
+        # Recompute every block the write touched
+        size = self.block_size
+        lo = start // size
+        hi = -(-end // size)
+        blocks = self.data[:, lo * size:hi * size].reshape(
+            self.channels, hi - lo, size)
+        self.block_min[:, lo:hi] = blocks.min(axis=2)
+        self.block_max[:, lo:hi] = blocks.max(axis=2)
+
+    def ordered(self):
+        """
+        ordered copies out the buffered samples, oldest first
+
+        Returns:
+        ndarray: (channels, len(self))
+        """
+        if self.count <= self.capacity:
+            return self.data[:, :self.count]
+        start = self.count % self.capacity
+        return np.concatenate(
+            (self.data[:, start:], self.data[:, :start]), axis=1)
+
+    def ordered_blocks(self):
+        """
+        ordered_blocks returns the min and max of every complete block,
+        oldest first, followed by the min and max of the newest, partly
+        written block. Once the buffer has wrapped, the up to
+        block_size - 1 oldest samples that share a block with the newest
+        ones are left out
+
+        Returns:
+        Tuple[ndarray, ndarray]: (channels, blocks) minimums and maximums
+        """
+        size = self.block_size
+        if self.count <= self.capacity:
+            end = self.count
+            order = np.arange(end // size)
+        else:
+            end = self.count % self.capacity
+            blocks = self.capacity // size
+            current = end // size
+            # The block being written holds the newest samples followed by
+            # the oldest ones; only its newest part is used, below
+            first = current + 1 if end % size else current
+            order = np.arange(first, current + blocks) % blocks
+        mins = self.block_min[:, order]
+        maxs = self.block_max[:, order]
+
+        tail = self.data[:, end // size * size:end]
+        if tail.shape[1]:
+            mins = np.concatenate((mins, tail.min(axis=1, keepdims=True)),
+                                  axis=1)
+            maxs = np.concatenate((maxs, tail.max(axis=1, keepdims=True)),
+                                  axis=1)
+        return mins, maxs
+
+    def decimate(self, columns):
+        """
+        decimate reduces the buffer to at most `columns` min/max pairs per
+        channel, oldest first. With fewer samples than columns every sample
+        is its own pair
+
+        Returns:
+        Tuple[ndarray, ndarray]: (channels, k) minimums and maximums
+        """
+        if len(self) >= 2 * self.block_size * columns:
+            mins, maxs = self.ordered_blocks()
+        else:
+            mins = maxs = self.ordered()
+
+        n = mins.shape[1]
+        if n <= columns:
+            return mins, maxs
+        edges = np.linspace(0, n, columns + 1).astype(np.intp)[:-1]
+        return (np.minimum.reduceat(mins, edges, axis=1),
+                np.maximum.reduceat(maxs, edges, axis=1))
+
+
+class ChartWidget(QWidget):
+    """
+    ChartWidget plots the buffered temperature and humidity samples as two
+    stacked min/max bands, newest on the right
+    """
+
+    # name, low and high end of the axis, color
+    series = (
+        ("Temperature (degC)", -20, 120, QColor(200, 60, 40)),
+        ("Humidity (%)", 0, 100, QColor(40, 90, 200)),
+    )
+
+    def __init__(self, capacity=2**22):
+        super().__init__()
+        self.buffer = RingBuffer(capacity, channels=len(self.series))
+        self.dirty = False
+        self.setMinimumHeight(200)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+    def add_samples(self, temps, hums):
+        self.buffer.extend(np.vstack((temps, hums)))
+        self.dirty = True
+
+    def refresh(self):
+        if self.dirty:
+            self.dirty = False
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        margin = 4
+        label_height = self.fontMetrics().height()
+        width = self.width() - 2 * margin
+        if width <= 0 or not len(self.buffer):
+            painter.drawText(self.rect(), Qt.AlignCenter, "No readings yet")
+            return
+
+        mins, maxs = self.buffer.decimate(width)
+        columns = mins.shape[1]
+        # Sparse data is spread over the width; dense data is one column
+        # per pixel
+        step = width / max(columns - 1, 1) if columns < width else 1.0
+        xs = margin + np.arange(columns) * step
+
+        plot_height = self.height() / len(self.series)
+        for i, (name, low, high, color) in enumerate(self.series):
+            top = i * plot_height + label_height
+            height = plot_height - label_height - margin
+            scale = height / (high - low)
+            upper = top + (high - np.clip(maxs[i], low, high)) * scale
+            lower = top + (high - np.clip(mins[i], low, high)) * scale
+
+            painter.setPen(QPen(Qt.lightGray))
+            painter.drawRect(QRectF(margin, top, width, height))
+            painter.setPen(QPen(Qt.black))
+            painter.drawText(QPointF(margin, top - 2),
+                             f'{name}  {low} to {high}, '
+                             f'latest {self.latest(i):.2f}')
+
+            painter.setPen(QPen(color, 1))
+            if columns < width:
+                # Every sample is its own column, so min == max
+                painter.drawPolyline(QPolygonF(
+                    [QPointF(x, y)
+                     for x, y in zip(xs.tolist(), upper.tolist())]))
+                continue
+
+            # One vertical line per pixel from max to min, stretched to
+            # meet the previous column so the trace has no gaps
+            top_ends = np.minimum(upper, np.roll(lower, 1))
+            bottom_ends = np.maximum(lower, np.roll(upper, 1))
+            top_ends[0], bottom_ends[0] = upper[0], lower[0]
+            painter.drawLines([
+                QLineF(x, y0, x, y1) for x, y0, y1 in
+                zip(xs.tolist(), top_ends.tolist(), bottom_ends.tolist())])
+
+    def latest(self, channel):
+        return float(self.buffer.data[
+            channel, (self.buffer.count - 1) % self.buffer.capacity])
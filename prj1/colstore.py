@@ -0,0 +1,624 @@
+"""
+Append-only, memory-mapped columnar storage for sensor readings
+
+ColumnStoreDb has the same interface as PseudoSensorDb, so either one can
+back the applications, but it keeps the readings in a directory instead of
+a sqlite file:
+
+    meta.json            format version and rows per segment
+    index                one fixed-width record per segment: row count,
+                         first/last timestamp, whether the timestamps are in
+                         order, and min/max/sum of both channels
+    000000.timestamp_ms  int64 epoch milliseconds   \\
+    000000.temperature   float64 degC                > one file per column
+    000000.humidity      float64 %                  /  per segment
+
+Segments are preallocated to segment_rows rows and filled in order, and
+every file is memory-mapped, so appending a batch is three slice
+assignments plus an index update, with no per-row work. A reading's id is
+its position in the store plus one.
+
+The index is also how other connections, in this process or another one,
+see new rows: they read the row counts from their own mapping of it and map
+new segment files as they appear.
+
+range_columns and latest_columns return the columns as NumPy views of the
+mapped files, with no copy, as long as the timestamps were appended in
+order. Readings appended out of order are still stored and found, but those
+reads are gathered and sorted into new arrays. Statistics use the
+per-segment summaries for segments that lie wholly inside the range, so
+only the segments at either end are scanned.
+
+Expiring readings drops whole segments, oldest first: the record's row
+count goes to zero and the files are deleted. Ids and positions of the
+remaining readings do not change
+"""
+
+import datetime
+import json
+import math
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from db import parse_datetime, to_epoch_ms
+
+FORMAT_VERSION = 1
+
+COLUMNS = (("timestamp_ms", "<i8"), ("temperature", "<f8"),
+           ("humidity", "<f8"))
+
+INDEX = np.dtype([
+    ("rows", "<i8"), ("ts_min", "<i8"), ("ts_max", "<i8"), ("sorted", "<i8"),
+    ("temp_min", "<f8"), ("temp_max", "<f8"), ("temp_sum", "<f8"),
+    ("hum_min", "<f8"), ("hum_max", "<f8"), ("hum_sum", "<f8"),
+])
+
+
+class Columns(namedtuple(
+        "Columns", ["timestamp_ms", "temperature", "humidity", "first_id",
+                    "id_array"], defaults=(None,))):
+    """
+    Columns holds matching slices of the timestamp, temperature and humidity
+    columns. A reading's id is its 1-based position in the store; a
+    contiguous slice only records the id of its first row, and `ids`
+    numbers the rest on demand
+    """
+
+    @property
+    def ids(self):
+        if self.id_array is not None:
+            return self.id_array
+        return np.arange(self.first_id,
+                         self.first_id + len(self.timestamp_ms))
+
+
+def concat_columns(chunks):
+    """
+    concat_columns joins the chunks returned by range_columns or
+    latest_columns into one Columns. This copies, unless there is only one
+    chunk
+
+    Returns:
+    Columns
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return Columns(np.empty(0, np.int64), np.empty(0), np.empty(0), 1)
+    return Columns(*(np.concatenate([chunk[i] for chunk in chunks])
+                     for i in range(3)), chunks[0].first_id,
+                   np.concatenate([chunk.ids for chunk in chunks]))
+
+
+class ColumnStoreDb:
+
+    datetime_format = "%Y-%m-%d %H:%M:%S %A"
+
+    def __init__(self, db_name="prj1_db.cols", segment_rows=2**20):
+        self.db_name = db_name
+        self.segment_rows = segment_rows
+        self.writable = False
+        self.index = None
+        self.index_size = 0
+        # Segment number -> its mapped (timestamp, temperature, humidity)
+        # files
+        self.segments = {}
+
+        # Rows given as datetime text arrive in bursts with the same text
+        self.last_dt = None
+        self.last_ms = None
+        # Id of the last reading expire_chunk has archived
+        self.archived_id = 0
+
+    @property
+    def conn(self):
+        # Open or closed, like PseudoSensorDb.conn, which callers check
+        return self if self.index is not None else None
+
+    def path(self, name):
+        return os.path.join(self.db_name, name)
+
+    def create_connection(self, wal=False, check_same_thread=True):
+        """
+        create_connection opens the store if it exists. Readers may open
+        it before the writer has created it; they see it once it is there.
+        Every connection can read while another one writes, and any thread
+        may use it, so `wal` and `check_same_thread` are accepted only for
+        compatibility with PseudoSensorDb
+        """
+        self.index = np.zeros(0, dtype=INDEX)
+        self.index_size = 0
+        self.segments = {}
+        self.refresh()
+
+    def create_sensor_table(self):
+        """
+        create_sensor_table creates the store on first use
+        """
+        os.makedirs(self.db_name, exist_ok=True)
+        meta_path = self.path("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["version"] != FORMAT_VERSION:
+                raise ValueError(
+                    f"unsupported column store version {meta['version']}")
+        else:
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump({"version": FORMAT_VERSION,
+                           "segment_rows": self.segment_rows}, f)
+            os.replace(meta_path + ".tmp", meta_path)
+            open(self.path("index"), "ab").close()
+        self.refresh()
+
+    def open_for_writing(self):
+        """
+        open_for_writing maps the store read-write. A connection does this
+        on its first insert; there should be only one writer at a time
+        """
+        self.writable = True
+        self.index_size = -1
+        self.segments = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        refresh maps the index again if segments were added since it was
+        last mapped
+        """
+        try:
+            size = os.path.getsize(self.path("index"))
+        except FileNotFoundError:
+            return
+        if size == self.index_size:
+            return
+        with open(self.path("meta.json")) as f:
+            self.segment_rows = json.load(f)["segment_rows"]
+        count = size // INDEX.itemsize
+        if count:
+            # Plain ndarray views of the mapping; memmap indexing is slow
+            self.index = np.memmap(self.path("index"), dtype=INDEX,
+                                   mode="r+" if self.writable else "r",
+                                   shape=(count,)).view(np.ndarray)
+        else:
+            self.index = np.zeros(0, dtype=INDEX)
+        self.index_size = size
+
+    def ordered(self):
+        """
+        ordered checks that every segment is sorted and starts where the
+        one before it ended, i.e. that the whole store is in timestamp order
+        """
+        index = self.index[self.index["rows"] > 0]
+        return bool(index["sorted"].all()
+                    and (index["ts_min"][1:] >= index["ts_max"][:-1]).all())
+
+    def segment(self, number, start=0, stop=None):
+        """
+        segment returns rows [start, stop) of one segment, by default all of
+        its readings, mapping its files on first use
+
+        Returns:
+        Columns: views of the mapped files, and the matching ids
+        """
+        files = self.segments.get(number)
+        if files is None:
+            files = tuple(
+                np.memmap(self.path(f"{number:06d}.{name}"), dtype=dtype,
+                          mode="r+" if self.writable else "r",
+                          shape=(self.segment_rows,)).view(np.ndarray)
+                for name, dtype in COLUMNS)
+            self.segments[number] = files
+        if stop is None:
+            stop = int(self.index[number]["rows"])
+        return Columns(*(column[start:stop] for column in files),
+                       number * self.segment_rows + start + 1)
+
+    def add_segment(self):
+        number = len(self.index)
+        for name, dtype in COLUMNS:
+            # Created sparse; the disk fills in as rows are written
+            with open(self.path(f"{number:06d}.{name}"), "wb") as f:
+                f.truncate(self.segment_rows * np.dtype(dtype).itemsize)
+        record = np.zeros(1, dtype=INDEX)
+        record["sorted"] = 1
+        # Appending the record is what makes the segment visible
+        with open(self.path("index"), "ab") as f:
+            f.write(record.tobytes())
+        self.refresh()
+
+    def close_db(self):
+        self.flush()
+        self.index = None
+        self.segments = {}
+
+    def timestamp_ms(self, dt):
+        if dt != self.last_dt:
+            self.last_ms = int(parse_datetime(dt) * 1000)
+            self.last_dt = dt
+        return self.last_ms
+
+    def insert_data(self, data):
+        """
+        insert_data stores a single (temperature, humidity, datetime) row.
+        An epoch-millisecond timestamp may be passed as a fourth value;
+        otherwise it is derived from the datetime text
+
+        Returns:
+        int: the id of the inserted row
+        """
+        temp, hum, dt = data[:3]
+        ms = data[3] if len(data) > 3 else self.timestamp_ms(dt)
+        self.append([ms], [temp], [hum])
+        return self.total_rows()
+
+    def insert_many(self, rows):
+        """
+        insert_many stores a sequence of (temperature, humidity, datetime)
+        rows, optionally with timestamp_ms as a fourth value
+
+        Returns:
+        int: the number of rows inserted
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        if all(len(row) > 3 for row in rows):
+            temps, hums, _, stamps = list(zip(*rows))[:4]
+        else:
+            temps = [row[0] for row in rows]
+            hums = [row[1] for row in rows]
+            stamps = [row[3] if len(row) > 3 else self.timestamp_ms(row[2])
+                      for row in rows]
+        return self.append(stamps, temps, hums)
+
+    def append(self, stamps, temps, hums):
+        """
+        append stores parallel timestamp, temperature and humidity arrays,
+        filling the last segment and adding new ones as needed
+
+        Returns:
+        int: the number of rows appended
+        """
+        if not self.writable:
+            self.open_for_writing()
+        stamps = np.asarray(stamps, dtype=np.int64)
+        temps = np.asarray(temps, dtype=np.float64)
+        hums = np.asarray(hums, dtype=np.float64)
+        done = 0
+        while done < len(stamps):
+            if not len(self.index) or \
+                    self.index[-1]["rows"] >= self.segment_rows:
+                self.add_segment()
+            number = len(self.index) - 1
+            record = self.index[number].item()
+            rows = record[0]
+            take = min(len(stamps) - done, self.segment_rows - rows)
+            part = slice(done, done + take)
+            columns = self.segment(number, rows, rows + take)
+            columns.timestamp_ms[:] = stamps[part]
+            columns.temperature[:] = temps[part]
+            columns.humidity[:] = hums[part]
+            self.index[number] = self.summarize(
+                record, stamps[part], temps[part], hums[part])
+            # Written last, so readers never count rows that are not there
+            self.index[number]["rows"] = rows + take
+            done += take
+        return done
+
+    def summarize(self, record, stamps, temps, hums):
+        """
+        summarize folds newly appended values into a segment's index record
+
+        Returns:
+        tuple: the new record, with the row count not yet updated
+        """
+        (rows, ts_min, ts_max, in_order, temp_min, temp_max, temp_sum,
+         hum_min, hum_max, hum_sum) = record
+        first = int(stamps[0])
+        if len(stamps) > 1:
+            in_order = in_order and bool((stamps[1:] >= stamps[:-1]).all())
+        if rows:
+            in_order = in_order and first >= ts_max
+            return (rows, min(ts_min, int(stamps.min())),
+                    max(ts_max, int(stamps.max())), int(in_order),
+                    min(temp_min, float(temps.min())),
+                    max(temp_max, float(temps.max())),
+                    temp_sum + float(temps.sum()),
+                    min(hum_min, float(hums.min())),
+                    max(hum_max, float(hums.max())),
+                    hum_sum + float(hums.sum()))
+        return (0, int(stamps.min()), int(stamps.max()), int(in_order),
+                float(temps.min()), float(temps.max()), float(temps.sum()),
+                float(hums.min()), float(hums.max()), float(hums.sum()))
+
+    def flush(self):
+        # Every write goes straight to the mapped files
+        return 0
+
+    def expire_chunk(self, max_age_ms=None, max_rows=None, limit=1000,
+                     archive=None):
+        """
+        expire_chunk is PseudoSensorDb.expire_chunk for whole segments: the
+        oldest segment is dropped once all of its readings are older than
+        max_age_ms or beyond the newest max_rows. The segment being written
+        is never dropped, so up to segment_rows more readings are kept. With
+        an archive, each call archives `limit` more of the segment's
+        readings and the call after the last of them drops it
+
+        Returns:
+        int: the number of readings archived or dropped
+        """
+        if not self.writable:
+            self.open_for_writing()
+        used = np.flatnonzero(self.index["rows"][:-1])
+        if not len(used):
+            return 0
+        number = int(used[0])
+        rows = int(self.index[number]["rows"])
+        first_id = number * self.segment_rows + 1
+        last_id = first_id + rows - 1
+        expired = max_age_ms is not None and \
+            self.index[number]["ts_max"] < time.time() * 1000 - max_age_ms
+        expired = expired or max_rows is not None and \
+            last_id <= self.total_rows() - max_rows
+        if not expired:
+            return 0
+
+        done = max(self.archived_id, first_id - 1) - first_id + 1
+        if archive is not None and done < rows:
+            chunk = self.segment(number, done, min(rows, done + limit))
+            archive.write(self.to_rows([chunk]))
+            self.archived_id = first_id + done + len(chunk.timestamp_ms) - 1
+            return len(chunk.timestamp_ms)
+
+        # Zeroing the record first means readers stop looking for the files
+        self.index[number] = np.zeros(1, dtype=INDEX)[0]
+        self.segments.pop(number, None)
+        for name, _ in COLUMNS:
+            os.remove(self.path(f"{number:06d}.{name}"))
+        return rows
+
+    def incremental_vacuum(self, pages=1000):
+        # Dropped segments give their files back at once
+        return 0
+
+    def total_rows(self):
+        if not self.writable:
+            self.refresh()
+        if not len(self.index):
+            return 0
+        return (len(self.index) - 1) * self.segment_rows \
+            + int(self.index[-1]["rows"])
+
+    def slice_rows(self, lo, hi):
+        """
+        slice_rows returns rows at positions [lo, hi) as one view per
+        segment they span
+
+        Returns:
+        List[Columns]
+        """
+        chunks = []
+        while lo < hi:
+            number, start = divmod(lo, self.segment_rows)
+            stop = min(self.segment_rows, start + hi - lo)
+            # Expired segments have no rows left
+            if self.index[number]["rows"]:
+                chunks.append(self.segment(number, start, stop))
+            lo += stop - start
+        return chunks
+
+    def search(self, ms):
+        """
+        search finds the position of the first row with timestamp >= ms,
+        for an ordered store
+
+        Returns:
+        int
+        """
+        # Empty segments were expired, or the last one was just added
+        used = np.flatnonzero(self.index["rows"])
+        k = int(np.searchsorted(self.index["ts_max"][used], ms, "left"))
+        if k >= len(used):
+            return self.total_rows()
+        number = int(used[k])
+        timestamps = self.segment(number).timestamp_ms
+        return number * self.segment_rows + int(
+            np.searchsorted(timestamps, ms, "left"))
+
+    def latest_columns(self, n):
+        """
+        latest_columns returns the latest n rows, oldest first, as views
+
+        Returns:
+        List[Columns]
+        """
+        total = self.total_rows()
+        return self.slice_rows(max(0, total - n), total)
+
+    def range_columns(self, start, end, after=None, limit=None):
+        """
+        range_columns returns the rows with start <= timestamp < end,
+        ordered by (timestamp_ms, id), that come after the (timestamp_ms,
+        id) key `after`, at most `limit` of them. They are views of the
+        store when it is ordered
+
+        Returns:
+        List[Columns]
+        """
+        start = to_epoch_ms(start)
+        end = to_epoch_ms(end)
+        self.refresh()
+        if not self.ordered():
+            return self.gather_range(start, end, after, limit)
+
+        lo = self.search(start)
+        if after is not None:
+            lo = max(lo, after[1])
+        hi = self.search(end)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return self.slice_rows(lo, hi)
+
+    def gather_range(self, start, end, after, limit):
+        """
+        gather_range is range_columns for a store with readings appended
+        out of order: matching rows are copied out of every segment that
+        may hold some and sorted
+
+        Returns:
+        List[Columns]
+        """
+        if after is not None:
+            start = max(start, after[0])
+        chunks = []
+        for number, record in enumerate(self.index):
+            rows = record["rows"]
+            if not rows or record["ts_max"] < start \
+                    or record["ts_min"] >= end:
+                continue
+            segment = self.segment(number)
+            mask = (segment.timestamp_ms >= start) \
+                & (segment.timestamp_ms < end)
+            if after is not None:
+                mask &= (segment.timestamp_ms > after[0]) \
+                    | (segment.ids > after[1])
+            chunks.append(Columns(segment.timestamp_ms[mask],
+                                  segment.temperature[mask],
+                                  segment.humidity[mask], segment.first_id,
+                                  segment.ids[mask]))
+
+        found = concat_columns(chunks)
+        order = np.lexsort((found.ids, found.timestamp_ms))[:limit]
+        return [Columns(found.timestamp_ms[order], found.temperature[order],
+                        found.humidity[order], found.first_id,
+                        found.ids[order])]
+
+    def to_rows(self, chunks):
+        """
+        to_rows turns column chunks into PseudoSensorDb row tuples,
+        formatting the datetime text once per second
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        columns = concat_columns(chunks)
+        stamps = columns.timestamp_ms.tolist()
+        texts = {}
+        for second in np.unique(columns.timestamp_ms // 1000).tolist():
+            texts[second] = datetime.datetime.fromtimestamp(second)\
+                .strftime(self.datetime_format)
+        return list(zip(columns.ids.tolist(), columns.temperature.tolist(),
+                        columns.humidity.tolist(),
+                        [texts[ms // 1000] for ms in stamps], stamps))
+
+    def get_latest_10(self):
+        """
+        get_latest_10 generates a list of rows (tuples) from the latest
+        ten readings (ordered by id)
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        return self.get_latest(10)
+
+    def get_latest(self, n):
+        """
+        get_latest generates a list of rows (tuples) from the latest
+        n readings (ordered by id, newest first)
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        return self.to_rows(self.latest_columns(n))[::-1]
+
+    def get_range(self, start, end, limit=None):
+        """
+        get_range generates a list of rows with start <= timestamp < end,
+        oldest first
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        return self.to_rows(self.range_columns(start, end, limit=limit))
+
+    def get_page(self, start, end, after=None, limit=1000):
+        """
+        get_page generates one page of rows with start <= timestamp < end,
+        oldest first, that come after the (timestamp_ms, id) key `after`
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        return self.to_rows(self.range_columns(start, end, after, limit))
+
+    def iter_range(self, start, end, batch_size=1000):
+        """
+        iter_range streams the rows with start <= timestamp < end, oldest
+        first, batch_size rows at a time
+
+        Yields:
+        Tuple[int,float,float,str,int]
+        """
+        after = None
+        while True:
+            rows = self.get_page(start, end, after, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][4], rows[-1][0])
+
+    def get_stats(self, start, end):
+        """
+        get_stats computes the min, max and average temperature and humidity
+        of the readings with start <= datetime < end, resolved to the
+        second like PseudoSensorDb.get_stats
+
+        Segments wholly inside the range are read from the index; only the
+        segments overlapping its ends are scanned
+
+        Returns:
+        List[Tuple[float, float, float]]: [(min, max, avg) of temperature,
+        (min, max, avg) of humidity], or None if there are no readings
+        """
+        lo = math.floor(to_epoch_ms(start) / 1000) * 1000
+        hi = math.floor(to_epoch_ms(end) / 1000) * 1000
+        self.refresh()
+
+        parts = []
+        for number, record in enumerate(self.index):
+            rows = record["rows"]
+            if not rows or record["ts_max"] < lo or record["ts_min"] >= hi:
+                continue
+            if record["ts_min"] >= lo and record["ts_max"] < hi:
+                parts.append((record["temp_min"], record["temp_max"],
+                              record["temp_sum"], record["hum_min"],
+                              record["hum_max"], record["hum_sum"], rows))
+                continue
+
+            segment = self.segment(number)
+            stamps = segment.timestamp_ms
+            if record["sorted"]:
+                part = slice(np.searchsorted(stamps, lo, "left"),
+                             np.searchsorted(stamps, hi, "left"))
+            else:
+                part = (stamps >= lo) & (stamps < hi)
+            temps = segment.temperature[part]
+            hums = segment.humidity[part]
+            if len(temps):
+                parts.append((temps.min(), temps.max(), temps.sum(),
+                              hums.min(), hums.max(), hums.sum(),
+                              len(temps)))
+
+        if not parts:
+            return None
+        parts = np.array(parts)
+        count = parts[:, 6].sum()
+        return [(float(parts[:, 0].min()), float(parts[:, 1].max()),
+                 float(parts[:, 2].sum() / count)),
+                (float(parts[:, 3].min()), float(parts[:, 4].max()),
+                 float(parts[:, 5].sum() / count))]
@@ -0,0 +1,190 @@
+"""
+Headless acquisition daemon
+
+Run from the prj1 directory:
+
+    python daemon.py --rate 1000 --duration 60 --db prj1_db.db --batch-size 100
+
+Generates readings with the pseudo sensor and stores them batch_size at a
+time, without the GUI. Only the sensor and database modules are imported,
+not PySide6, so it starts quickly and needs no display, which suits
+servers and containers. Batches fall due on a fixed schedule from the
+start, so a slow commit is made up by the following batches instead of
+slowing the rate down.
+
+It runs for --duration seconds (forever if 0), or until SIGINT or SIGTERM,
+and prints JSON lines: one once it is ready to store readings, with the
+startup time including the imports, one every --report seconds, and a
+summary with the achieved throughput when it stops
+"""
+
+import time
+
+# Taken before the other imports, so the reported startup includes them
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import datetime  # noqa: E402
+import json  # noqa: E402
+import signal  # noqa: E402
+
+import pseudoSensor  # noqa: E402
+from colstore import ColumnStoreDb  # noqa: E402
+from db import PseudoSensorDb  # noqa: E402
+
+# Storage backends with the PseudoSensorDb interface, for --storage
+STORAGE = {"sqlite": PseudoSensorDb, "columnar": ColumnStoreDb}
+
+
+def on_sigterm(signum, frame):
+    # Stops the loop the same way Ctrl-C does
+    raise KeyboardInterrupt
+
+
+def store_batch(sensor_db, hums, temps, stamps):
+    """
+    store_batch stores one batch in one transaction. Readings in the same
+    second share their datetime text
+    """
+    texts = {}
+    ms_list = stamps.tolist()
+    for ms in ms_list:
+        second = ms // 1000
+        if second not in texts:
+            texts[second] = datetime.datetime.fromtimestamp(second)\
+                .strftime('%Y-%m-%d %H:%M:%S %A')
+    sensor_db.insert_many(zip(temps.tolist(), hums.tolist(),
+                              [texts[ms // 1000] for ms in ms_list],
+                              ms_list))
+
+
+class Daemon:
+    """
+    Daemon stores readings at rate_hz, batch_size at a time, for
+    duration_s seconds (None for no limit). A rate of 0 stores them as
+    fast as possible
+    """
+
+    def __init__(self, sensor_db, rate_hz, duration_s, batch_size):
+        self.sensor = pseudoSensor.PseudoSensor()
+        self.sensor_db = sensor_db
+        self.rate_hz = rate_hz
+        self.duration_s = duration_s
+        self.batch_size = batch_size
+        self.produced = 0
+        self.batches = 0
+        self.started = 0.0
+        # Furthest a batch was stored behind its schedule, seconds
+        self.max_lag = 0.0
+
+    def total(self):
+        # Flat out, the duration is checked against the clock instead
+        if self.duration_s is None or not self.rate_hz:
+            return None
+        return int(self.duration_s * self.rate_hz)
+
+    def run(self, report_s=10):
+        self.started = time.monotonic()
+        start_ms = time.time() * 1000
+        period_ms = 1000 / self.rate_hz if self.rate_hz else 0
+        total = self.total()
+        next_report = self.started + report_s
+        while total is None or self.produced < total:
+            now = time.monotonic()
+            if not self.rate_hz and self.duration_s is not None \
+                    and now - self.started >= self.duration_s:
+                break
+            n = self.batch_size
+            if total is not None:
+                n = min(n, total - self.produced)
+
+            stopping = False
+            if self.rate_hz:
+                # The batch is due once its last reading is
+                due = self.started + (self.produced + n - 1) / self.rate_hz
+                if due > now:
+                    try:
+                        time.sleep(due - now)
+                    except KeyboardInterrupt:
+                        # Store the readings that are due before stopping
+                        stopping = True
+                        elapsed = time.monotonic() - self.started
+                        n = min(n, int(elapsed * self.rate_hz) + 1
+                                - self.produced)
+                else:
+                    self.max_lag = max(self.max_lag, now - due)
+                hums, temps, stamps = self.sensor.generate_batch(
+                    n, start_ms=int(start_ms + self.produced * period_ms),
+                    period_ms=period_ms)
+            else:
+                hums, temps, stamps = self.sensor.generate_batch(n)
+            if n > 0:
+                store_batch(self.sensor_db, hums, temps, stamps)
+                self.produced += n
+                self.batches += 1
+            if stopping:
+                return
+
+            if report_s and time.monotonic() >= next_report:
+                next_report += report_s
+                self.report("progress")
+
+    def report(self, event, **extra):
+        elapsed = time.monotonic() - self.started
+        print(json.dumps({
+            "event": event,
+            "readings": self.produced,
+            "batches": self.batches,
+            "elapsed_s": round(elapsed, 3),
+            "rate_hz": round(self.produced / elapsed, 1) if elapsed else 0.0,
+            "target_hz": self.rate_hz,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            **extra,
+        }), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="readings per second; 0 for as fast as "
+                        "possible")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="seconds to run; 0 runs until stopped")
+    parser.add_argument("--db", default=None,
+                        help="database file, or directory for columnar "
+                        "storage (default prj1_db.db or prj1_db.cols)")
+    parser.add_argument("--storage", choices=sorted(STORAGE),
+                        default="sqlite")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="readings stored per transaction")
+    parser.add_argument("--report", type=float, default=10,
+                        help="seconds between progress lines; 0 for none")
+    args = parser.parse_args(argv)
+    if args.rate < 0 or args.batch_size < 1:
+        parser.error("--rate must not be negative and --batch-size must "
+                     "be at least 1")
+
+    db_class = STORAGE[args.storage]
+    sensor_db = db_class(args.db) if args.db else db_class()
+    sensor_db.create_connection(wal=True)
+    sensor_db.create_sensor_table()
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    daemon = Daemon(sensor_db, args.rate, args.duration or None,
+                    args.batch_size)
+    print(json.dumps({
+        "event": "ready", "db": sensor_db.db_name, "storage": args.storage,
+        "startup_ms": round((time.perf_counter() - STARTED) * 1000, 1),
+    }), flush=True)
+    try:
+        daemon.run(args.report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sensor_db.close_db()
+    daemon.report("stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,146 @@
+import csv
+import datetime
+import gzip
+import math
+import os
+import pathlib
 import sqlite3
+import time
 from sqlite3 import Error
 
+# Version 1 stored only the free-form datetime text. Version 2 adds the
+# indexed epoch-millisecond timestamp_ms column
+SCHEMA_VERSION = 2
+
+# Rollup tables, finest first. Each bucket holds min/max/sum/count of the
+# readings whose epoch-second timestamp falls in [bucket, bucket + size)
+ROLLUP_LEVELS = (("minute", 60), ("hour", 3600), ("day", 86400))
+
+
+def parse_datetime(text):
+    """
+    parse_datetime turns a stored datetime string into epoch seconds. Both
+    the ISO form and the 'yyyy-MM-dd hh:mm:ss dddd' form start with the
+    date and time, so only the first 19 characters are read
+    """
+    return datetime.datetime.strptime(
+        text[:19].replace("T", " "), "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def to_epoch_ms(value):
+    """
+    to_epoch_ms accepts epoch milliseconds or a datetime.datetime (naive
+    ones are local time) and returns epoch milliseconds
+    """
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+class RetentionPolicy:
+    """
+    RetentionPolicy says which readings to expire: those older than
+    max_age_ms, and all but the newest max_rows; either may be None. Every
+    interval_s a pass removes them chunk_rows at a time, first appending
+    them to a gzip-compressed CSV file in archive_dir if it is set
+    """
+
+    def __init__(self, max_age_ms=None, max_rows=None, interval_s=60,
+                 chunk_rows=1000, archive_dir=None):
+        self.max_age_ms = max_age_ms
+        self.max_rows = max_rows
+        self.interval_s = interval_s
+        self.chunk_rows = chunk_rows
+        self.archive_dir = archive_dir
+
+
+class RowArchive:
+    """
+    RowArchive appends rows to a gzip-compressed CSV file in `directory`,
+    named after the time the archive was created. The file is only created
+    once there is a row to write
+    """
+
+    columns = ("id", "temperature_degC", "humidity_pcent", "datetime",
+               "timestamp_ms")
+
+    def __init__(self, directory, prefix="sensor_data"):
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"{prefix}-{stamp}.csv.gz")
+        self.file = None
+        self.writer = None
+        self.rows = 0
+
+    def write(self, rows):
+        """
+        write appends the rows and flushes them, so they are in the file
+        before the caller deletes them from the database
+        """
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            is_new = not os.path.exists(self.path)
+            self.file = gzip.open(self.path, "at", newline="")
+            self.writer = csv.writer(self.file)
+            if is_new:
+                self.writer.writerow(self.columns)
+        self.writer.writerows(rows)
+        self.file.flush()
+        self.rows += len(rows)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
 
 class PseudoSensorDb:
 
-    def __init__(self, db_name="prj1_db.db"):
+    datetime_format = "%Y-%m-%d %H:%M:%S %A"
+
+    def __init__(self, db_name="prj1_db.db", buffer_rows=0, buffer_ms=0):
         self.conn = None
         self.db_name = db_name
         self.table_name = "sensor_data"
 
-    def create_connection(self):
+        # Write-behind buffering is off unless buffer_rows or buffer_ms is
+        # set. When on, insert_data queues rows and they are written in one
+        # transaction once buffer_rows rows are queued or the oldest queued
+        # row is buffer_ms old. insert_data only sees the age when a row
+        # arrives, so whoever owns the connection calls flush_if_due on a
+        # timer to hold buffer_ms after the last insert of a burst
+        self.buffer_rows = buffer_rows
+        self.buffer_ms = buffer_ms
+        self.pending = []
+        self.pending_since = 0.0
+
+        # Readings arrive in bursts with the same datetime text, so keep
+        # the last parse around
+        self.last_dt = None
+        self.last_ms = None
+
+    def create_connection(self, wal=False, read_only=False,
+                          check_same_thread=True):
+        """
+        create_connection opens the database. With `wal` it is put in WAL
+        mode, so other connections can read while this one commits. With
+        `read_only` the file is opened read-only, and is not created if it
+        does not exist. check_same_thread is passed on to sqlite3.connect
+        """
         self.conn = None
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            if read_only:
+                uri = pathlib.Path(self.db_name).absolute().as_uri()
+                self.conn = sqlite3.connect(
+                    f"{uri}?mode=ro", uri=True,
+                    check_same_thread=check_same_thread)
+                return
+            self.conn = sqlite3.connect(
+                self.db_name, check_same_thread=check_same_thread)
+            # Only takes effect on a new database, before anything else
+            # writes to it; see incremental_vacuum
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if wal:
+                self.conn.execute("PRAGMA journal_mode=WAL")
         except Error as e:
             print(e)
 
@@ -23,29 +151,403 @@ class PseudoSensorDb:
             id integer PRIMARY KEY,
             temperature_degC float,
             humidity_pcent float,
-            datetime text
+            datetime text,
+            timestamp_ms integer
         );
         """.format(table=self.table_name)
         try:
             curs = self.conn.cursor()
             curs.execute(create_table_sql)
+            self.migrate()
+            curs.execute(f"""
+            CREATE INDEX IF NOT EXISTS {self.table_name}_timestamp_ms
+            ON {self.table_name}(timestamp_ms);
+            """)
+            self.create_rollup_tables()
         except Error as e:
             print(e)
 
+    def migrate(self, chunk_size=10000):
+        """
+        migrate brings a database written by an older version up to
+        SCHEMA_VERSION in place
+
+        Version 1 to 2 adds timestamp_ms and fills it from the datetime
+        text, a chunk of rows per transaction so other connections are not
+        locked out for long. An interrupted migration resumes where it left
+        off, since only rows without a timestamp are visited
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        columns = [row[1] for row in self.conn.execute(
+            f"PRAGMA table_info({self.table_name})")]
+        if "timestamp_ms" not in columns:
+            self.conn.execute(f"""
+            ALTER TABLE {self.table_name} ADD COLUMN timestamp_ms integer
+            """)
+            self.conn.commit()
+
+        last_id = -1
+        while True:
+            rows = self.conn.execute(f"""
+            SELECT id, datetime FROM {self.table_name}
+            WHERE id > ? AND timestamp_ms IS NULL ORDER BY id LIMIT ?
+            """, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            with self.conn:
+                self.conn.executemany(f"""
+                UPDATE {self.table_name} SET timestamp_ms=? WHERE id=?
+                """, [(self.timestamp_ms(dt), row_id) for row_id, dt in rows])
+
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def timestamp_ms(self, dt):
+        """
+        timestamp_ms converts stored datetime text to epoch milliseconds,
+        or None if the text cannot be parsed
+        """
+        if dt != self.last_dt:
+            try:
+                self.last_ms = int(parse_datetime(dt) * 1000)
+            except (TypeError, ValueError):
+                self.last_ms = None
+            self.last_dt = dt
+        return self.last_ms
+
+    def normalize_row(self, row):
+        """
+        normalize_row fills in timestamp_ms for a (temperature, humidity,
+        datetime) row. Rows that already carry it as a fourth value are
+        passed through
+        """
+        if len(row) > 3:
+            return tuple(row[:4])
+        return (row[0], row[1], row[2], self.timestamp_ms(row[2]))
+
+    def create_rollup_tables(self):
+        """
+        create_rollup_tables creates the per-minute, per-hour and per-day
+        rollup tables. If they are new and readings already exist, they are
+        filled in from the existing rows
+        """
+        is_new = False
+        for level, _ in ROLLUP_LEVELS:
+            table = f"{self.table_name}_{level}"
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                (table,)).fetchone()
+            is_new = is_new or exists is None
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}
+            (
+                bucket integer PRIMARY KEY,
+                temp_min float,
+                temp_max float,
+                temp_sum float,
+                hum_min float,
+                hum_max float,
+                hum_sum float,
+                count integer
+            );
+            """)
+        self.conn.commit()
+        if is_new:
+            self.rebuild_rollups()
+
+    def rebuild_rollups(self, chunk_size=10000):
+        """
+        rebuild_rollups recomputes every rollup table from the raw readings,
+        a chunk of rows per transaction
+        """
+        with self.conn:
+            for level, _ in ROLLUP_LEVELS:
+                self.conn.execute(f"DELETE FROM {self.table_name}_{level}")
+
+        last_id = -1
+        while True:
+            rows = self.conn.execute(f"""
+            SELECT id, temperature_degC, humidity_pcent, datetime,
+                timestamp_ms
+            FROM {self.table_name} WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            with self.conn:
+                self.update_rollups([row[1:] for row in rows])
+
+    def update_rollups(self, rows):
+        """
+        update_rollups folds normalized (temperature, humidity, datetime,
+        timestamp_ms) rows into the rollup tables. It does not commit, so
+        it shares the transaction of the insert that called it
+        """
+        # Rows are folded into the finest buckets once; every coarser level
+        # is folded from those, since its size is a multiple of theirs
+        buckets = {}
+        size = ROLLUP_LEVELS[0][1]
+        for temp, hum, _, ms in rows:
+            if ms is None:
+                continue
+
+            seconds = ms // 1000
+            key = seconds - seconds % size
+            acc = buckets.get(key)
+            if acc is None:
+                buckets[key] = [temp, temp, temp, hum, hum, hum, 1]
+            else:
+                if temp < acc[0]:
+                    acc[0] = temp
+                elif temp > acc[1]:
+                    acc[1] = temp
+                acc[2] += temp
+                if hum < acc[3]:
+                    acc[3] = hum
+                elif hum > acc[4]:
+                    acc[4] = hum
+                acc[5] += hum
+                acc[6] += 1
+
+        for level, size in ROLLUP_LEVELS:
+            if size != ROLLUP_LEVELS[0][1]:
+                finer, buckets = buckets, {}
+                for key, part in finer.items():
+                    key -= key % size
+                    acc = buckets.get(key)
+                    if acc is None:
+                        buckets[key] = list(part)
+                    else:
+                        acc[0] = min(acc[0], part[0])
+                        acc[1] = max(acc[1], part[1])
+                        acc[2] += part[2]
+                        acc[3] = min(acc[3], part[3])
+                        acc[4] = max(acc[4], part[4])
+                        acc[5] += part[5]
+                        acc[6] += part[6]
+
+            self.conn.executemany(f"""
+            INSERT INTO {self.table_name}_{level}
+            (bucket,temp_min,temp_max,temp_sum,hum_min,hum_max,hum_sum,count)
+            VALUES(?,?,?,?,?,?,?,?)
+            ON CONFLICT(bucket) DO UPDATE SET
+                temp_min=min(temp_min, excluded.temp_min),
+                temp_max=max(temp_max, excluded.temp_max),
+                temp_sum=temp_sum + excluded.temp_sum,
+                hum_min=min(hum_min, excluded.hum_min),
+                hum_max=max(hum_max, excluded.hum_max),
+                hum_sum=hum_sum + excluded.hum_sum,
+                count=count + excluded.count
+            """, [(key, *acc) for key, acc in buckets.items()])
+
     def close_db(self):
+        self.flush()
         self.conn.close()
 
     def insert_data(self, data):
+        """
+        insert_data stores a single (temperature, humidity, datetime) row.
+        An epoch-millisecond timestamp may be passed as a fourth value;
+        otherwise it is derived from the datetime text
+
+        With write-behind buffering on, the row is queued instead and None
+        is returned, since the row id is not known until the flush
+
+        Returns:
+        int: the id of the inserted row, or None if it was buffered
+        """
+        if self.buffer_rows or self.buffer_ms:
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(data)
+            if self.buffer_full():
+                self.flush()
+            return None
+
         insert_data_sql = """
-        INSERT INTO {table}(temperature_degC,humidity_pcent,datetime)
-        VALUES(?,?,?)
+        INSERT INTO {table}(temperature_degC,humidity_pcent,datetime,
+            timestamp_ms)
+        VALUES(?,?,?,?)
         """.format(table=self.table_name)
 
+        data = self.normalize_row(data)
         curs = self.conn.cursor()
         curs.execute(insert_data_sql, data)
+        self.update_rollups([data])
         self.conn.commit()
         return curs.lastrowid
 
+    def insert_many(self, rows):
+        """
+        insert_many stores a sequence of (temperature, humidity, datetime)
+        rows, optionally with timestamp_ms as a fourth value, with a single
+        executemany in one transaction, so the whole batch pays for one
+        commit instead of one per row
+
+        Returns:
+        int: the number of rows inserted
+        """
+        insert_data_sql = """
+        INSERT INTO {table}(temperature_degC,humidity_pcent,datetime,
+            timestamp_ms)
+        VALUES(?,?,?,?)
+        """.format(table=self.table_name)
+
+        rows = [self.normalize_row(row) for row in rows]
+        with self.conn:
+            curs = self.conn.executemany(insert_data_sql, rows)
+            self.update_rollups(rows)
+        return curs.rowcount
+
+    def buffer_full(self):
+        """
+        buffer_full checks whether the write-behind buffer has reached its
+        row limit or its age limit
+        """
+        if not self.pending:
+            return False
+        if self.buffer_rows and len(self.pending) >= self.buffer_rows:
+            return True
+        age_ms = (time.monotonic() - self.pending_since) * 1000
+        return bool(self.buffer_ms) and age_ms >= self.buffer_ms
+
+    def flush(self):
+        """
+        flush writes any rows queued by the write-behind buffer
+
+        Returns:
+        int: the number of rows written
+        """
+        if not self.pending or self.conn is None:
+            return 0
+        rows, self.pending = self.pending, []
+        try:
+            return self.insert_many(rows)
+        except Exception:
+            # Nothing was committed; keep the rows for the next flush
+            self.pending = rows + self.pending
+            raise
+
+    def flush_if_due(self):
+        """
+        flush_if_due flushes the write-behind buffer if it has reached its
+        row limit or its age limit
+
+        Returns:
+        float: seconds until the oldest queued row is buffer_ms old, or
+        None if no age limit is pending
+        """
+        if self.buffer_full():
+            self.flush()
+        if not self.pending or not self.buffer_ms:
+            return None
+        age_ms = (time.monotonic() - self.pending_since) * 1000
+        return max(0.0, (self.buffer_ms - age_ms) / 1000)
+
+    def expire_chunk(self, max_age_ms=None, max_rows=None, limit=1000,
+                     archive=None):
+        """
+        expire_chunk deletes up to `limit` of the oldest readings that are
+        older than max_age_ms or beyond the newest max_rows, in one short
+        transaction, after appending them to `archive` if one is given.
+        The rollup buckets they fell in are recomputed in the same
+        transaction, so statistics never count expired readings. Call it
+        until it returns 0 to expire everything due
+
+        Returns:
+        int: the number of readings expired
+        """
+        self.flush()
+        ids = set()
+        if max_age_ms is not None:
+            cutoff_ms = int(time.time() * 1000) - max_age_ms
+            ids.update(row[0] for row in self.conn.execute(f"""
+            SELECT id FROM {self.table_name} WHERE timestamp_ms < ?
+            ORDER BY timestamp_ms LIMIT ?
+            """, (cutoff_ms, limit)))
+        if max_rows is not None:
+            ids.update(row[0] for row in self.conn.execute(f"""
+            SELECT id FROM {self.table_name}
+            WHERE id <= (SELECT max(id) FROM {self.table_name}) - ?
+            ORDER BY id LIMIT ?
+            """, (max_rows, limit)))
+        ids = sorted(ids)[:limit]
+        if not ids:
+            return 0
+
+        rows = self.conn.execute(f"""
+        SELECT * FROM {self.table_name}
+        WHERE id IN ({",".join("?" * len(ids))}) ORDER BY id
+        """, ids).fetchall()
+        if archive is not None:
+            archive.write(rows)
+        with self.conn:
+            self.conn.executemany(
+                f"DELETE FROM {self.table_name} WHERE id=?",
+                [(row_id,) for row_id in ids])
+            self.refresh_rollups(row[4] for row in rows)
+        return len(ids)
+
+    def refresh_rollups(self, stamps):
+        """
+        refresh_rollups recomputes the rollup buckets holding the given
+        epoch-millisecond timestamps, after the rows with them were
+        deleted. Minute buckets are recomputed from the raw rows and every
+        coarser level from the level below it; buckets left empty are
+        dropped. It does not commit, like update_rollups
+        """
+        size = ROLLUP_LEVELS[0][1]
+        keys = {ms // 1000 - ms // 1000 % size for ms in stamps
+                if ms is not None}
+        finer = None
+        for level, size in ROLLUP_LEVELS:
+            keys = {key - key % size for key in keys}
+            table = f"{self.table_name}_{level}"
+            self.conn.executemany(f"DELETE FROM {table} WHERE bucket=?",
+                                  [(key,) for key in keys])
+            if finer is None:
+                self.conn.executemany(f"""
+                INSERT INTO {table}
+                SELECT ?, min(temperature_degC), max(temperature_degC),
+                    sum(temperature_degC), min(humidity_pcent),
+                    max(humidity_pcent), sum(humidity_pcent), count(*)
+                FROM {self.table_name}
+                WHERE timestamp_ms >= ? AND timestamp_ms < ?
+                HAVING count(*) > 0
+                """, [(key, key * 1000, (key + size) * 1000)
+                      for key in keys])
+            else:
+                self.conn.executemany(f"""
+                INSERT INTO {table}
+                SELECT ?, min(temp_min), max(temp_max), sum(temp_sum),
+                    min(hum_min), max(hum_max), sum(hum_sum), sum(count)
+                FROM {self.table_name}_{finer}
+                WHERE bucket >= ? AND bucket < ?
+                HAVING count(*) > 0
+                """, [(key, key, key + size) for key in keys])
+            finer = level
+
+    def incremental_vacuum(self, pages=1000):
+        """
+        incremental_vacuum returns up to `pages` free pages to the file
+        system. Deleted rows only leave free pages behind, which later
+        inserts reuse, so the file stops growing either way; this shrinks
+        it. It only works on databases created with auto_vacuum, which
+        create_connection turns on for new ones
+
+        Returns:
+        int: the number of free pages left to return
+        """
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        self.conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")\
+            .fetchall()
+        return self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+
     def get_latest_10(self):
         """
         get_latest_10 generates a list of rows (tuples) from the latest
@@ -57,12 +559,168 @@ class PseudoSensorDb:
         Returns:
         List[Tuple[float,float,str]]
         """
+        return self.get_latest(10)
+
+    def get_latest(self, n):
+        """
+        get_latest generates a list of rows (tuples) from the latest
+        n readings (ordered by id, newest first)
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
         get_data_sql = """
-        SELECT * FROM {table} ORDER BY id DESC LIMIT 10;
+        SELECT * FROM {table} ORDER BY id DESC LIMIT ?;
         """.format(table=self.table_name)
 
         curs = self.conn.cursor()
-        curs.execute(get_data_sql)
+        curs.execute(get_data_sql, (n,))
 
         data = curs.fetchall()
         return data
+
+    def get_range(self, start, end, limit=None):
+        """
+        get_range generates a list of rows with start <= timestamp < end,
+        oldest first, using the timestamp_ms index
+
+        start and end are epoch milliseconds or datetime.datetime objects
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        get_data_sql = """
+        SELECT * FROM {table}
+        WHERE timestamp_ms >= ? AND timestamp_ms < ?
+        ORDER BY timestamp_ms, id LIMIT ?;
+        """.format(table=self.table_name)
+
+        curs = self.conn.cursor()
+        curs.execute(get_data_sql, (to_epoch_ms(start), to_epoch_ms(end),
+                                    -1 if limit is None else limit))
+        return curs.fetchall()
+
+    def get_page(self, start, end, after=None, limit=1000):
+        """
+        get_page generates one page of rows with start <= timestamp < end,
+        oldest first, that come after the (timestamp_ms, id) key `after`
+
+        This is keyset pagination: each page is an index seek from the
+        last key of the previous page, so deep pages cost the same as the
+        first one, unlike OFFSET
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        start = to_epoch_ms(start)
+        end = to_epoch_ms(end)
+        if after is None:
+            return self.get_range(start, end, limit)
+
+        after_ms, after_id = after
+        get_data_sql = """
+        SELECT * FROM {table}
+        WHERE timestamp_ms >= ? AND timestamp_ms < ?
+            AND (timestamp_ms > ? OR id > ?)
+        ORDER BY timestamp_ms, id LIMIT ?;
+        """.format(table=self.table_name)
+
+        curs = self.conn.cursor()
+        curs.execute(get_data_sql, (max(start, after_ms), end, after_ms,
+                                    after_id, limit))
+        return curs.fetchall()
+
+    def iter_range(self, start, end, batch_size=1000):
+        """
+        iter_range streams the rows with start <= timestamp < end, oldest
+        first, fetching batch_size rows at a time so memory stays bounded
+        however long the range is
+
+        Yields:
+        Tuple[int,float,float,str,int]
+        """
+        after = None
+        while True:
+            rows = self.get_page(start, end, after, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][4], rows[-1][0])
+
+    def get_stats(self, start, end):
+        """
+        get_stats computes the min, max and average temperature and humidity
+        of the readings with start <= datetime < end
+
+        The range is split into whole days, hours and minutes, which are
+        read from the rollup tables, plus the partial minutes at either
+        edge, which are read from the raw rows. The work is bounded by the
+        number of buckets, not the number of readings
+
+        start and end are epoch milliseconds or datetime.datetime objects,
+        resolved to the second
+
+        Returns:
+        List[Tuple[float, float, float]]: [(min, max, avg) of temperature,
+        (min, max, avg) of humidity], or None if there are no readings
+        """
+        lo = math.floor(to_epoch_ms(start) / 1000)
+        hi = math.floor(to_epoch_ms(end) / 1000)
+
+        # Each level covers the aligned middle of what the finer level
+        # left over; the ragged ends stay with the finer level
+        segments = []
+        finer = None
+        for level, size in ROLLUP_LEVELS:
+            first = -(-lo // size) * size
+            last = hi // size * size
+            if first >= last:
+                break
+            segments.append((finer, lo, first))
+            segments.append((finer, last, hi))
+            lo, hi, finer = first, last, level
+        segments.append((finer, lo, hi))
+
+        total = None
+        for level, seg_lo, seg_hi in segments:
+            if seg_lo >= seg_hi:
+                continue
+            if level is None:
+                part = self.raw_stats(seg_lo, seg_hi)
+            else:
+                part = self.conn.execute(f"""
+                SELECT min(temp_min), max(temp_max), sum(temp_sum),
+                    min(hum_min), max(hum_max), sum(hum_sum), sum(count)
+                FROM {self.table_name}_{level}
+                WHERE bucket >= ? AND bucket < ?
+                """, (seg_lo, seg_hi)).fetchone()
+            if not part[6]:
+                continue
+            if total is None:
+                total = list(part)
+            else:
+                total = [min(total[0], part[0]), max(total[1], part[1]),
+                         total[2] + part[2], min(total[3], part[3]),
+                         max(total[4], part[4]), total[5] + part[5],
+                         total[6] + part[6]]
+
+        if total is None:
+            return None
+        count = total[6]
+        return [(total[0], total[1], total[2]/count),
+                (total[3], total[4], total[5]/count)]
+
+    def raw_stats(self, lo, hi):
+        """
+        raw_stats aggregates the raw rows between two epoch seconds
+
+        Returns:
+        Tuple: temp min/max/sum, hum min/max/sum and the row count
+        """
+        return self.conn.execute(f"""
+        SELECT min(temperature_degC), max(temperature_degC),
+            sum(temperature_degC), min(humidity_pcent), max(humidity_pcent),
+            sum(humidity_pcent), count(*)
+        FROM {self.table_name}
+        WHERE timestamp_ms >= ? AND timestamp_ms < ?
+        """, (lo * 1000, hi * 1000)).fetchone()
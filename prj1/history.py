@@ -0,0 +1,254 @@
+"""
+Scrollable view of every reading stored in the sensor database
+
+HistoryModel is a QAbstractTableModel that never holds the whole table.
+Rows are read in pages with the database's keyset pagination: fetchMore
+grows the model one page at a time as the view scrolls down, and only the
+most recently used pages are kept in memory. For every page the model
+remembers just the key of the row before it, so any page can be read again
+with one index seek after it has been evicted
+
+The model never queries the database itself. It asks for pages through
+page_requested, and whoever reads them, the acquisition thread in Prj1,
+hands them back to on_page, so a slow disk never stalls the GUI thread.
+Cells of a page that is still being read show up empty until it arrives
+"""
+
+from collections import OrderedDict
+
+from PySide6.QtCore import (
+    QAbstractTableModel,
+    QModelIndex,
+    Qt,
+    Signal,
+    Slot
+)
+from PySide6.QtWidgets import (
+    QHeaderView,
+    QLabel,
+    QTableView,
+    QVBoxLayout,
+    QWidget
+)
+
+# get_page bounds that cover every stored reading
+START_MS = 0
+END_MS = 2**62
+
+
+def row_key(row):
+    """
+    row_key is the (timestamp_ms, id) keyset pagination key of a row
+    """
+    return row[4], row[0]
+
+
+class HistoryModel(QAbstractTableModel):
+    """
+    HistoryModel shows the stored readings, oldest first, as humidity,
+    temperature and datetime columns
+
+    Call refresh() after inserting readings to append them to the end of
+    the model without touching the rows already shown
+
+    page_requested(tag, after, limit) asks for up to `limit` rows after the
+    key `after`, from get_page over START_MS to END_MS; the rows go back to
+    on_page(tag, rows)
+    """
+
+    headers = ("Humidity (%)", "Temperature (degC)", "Datetime")
+
+    page_requested = Signal(object, object, int)
+
+    def __init__(self, page_size=500, max_pages=8, parent=None):
+        super().__init__(parent)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        # Page number -> rows, least recently used first
+        self.pages = OrderedDict()
+        # Key of the row before each page; page 0 starts at the beginning
+        self.page_keys = [None]
+        # Key of the last row of the model
+        self.last_key = None
+        self.rows = 0
+        self.exhausted = False
+        # Tags of the requests not answered yet
+        self.requested = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return section + 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole and index.column() < 2:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole:
+            return None
+
+        # Rows are (id, temperature, humidity, datetime, timestamp_ms)
+        row = self.row(index.row())
+        if row is None:
+            return None
+        match index.column():
+            case 0:
+                return f'{row[2]:.2f}'
+            case 1:
+                return f'{row[1]:.2f}'
+            case _:
+                return row[3]
+
+    def row(self, number):
+        page, offset = divmod(number, self.page_size)
+        rows = self.page(page)
+        if rows is None:
+            return None
+        # A page read again can come back short if rows were deleted
+        return rows[offset] if offset < len(rows) else None
+
+    def page_count(self, number):
+        # Only as many rows as the model has announced; later ones are
+        # added by fetch()
+        return min(self.page_size, self.rows - number * self.page_size)
+
+    def page(self, number):
+        """
+        page returns the rows of one page from the cache, or asks for them
+        to be read again and returns None until they arrive
+
+        Returns:
+        List[Tuple[int,float,float,str,int]]
+        """
+        rows = self.pages.get(number)
+        if rows is not None:
+            self.pages.move_to_end(number)
+            return rows
+
+        count = self.page_count(number)
+        if count <= 0:
+            return []
+        self.request(("page", number, count), self.page_keys[number], count)
+        return None
+
+    def request(self, tag, after, limit):
+        if tag not in self.requested:
+            self.requested.add(tag)
+            self.page_requested.emit(tag, after, limit)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not parent.isValid():
+            self.fetch(self.page_size)
+
+    @Slot()
+    def refresh(self):
+        """
+        refresh appends readings stored since the model last reached the
+        end of the table. Until the view has scrolled that far, fetchMore
+        will pick them up instead
+        """
+        if self.exhausted:
+            self.fetch(self.page_size)
+
+    def fetch(self, limit):
+        """
+        fetch asks for up to `limit` rows after the last row of the model,
+        which on_page appends. Only one such request is out at a time
+        """
+        if not any(tag[0] == "tail" for tag in self.requested):
+            self.request(("tail", self.last_key, limit), self.last_key,
+                         limit)
+
+    @Slot(object, object)
+    def on_page(self, tag, rows):
+        """
+        on_page takes the rows of a request made through page_requested
+        """
+        self.requested.discard(tag)
+        if tag[0] == "tail":
+            self.append(rows, tag[2])
+            return
+
+        _, number, count = tag
+        # If rows were appended to the page meanwhile, these are too few;
+        # the cells then ask again
+        if count == self.page_count(number):
+            self.pages[number] = rows
+            self.evict()
+        first = number * self.page_size
+        last = min(first + self.page_size, self.rows) - 1
+        self.dataChanged.emit(self.index(first, 0),
+                              self.index(last, len(self.headers) - 1))
+
+    def append(self, rows, limit):
+        """
+        append adds the rows read after the last row of the model
+        """
+        self.exhausted = len(rows) < limit
+        if not rows:
+            return
+
+        self.beginInsertRows(QModelIndex(), self.rows,
+                             self.rows + len(rows) - 1)
+        last = len(self.page_keys) - 1
+        tail_rows = self.rows - last * self.page_size
+        # The last page may have been evicted; its rows are then read again
+        # when it is shown
+        tail = self.pages.get(last)
+        for row in rows:
+            if tail_rows == self.page_size:
+                self.page_keys.append(self.last_key)
+                last += 1
+                tail_rows = 0
+                tail = self.pages[last] = []
+            if tail is not None:
+                tail.append(row)
+            tail_rows += 1
+            self.last_key = row_key(row)
+        self.rows += len(rows)
+        self.evict()
+        self.endInsertRows()
+
+    def evict(self):
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+
+class HistoryWidget(QWidget):
+    """
+    HistoryWidget is a table of the full reading history backed by a
+    HistoryModel. Connect its model's page_requested to something that
+    reads the pages, and the rows back to its on_page
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.model = HistoryModel(parent=self)
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        # Fixed row heights and column widths let the view lay out millions
+        # of rows without asking the model for every one of them
+        rows = self.view.verticalHeader()
+        rows.setSectionResizeMode(QHeaderView.Fixed)
+        rows.setDefaultSectionSize(self.view.fontMetrics().height() + 6)
+        header = self.view.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.Interactive)
+        header.setSectionResizeMode(1, QHeaderView.Interactive)
+        header.setSectionResizeMode(2, QHeaderView.Stretch)
+
+        self.layout = QVBoxLayout(self)
+        self.layout.addWidget(QLabel("Reading History"))
+        self.layout.addWidget(self.view)
@@ -7,13 +7,17 @@ a 'pseudo' temperature/humidity sensor and display the information
 to the user in an easy to see interface
 
 The user can read a single measurement or request ten (10) to be
-read over the course of one (1) second intervals
+read over the course of one (1) second intervals, or stream any number of
+readings at a high rate with a decimated live view and a live chart
 
 The user can calculate the minimum, maximum, and average of the
-latest ten (10) readings from a long term storage sqlite3 database
+latest ten (10), or any other number of, readings stored in a long term
+sqlite3 database, and scroll through every reading stored in it
 """
 
+import argparse
 import sys
+import time
 from PySide6.QtWidgets import (
     QApplication,
     QPushButton,
@@ -26,18 +30,25 @@ from PySide6.QtWidgets import (
     QHeaderView,
     QLineEdit,
     QGridLayout,
-    QProgressBar
+    QProgressBar,
+    QSpinBox
 )
 
 from PySide6.QtCore import (
-    Slot, QTimer, QDateTime, Qt
+    Slot, QTimer, Qt
 )
 
 from PySide6.QtGui import QDoubleValidator
 
 from typing import Tuple
 import pseudoSensor
-from db import PseudoSensorDb
+from acquisition import Acquisition
+from alarms import AlarmEngine, AlarmRule
+from chart import ChartWidget
+from colstore import ColumnStoreDb
+from db import PseudoSensorDb, RetentionPolicy
+from history import HistoryWidget
+from stats import SensorStats
 
 MIN_HUM = 0  # %hum
 MAX_HUM = 100  # %hum
@@ -45,91 +56,158 @@ MAX_HUM = 100  # %hum
 MIN_TEMP = -20  # degC
 MAX_TEMP = 120  # degC
 
+# Readings can arrive faster than the screen refreshes, so the UI is
+# redrawn at most this often
+UI_REFRESH_MS = 1000 // 60
+
+# Storage backends with the PseudoSensorDb interface, for --storage
+STORAGE = {"sqlite": PseudoSensorDb, "columnar": ColumnStoreDb}
+
 
 class Prj1(QWidget):
-    def __init__(self):
+    def __init__(self, storage="sqlite", db_name=None, retention=None):
         super().__init__()
         self.sensor = pseudoSensor.PseudoSensor()
 
         # Iniialize the database
-        self.db = PseudoSensorDb()
+        db_class = STORAGE[storage]
+        self.db = db_class(db_name) if db_name else db_class()
         self.db.create_connection()
         self.db.create_sensor_table()
 
+        # Rolling statistics are seeded once from the database and then
+        # kept up to date on every insert
+        self.stats = SensorStats()
+        rows = self.db.get_latest(self.stats.max_window)
+        self.stats.seed((row[1], row[2]) for row in reversed(rows))
+
         self.setWindowTitle("Prj1")
         self.latest_temp = 0
         self.latest_hum = 0
         self.latest_dt = ""
 
+        # Readings are generated and stored on the acquisition thread, with
+        # its own connection; this one is only read from
+        self.acquisition = Acquisition(self.sensor, self.db.db_name, self,
+                                       db_class, retention)
+        self.acquisition.reading.connect(self.on_reading)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(UI_REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh_ui)
+
         self.alarms = AlarmWidget()
-        self.single_read = SingleReadWidget(self.sensor)
-        self.single_read.read_btn.clicked.connect(self.get_from_single_read)
-        self.single_read.read_btn.clicked.connect(self.update_alarm)
-        self.single_read.read_btn.clicked.connect(self.insert_into_db)
-
-        self.readings_table = ReadingsTableWidget(self.sensor)
-        self.readings_table.timer.timeout.connect(
-            self.get_from_table)
-        self.readings_table.timer.timeout.connect(self.update_alarm)
-        self.readings_table.timer.timeout.connect(self.insert_into_db)
+        self.single_read = SingleReadWidget()
+        self.single_read.read_btn.clicked.connect(self.request_single_read)
+
+        self.readings_table = ReadingsTableWidget()
+        self.readings_table.timer.timeout.connect(self.request_table_read)
+
+        self.stream = StreamWidget()
+        self.stream.start_btn.clicked.connect(self.toggle_stream)
+        self.acquisition.batch.connect(self.on_batch)
+        self.acquisition.progress.connect(self.on_stream_progress)
+        self.chart = ChartWidget()
         self.close_btn = QPushButton("Close Window")
         self.close_btn.clicked.connect(self.my_close)
 
-        self.calc_widget = CalcWidget(self.db)
+        self.calc_widget = CalcWidget(self.stats)
+        self.history = HistoryWidget()
+        self.history.model.page_requested.connect(
+            self.acquisition.request_page)
+        self.acquisition.page.connect(self.history.model.on_page)
 
         self.layout = QVBoxLayout(self)
         self.layout.addWidget(self.alarms)
         self.layout.addWidget(self.single_read)
         self.layout.addWidget(self.readings_table)
+        self.layout.addWidget(self.stream)
+        self.layout.addWidget(self.chart)
         self.layout.addWidget(self.calc_widget)
+        self.layout.addWidget(self.history)
         self.layout.addWidget(self.close_btn)
-        self.resize(500, 800)
+        self.resize(500, 1200)
+
+        self.acquisition.start()
 
     @Slot()
-    def get_from_single_read(self):
-        """
-        get_from_single_read retrieves data generated from the
-        SingleReadWidget widget
-        """
-        self.latest_temp, self.latest_hum, self.latest_dt =\
-            self.single_read.get_reading()
+    def request_single_read(self):
+        self.acquisition.request("single")
 
     @Slot()
-    def get_from_table(self):
+    def request_table_read(self):
+        self.acquisition.request("table")
+
+    @Slot(float, float, str, str)
+    def on_reading(self, hum, temp, dt, source):
         """
-        get_from_table retrieves data generated from the
-        ReadingsTableWidget widget to store in the latest readings
+        on_reading receives every stored reading from the acquisition
+        thread. The alarms and statistics see each one; redrawing the
+        widgets is left to refresh_ui
         """
-        curr_row = self.readings_table.timer_count-1
-        self.latest_hum = self.readings_table\
-            .readings[curr_row][0]
-        self.latest_temp = self.readings_table\
-            .readings[curr_row][1]
-        self.latest_dt = self.readings_table\
-            .readings[curr_row][2]
+        self.latest_hum, self.latest_temp, self.latest_dt = hum, temp, dt
+        self.stats.update(temp, hum)
+        self.alarms.check([temp], [hum], [int(time.time() * 1000)])
+        self.chart.add_samples([temp], [hum])
+        if source == "single":
+            self.single_read.set_reading(hum, temp, dt)
+        else:
+            self.readings_table.add_reading(hum, temp, dt)
+        self.schedule_refresh()
 
     @Slot()
-    def update_alarm(self):
+    def toggle_stream(self):
+        if self.stream.running:
+            self.acquisition.stop_stream()
+            return
+        self.stream.start()
+        self.acquisition.start_stream(self.stream.rate_input.value(),
+                                      self.stream.count_input.value())
+
+    @Slot(object, object, object)
+    def on_batch(self, hums, temps, stamps):
         """
-        update_alarm sets the alarm value to be checked against
-        to the latest values retrieves from the other data generating widgets
+        on_batch receives one tick of a stream: the statistics and the
+        alarms see every sample, the widgets only a summary
         """
-        self.alarms.alarm_hum(self.latest_hum)
-        self.alarms.alarm_temp(self.latest_temp)
+        self.latest_hum, self.latest_temp = float(hums[-1]), float(temps[-1])
+        for temp, hum in zip(temps.tolist(), hums.tolist()):
+            self.stats.update(temp, hum)
+        self.alarms.check(temps, hums, stamps)
+        self.stream.add_batch(hums, temps, stamps)
+        self.chart.add_samples(temps, hums)
+        self.schedule_refresh()
+
+    @Slot(int, int)
+    def on_stream_progress(self, done, total):
+        self.stream.set_progress(done, total)
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start()
 
     @Slot()
-    def insert_into_db(self):
-        data = (self.latest_temp, self.latest_hum, self.latest_dt)
-        self.db.insert_data(data)
+    def refresh_ui(self):
+        """
+        refresh_ui redraws everything that changed since the last refresh
+        """
+        self.single_read.refresh()
+        self.readings_table.refresh()
+        self.stream.refresh()
+        self.chart.refresh()
+        self.history.model.refresh()
 
     @Slot()
     def my_close(self):
+        self.acquisition.stop()
         if self.db.conn:
             self.db.close_db()
 
         self.close()
 
     def closeEvent(self, event):
+        self.acquisition.stop()
         if self.db.conn:
             self.db.close_db()
 
@@ -138,18 +216,17 @@ class Prj1(QWidget):
 
 class SingleReadWidget(QWidget):
     """
-    SingleReadWidget that generates a single sample of the read
+    SingleReadWidget requests a single sample of the read and shows it
     in its own small display
     """
 
-    def __init__(self, ps: pseudoSensor.PseudoSensor):
+    def __init__(self):
         super().__init__()
         self.hum = 0
         self.temp = 0
         self.dt = ""
-        self.sensor = ps
+        self.dirty = False
         self.read_btn = QPushButton("Single Humidity/Temp Reading")
-        self.read_btn.clicked.connect(self.gen_humidity_temp_reading)
 
         # Single Read Humidity and Temp Readings
         self.humidity_label = QLabel("20")
@@ -171,11 +248,14 @@ class SingleReadWidget(QWidget):
         self.layout.addWidget(self.read_btn)
         self.layout.addLayout(self.temp_hum_layout)
 
-    @Slot()
-    def gen_humidity_temp_reading(self) -> None:
-        self.hum, self.temp = self.sensor.generate_values()
-        current_time = QDateTime.currentDateTime()
-        self.dt = current_time.toString('yyyy-MM-dd hh:mm:ss dddd')
+    def set_reading(self, hum, temp, dt) -> None:
+        self.hum, self.temp, self.dt = hum, temp, dt
+        self.dirty = True
+
+    def refresh(self) -> None:
+        if not self.dirty:
+            return
+        self.dirty = False
         self.humidity_label.setText(f'{self.hum:.2f}')
         self.temp_label.setText(f'{self.temp:.2f}')
 
@@ -187,23 +267,26 @@ class ReadingsTableWidget(QWidget):
     """
     ReadingTablesWidget contains the button to request ten readings and the
     table that shows the latest readings from the table
+
+    The timer only asks for readings; they are filled in by add_reading as
+    they arrive
     """
 
-    def __init__(self, ps: pseudoSensor.PseudoSensor):
+    def __init__(self):
         super().__init__()
-        self.sensor = ps
         self.num_read = 10
         self.readings = [(0, 0, "")]*self.num_read
+        self.dirty_rows = set()
 
         self.read_btn = QPushButton("Ten Humidity/Temperature Readings")
-        self.table = ReadingsTable(self.sensor, self.num_read)
+        self.table = ReadingsTable(self.num_read)
         self.read_btn.clicked.connect(self.start_timer)
 
         self.progress = QProgressBar(self)
         self.progress.setValue(0)
         self.timer = QTimer()
-        self.timer.timeout.connect(self.gen_humidity_temp_readings)
-        self.timer.timeout.connect(self.update_progress_bar)
+        self.timer.timeout.connect(self.count_request)
+        self.requested = 0
         self.timer_count = 0
         self.layout = QVBoxLayout(self)
         self.layout.addWidget(self.read_btn)
@@ -211,24 +294,32 @@ class ReadingsTableWidget(QWidget):
         self.layout.addWidget(self.table)
 
     @Slot()
-    def gen_humidity_temp_readings(self):
+    def count_request(self):
         """
-        gen_humidity_temp_readings is triggered from the timer in this widge
-        to generate a reading value and update the data array and update
-        the table ui
+        count_request stops the timer once it has asked for num_read
+        readings
         """
-        humidity, temp = self.sensor.generate_values()
-        current_time = QDateTime.currentDateTime()
-        formatted_time = current_time.toString('yyyy-MM-dd hh:mm:ss dddd')
+        self.requested = self.requested + 1
+        if self.requested >= self.num_read:
+            self.requested = 0
+            self.end_timer()
 
+    def add_reading(self, humidity, temp, formatted_time):
+        """
+        add_reading stores the next reading in the data array; the table ui
+        picks it up on the next refresh
+        """
         self.readings[self.timer_count] = (humidity, temp, formatted_time)
-        self.table.update_table(self.timer_count, temp,
-                                humidity, formatted_time)
-        self.timer_count = self.timer_count + 1
+        self.dirty_rows.add(self.timer_count)
+        self.timer_count = (self.timer_count + 1) % self.num_read
 
-        if self.timer_count >= self.num_read:
-            self.timer_count = 0
-            self.end_timer()
+    def refresh(self):
+        for row in self.dirty_rows:
+            humidity, temp, formatted_time = self.readings[row]
+            self.table.update_table(row, temp, humidity, formatted_time)
+        if self.dirty_rows:
+            self.update_progress_bar()
+        self.dirty_rows.clear()
 
     def start_timer(self):
         self.timer.start(1000)
@@ -238,7 +329,8 @@ class ReadingsTableWidget(QWidget):
 
     @Slot()
     def update_progress_bar(self):
-        self.progress.setValue(float(self.timer_count/self.num_read)*100)
+        filled = self.timer_count or self.num_read
+        self.progress.setValue(float(filled/self.num_read)*100)
 
 
 class ReadingsTable(QTableWidget):
@@ -249,7 +341,7 @@ class ReadingsTable(QTableWidget):
     the UI table. The parent widget holds the data
     """
 
-    def __init__(self, ps: pseudoSensor.PseudoSensor, num_rows: int):
+    def __init__(self, num_rows: int):
         super().__init__()
 
         self.num_rows = num_rows
@@ -263,18 +355,130 @@ class ReadingsTable(QTableWidget):
         header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(2, QHeaderView.Stretch)
 
+        # The items are created once and only have their text changed
+        for row in range(self.num_rows):
+            for col in range(3):
+                self.setItem(row, col, QTableWidgetItem(""))
+
     def update_table(self, row, temp, humidity, datetime):
         """
         update_table updates the table ui element at 'row' with the latest
         sensor data
         """
-        item_humidity = QTableWidgetItem(f'{humidity:.2f}')
-        item_temp = QTableWidgetItem(f'{temp:.2f}')
-        item_time = QTableWidgetItem(f'{datetime}')
+        self.item(row, 0).setText(f'{humidity:.2f}')
+        self.item(row, 1).setText(f'{temp:.2f}')
+        self.item(row, 2).setText(f'{datetime}')
 
-        self.setItem(row, 0, item_humidity)
-        self.setItem(row, 1, item_temp)
-        self.setItem(row, 2, item_time)
+
+class StreamWidget(QWidget):
+    """
+    StreamWidget sets up a high-rate acquisition of a number of samples at
+    a rate in Hz. Instead of a table row per sample it shows a decimated
+    live view: the latest sample with the min and max since the last
+    redraw, and the sample rate actually achieved
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.running = False
+        self.received = 0
+        self.done = 0
+        self.total = 0
+        self.started = 0.0
+        self.finished = None
+        self.latest = None
+        self.extremes = None
+        self.dirty = False
+
+        self.rate_input = QSpinBox()
+        self.rate_input.setRange(1, 10000)
+        self.rate_input.setValue(1000)
+        self.rate_input.setSuffix(" Hz")
+        self.count_input = QSpinBox()
+        self.count_input.setRange(1, 100000000)
+        self.count_input.setValue(60000)
+        self.count_input.setSuffix(" samples")
+        self.start_btn = QPushButton("Start Stream")
+
+        self.progress = QProgressBar(self)
+        self.progress.setValue(0)
+        self.temp_label = QLabel("")
+        self.hum_label = QLabel("")
+        self.rate_label = QLabel("")
+
+        self.input_layout = QHBoxLayout()
+        self.input_layout.addWidget(self.rate_input)
+        self.input_layout.addWidget(self.count_input)
+        self.input_layout.addWidget(self.start_btn)
+        self.layout = QVBoxLayout(self)
+        self.layout.addWidget(QLabel("High-Rate Stream"))
+        self.layout.addLayout(self.input_layout)
+        self.layout.addWidget(self.progress)
+        self.layout.addWidget(self.temp_label)
+        self.layout.addWidget(self.hum_label)
+        self.layout.addWidget(self.rate_label)
+
+    def start(self):
+        self.received = 0
+        self.done = 0
+        self.total = self.count_input.value()
+        self.started = time.monotonic()
+        self.finished = None
+        self.latest = None
+        self.extremes = None
+        self.set_running(True)
+
+    def set_running(self, running):
+        self.running = running
+        self.start_btn.setText("Stop Stream" if running else "Start Stream")
+        self.rate_input.setEnabled(not running)
+        self.count_input.setEnabled(not running)
+
+    def add_batch(self, hums, temps, stamps):
+        """
+        add_batch folds one batch of samples into the live view
+        """
+        self.received += len(hums)
+        self.latest = (float(temps[-1]), float(hums[-1]))
+        batch = [float(temps.min()), float(temps.max()),
+                 float(hums.min()), float(hums.max())]
+        if self.extremes is None:
+            self.extremes = batch
+        else:
+            self.extremes = [min(self.extremes[0], batch[0]),
+                             max(self.extremes[1], batch[1]),
+                             min(self.extremes[2], batch[2]),
+                             max(self.extremes[3], batch[3])]
+        self.dirty = True
+
+    def set_progress(self, done, total):
+        self.done, self.total = done, total
+        if done >= total:
+            self.finished = time.monotonic()
+            self.set_running(False)
+        self.dirty = True
+
+    def refresh(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        if self.total:
+            self.progress.setValue(int(self.done / self.total * 100))
+        elapsed = (self.finished or time.monotonic()) - self.started
+        if elapsed > 0:
+            self.rate_label.setText(
+                f'{self.received} samples, {self.received / elapsed:.0f}/s')
+        if self.extremes is None:
+            return
+
+        # Latest sample [min, max] since the last redraw
+        temp, hum = self.latest
+        min_temp, max_temp, min_hum, max_hum = self.extremes
+        self.temp_label.setText(
+            f'{temp:.2f} degC [{min_temp:.2f}, {max_temp:.2f}]')
+        self.hum_label.setText(f'{hum:.2f} % [{min_hum:.2f}, {max_hum:.2f}]')
+        self.extremes = None
 
 
 class AlarmWidget(QWidget):
@@ -282,7 +486,8 @@ class AlarmWidget(QWidget):
     Alarm widget notifies the user when any of the temperature or humidity
     readings are over the alarm level.
 
-    This widget has the ability to reset the alarms.
+    The levels are rules of an AlarmEngine, which checks whole batches of
+    readings at once. This widget has the ability to reset the alarms.
     """
 
     def __init__(self):
@@ -292,6 +497,9 @@ class AlarmWidget(QWidget):
         self.hum_alarm = 80  # Percent
         self.temp_has_alarmed = False
         self.hum_has_alarmed = False
+        self.engine = AlarmEngine()
+        self.engine.add_rule(AlarmRule("temp", "temp", self.temp_alarm))
+        self.engine.add_rule(AlarmRule("hum", "hum", self.hum_alarm))
         self.layout = QVBoxLayout(self)
 
         self.grid = QGridLayout()
@@ -328,16 +536,28 @@ class AlarmWidget(QWidget):
         self.layout.addWidget(QLabel("Alarm Settings"))
         self.layout.addLayout(self.grid)
 
+    def check(self, temps, hums, stamps):
+        """
+        check runs the alarm rules over a batch of readings and shows the
+        first reading of the batch that raised each alarm
+        """
+        for event in self.engine.evaluate(temps, hums, stamps):
+            if not event.raised:
+                continue
+            if event.rule == "temp":
+                self.alarm_temp(event.value)
+            else:
+                self.alarm_hum(event.value)
+
     @Slot()
     def alarm_temp(self, temp_val):
         """
-        alarm_temp checks the temperature value against the set alarm level
-        and will trigger the ui element to show the user that the
-        alarm level has been reached
+        alarm_temp will trigger the ui element to show the user that the
+        temperature alarm level has been reached at temp_val
 
         The alarm can be cleared if needed
         """
-        if temp_val > self.temp_alarm and not self.temp_has_alarmed:
+        if not self.temp_has_alarmed:
             self.clear_temp_alarm_btn.setEnabled(True)
             self.temp_has_alarmed = True
             self.temp_alarm_box.setText(f'ALARM at {temp_val:.2f}degC')
@@ -348,13 +568,12 @@ class AlarmWidget(QWidget):
     @Slot()
     def alarm_hum(self, hum_val):
         """
-        alarm_hum checks the humidity value against the set alarm level
-        and will trigger the ui element to show the user that the
-        alarm level has been reached
+        alarm_hum will trigger the ui element to show the user that the
+        humidity alarm level has been reached at hum_val
 
         The alarm can be cleared if needed
         """
-        if hum_val > self.hum_alarm and not self.hum_has_alarmed:
+        if not self.hum_has_alarmed:
             self.clear_hum_alarm_btn.setEnabled(True)
             self.hum_has_alarmed = True
             self.hum_alarm_box.setText(f'ALARM at {hum_val:.2f}%')
@@ -372,6 +591,7 @@ class AlarmWidget(QWidget):
             return
         val = float(self.temp_input.text())
         self.temp_alarm = max(MIN_TEMP, min(val, MAX_TEMP))
+        self.engine.set_limit("temp", self.temp_alarm)
 
         # Also lock the number shown in the edit box
         if val > MAX_TEMP:
@@ -387,6 +607,7 @@ class AlarmWidget(QWidget):
             return
         val = float(self.hum_input.text())
         self.hum_alarm = max(MIN_HUM, min(val, MAX_HUM))
+        self.engine.set_limit("hum", self.hum_alarm)
 
         # Also lock the number shown in the edit box
         if val > MAX_HUM:
@@ -404,6 +625,7 @@ class AlarmWidget(QWidget):
         """)
         self.temp_has_alarmed = False
         self.clear_temp_alarm_btn.setEnabled(False)
+        self.engine.rearm("temp")
 
     @Slot()
     def clear_hum_alarm(self):
@@ -417,26 +639,29 @@ class AlarmWidget(QWidget):
         """)
         self.hum_has_alarmed = False
         self.clear_hum_alarm_btn.setEnabled(False)
+        self.engine.rearm("hum")
 
 
 class CalcWidget(QWidget):
     """
-    CalcWidget displays the min, max, and average of the latest (past 10 max)
-    readings and their respective minimums, maximums, and averages in a grid
-    ui configuration
+    CalcWidget displays the min, max, and average of the latest (past 10 by
+    default) readings and their respective minimums, maximums, and averages
+    in a grid ui configuration
 
-    The user must click on the button to read in the latest data and get the
-    results
+    The user must click on the button to get the results, which come from
+    the rolling statistics engine rather than a database query
     """
 
-    def __init__(self, db: PseudoSensorDb):
+    def __init__(self, stats: SensorStats):
         super().__init__()
 
-        self.db = db
-        self.data = []
+        self.stats = stats
         self.calcs = []
-        self.calc_btn = QPushButton("Calculate Avg/Min/Max of Latest Ten")
-        self.calc_btn.clicked.connect(self.get_latest_data_db)
+        self.calc_btn = QPushButton("Calculate Avg/Min/Max of Latest")
+        self.window_input = QSpinBox()
+        self.window_input.setRange(1, self.stats.max_window)
+        self.window_input.setValue(self.stats.default_window)
+        self.window_input.setSuffix(" readings")
         self.calc_btn.clicked.connect(self.calculate)
         self.calc_btn.clicked.connect(self.update)
         self.grid = QGridLayout()
@@ -457,32 +682,21 @@ class CalcWidget(QWidget):
         self.grid.addWidget(self.min_hum_label, 2, 1, 1, 1)
         self.grid.addWidget(self.max_hum_label, 2, 2, 1, 1)
         self.grid.addWidget(self.avg_hum_label, 2, 3, 1, 1)
+        self.btn_layout = QHBoxLayout()
+        self.btn_layout.addWidget(self.calc_btn)
+        self.btn_layout.addWidget(self.window_input)
         self.layout = QVBoxLayout(self)
-        self.layout.addWidget(self.calc_btn)
+        self.layout.addLayout(self.btn_layout)
         self.layout.addLayout(self.grid)
 
-    @Slot()
-    def get_latest_data_db(self):
-        self.data = self.db.get_latest_10()
-
     @Slot()
     def calculate(self):
-        if self.data is None or self.data == []:
+        calcs = self.stats.stats(self.window_input.value())
+        if calcs is None:
             # (min, max, avg) of temp, humidity
             return [(0, 0, 0), (0, 0, 0)]
 
-        temps = [row[2] for row in self.data]
-        hums = [row[1] for row in self.data]
-
-        min_temp = min(temps)
-        min_hum = min(hums)
-        max_temp = max(temps)
-        max_hum = max(hums)
-        avg_temp = sum(temps)/len(temps)
-        avg_hum = sum(hums)/len(hums)
-
-        self.calcs = [(min_temp, max_temp, avg_temp),
-                      (min_hum, max_hum, avg_hum)]
+        self.calcs = calcs
 
     @Slot()
     def update(self):
@@ -499,9 +713,32 @@ class CalcWidget(QWidget):
 
 
 def main():
-    app = QApplication(sys.argv)
-
-    window = Prj1()
+    parser = argparse.ArgumentParser(description="Sensor GUI")
+    parser.add_argument("--storage", choices=sorted(STORAGE),
+                        default="sqlite",
+                        help="sqlite, or the memory-mapped column store for "
+                        "high-rate ingest")
+    parser.add_argument("--db", default=None,
+                        help="database file, or directory for columnar "
+                        "storage")
+    parser.add_argument("--keep-days", type=float, default=None,
+                        help="delete readings older than this")
+    parser.add_argument("--keep-rows", type=int, default=None,
+                        help="delete all but the newest KEEP_ROWS readings")
+    parser.add_argument("--archive-dir", default=None,
+                        help="append deleted readings to gzipped CSV files "
+                        "here first")
+    # Everything else is left for Qt
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    retention = None
+    if args.keep_days is not None or args.keep_rows is not None:
+        retention = RetentionPolicy(
+            max_age_ms=None if args.keep_days is None
+            else int(args.keep_days * 86400 * 1000),
+            max_rows=args.keep_rows, archive_dir=args.archive_dir)
+    window = Prj1(args.storage, args.db, retention)
     window.show()
     sys.exit(app.exec())
 
@@ -1,4 +1,5 @@
-import random
+import time
+import numpy as np
 
 
 class PseudoSensor:
@@ -9,15 +10,24 @@ class PseudoSensor:
     h_range_index = 0
     t_range_index = 0
 
-    def __init__(self):
+    def __init__(self, seed=None):
 
         self.humVal = self.h_range[self.h_range_index]
         self.tempVal = self.t_range[self.t_range_index]
 
+        # Single reads and batches draw from the same generator in the same
+        # order, so a seeded sensor is repeatable and generate_batch(n)
+        # matches n calls to generate_values()
+        self.rng = np.random.default_rng(seed)
+        self._h_cycle = np.array(self.h_range, dtype=np.float64)
+        self._t_cycle = np.array(self.t_range, dtype=np.float64)
+
     def generate_values(self):
 
-        self.humVal = self.h_range[self.h_range_index] + random.uniform(0, 10)
-        self.tempVal = self.t_range[self.t_range_index] + random.uniform(0, 10)
+        self.humVal = self.h_range[self.h_range_index] + \
+            float(self.rng.uniform(0, 10))
+        self.tempVal = self.t_range[self.t_range_index] + \
+            float(self.rng.uniform(0, 10))
         self.h_range_index += 1
 
         if self.h_range_index > len(self.h_range) - 1:
@@ -30,6 +40,113 @@ class PseudoSensor:
 
         return self.humVal, self.tempVal
 
+    def generate_batch(self, n, start_ms=None, period_ms=1000):
+        """
+        generate_batch generates n readings in one vectorized step, following
+        the same humidity/temperature cycle as generate_values and leaving
+        the cursors where n single calls would have left them
+
+        The timestamps start at start_ms (defaults to now) and are spaced
+        period_ms apart
+
+        Returns:
+        Tuple[ndarray, ndarray, ndarray]: humidity, temperature (float64)
+        and epoch-millisecond timestamps (int64)
+        """
+        if n <= 0:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty.copy(), np.empty(0, dtype=np.int64)
+
+        steps = np.arange(n)
+        h_idx = (self.h_range_index + steps) % len(self.h_range)
+        t_idx = (self.t_range_index + steps) % len(self.t_range)
+
+        # Drawn as (n, 2) so the stream order is hum, temp, hum, temp...
+        noise = self.rng.uniform(0, 10, size=(n, 2))
+        hums = self._h_cycle[h_idx] + noise[:, 0]
+        temps = self._t_cycle[t_idx] + noise[:, 1]
+
+        if start_ms is None:
+            start_ms = int(time.time() * 1000)
+        timestamps = start_ms + (steps * period_ms).astype(np.int64)
+
+        self.h_range_index = int((h_idx[-1] + 1) % len(self.h_range))
+        self.t_range_index = int((t_idx[-1] + 1) % len(self.t_range))
+        self.humVal = float(hums[-1])
+        self.tempVal = float(temps[-1])
+
+        return hums, temps, timestamps
+
+
+class SensorFleet:
+    """
+    SensorFleet simulates many PseudoSensors at once. Instead of one Python
+    object per sensor, the per-sensor cursors, phase offsets and last
+    values are held in compact arrays and every sensor is advanced in a
+    single vectorized tick
+    """
+
+    def __init__(self, num_sensors, seed=None, random_phase=True):
+        self.num_sensors = num_sensors
+        self.rng = np.random.default_rng(seed)
+        self._h_cycle = np.array(PseudoSensor.h_range, dtype=np.float32)
+        self._t_cycle = np.array(PseudoSensor.t_range, dtype=np.float32)
+
+        # Both cycles are shorter than 256 steps, so a byte per cursor
+        if random_phase:
+            self.h_phase = self.rng.integers(
+                0, len(self._h_cycle), num_sensors, dtype=np.uint8)
+            self.t_phase = self.rng.integers(
+                0, len(self._t_cycle), num_sensors, dtype=np.uint8)
+        else:
+            self.h_phase = np.zeros(num_sensors, dtype=np.uint8)
+            self.t_phase = np.zeros(num_sensors, dtype=np.uint8)
+
+        self.h_range_index = self.h_phase.copy()
+        self.t_range_index = self.t_phase.copy()
+        self.humVal = self._h_cycle[self.h_range_index]
+        self.tempVal = self._t_cycle[self.t_range_index]
+        self._noise = np.empty((2, num_sensors), dtype=np.float32)
+
+    def tick(self):
+        """
+        tick generates one reading for every sensor in the fleet and
+        advances all cursors, the same as calling generate_values once on
+        each sensor
+
+        Returns:
+        Tuple[ndarray, ndarray]: humidity, temperature (float32, one entry
+        per sensor)
+        """
+        self.rng.random(out=self._noise, dtype=np.float32)
+        self._noise *= 10
+
+        self.humVal = self._h_cycle[self.h_range_index] + self._noise[0]
+        self.tempVal = self._t_cycle[self.t_range_index] + self._noise[1]
+
+        self.h_range_index += 1
+        self.h_range_index[self.h_range_index >= len(self._h_cycle)] = 0
+        self.t_range_index += 1
+        self.t_range_index[self.t_range_index >= len(self._t_cycle)] = 0
+
+        return self.humVal, self.tempVal
+
+    def reset(self):
+        """
+        reset moves every sensor back to its starting phase
+        """
+        self.h_range_index[:] = self.h_phase
+        self.t_range_index[:] = self.t_phase
+
+    @property
+    def nbytes(self):
+        """
+        nbytes is the memory held by the fleet's per-sensor arrays
+        """
+        return sum(arr.nbytes for arr in (
+            self.h_phase, self.t_phase, self.h_range_index,
+            self.t_range_index, self.humVal, self.tempVal, self._noise))
+
 
 if __name__ == "__main__":
     sensor = PseudoSensor()
@@ -0,0 +1,137 @@
+from collections import OrderedDict, deque
+
+
+class RollingWindow:
+    """
+    RollingWindow keeps the min, max and average of the last `size` values
+    pushed into it
+
+    The average comes from a running sum and the min/max from monotonic
+    deques, so each push is O(1) amortized and reading the stats is O(1)
+    no matter how large the window is
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()
+        self.total = 0.0
+        self.pushed = 0
+
+        # (push number, value) pairs, increasing for mins and decreasing
+        # for maxs, so the front of each is the current min/max
+        self.mins = deque()
+        self.maxs = deque()
+
+    def push(self, value):
+        idx = self.pushed
+        self.pushed += 1
+
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.size:
+            self.total -= self.values.popleft()
+
+        # The running sum slowly picks up float error, so rebuild it from
+        # the window now and then. Amortized over the pushes this is O(1)
+        if self.pushed % (self.size * 64) == 0:
+            self.total = sum(self.values)
+
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((idx, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((idx, value))
+
+        oldest = idx - self.size
+        if self.mins[0][0] <= oldest:
+            self.mins.popleft()
+        if self.maxs[0][0] <= oldest:
+            self.maxs.popleft()
+
+    def stats(self):
+        """
+        stats returns the (min, max, avg) of the values in the window
+
+        Returns:
+        Tuple[float, float, float] or None if nothing has been pushed
+        """
+        if not self.values:
+            return None
+        return (self.mins[0][1], self.maxs[0][1],
+                self.total/len(self.values))
+
+
+class SensorStats:
+    """
+    SensorStats is the in-memory statistics engine for the sensor readings.
+    It is updated on every insert and answers min/max/avg queries over the
+    latest N readings without going back to the database
+
+    Each requested window size gets its own pair of RollingWindows, built
+    once from the recent history and then kept up to date incrementally.
+    Only the most recently used `max_windows` sizes are kept
+    """
+
+    def __init__(self, default_window=10, max_window=10000, max_windows=8):
+        self.default_window = default_window
+        self.max_window = max_window
+        self.max_windows = max_windows
+        self.history = deque(maxlen=max_window)
+        self.windows = OrderedDict()
+
+    def seed(self, rows):
+        """
+        seed resets the engine from existing (temperature, humidity) rows,
+        oldest first
+        """
+        self.history.clear()
+        self.windows.clear()
+        self.history.extend(rows)
+
+    def update(self, temp, hum):
+        """
+        update adds a new reading to the history and every live window
+        """
+        self.history.append((temp, hum))
+        for temp_window, hum_window in self.windows.values():
+            temp_window.push(temp)
+            hum_window.push(hum)
+
+    def window(self, size):
+        if size in self.windows:
+            self.windows.move_to_end(size)
+            return self.windows[size]
+
+        temp_window = RollingWindow(size)
+        hum_window = RollingWindow(size)
+        start = max(0, len(self.history) - size)
+        for i in range(start, len(self.history)):
+            temp, hum = self.history[i]
+            temp_window.push(temp)
+            hum_window.push(hum)
+
+        self.windows[size] = (temp_window, hum_window)
+        if len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+        return temp_window, hum_window
+
+    def stats(self, size=None):
+        """
+        stats returns the min, max and average of the latest `size` readings
+        (the default window if not given). If fewer readings exist, all of
+        them are used
+
+        Returns:
+        List[Tuple[float, float, float]]: [(min, max, avg) of temperature,
+        (min, max, avg) of humidity], or None if there are no readings
+        """
+        if size is None:
+            size = self.default_window
+        if size < 1 or size > self.max_window:
+            raise ValueError(f"window must be between 1 and {self.max_window}")
+
+        temp_window, hum_window = self.window(size)
+        if temp_window.stats() is None:
+            return None
+        return [temp_window.stats(), hum_window.stats()]
@@ -0,0 +1,332 @@
+"""
+Bulk export and import of stored readings
+
+Run from the prj1 directory:
+
+    python transfer.py export prj1_db.db readings.csv.gz \\
+        --start 2024-01-01 --end 2024-02-01
+    python transfer.py import readings.parquet restored.db
+
+The format comes from the file extension: .csv or .ndjson (.jsonl), each
+optionally gzipped (.gz), .parquet, or .arrow (Arrow IPC file, zstd
+compressed). Parquet and Arrow need pyarrow, which is only imported for
+them.
+
+Export streams the rows oldest first, batch_size at a time, through the
+database's keyset paging (iter_range), so memory stays bounded however
+many rows there are. Import reads batch_size rows at a time and stores each
+batch with insert_many, in one transaction. Imported rows get new ids;
+their timestamps and datetime text are kept
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import sys
+import time
+
+import colstore
+import db
+
+# Storage backends with the PseudoSensorDb interface, for --storage
+STORAGE = {"sqlite": db.PseudoSensorDb, "columnar": colstore.ColumnStoreDb}
+
+COLUMNS = db.RowArchive.columns
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson",
+           ".parquet": "parquet", ".arrow": "arrow"}
+
+
+def file_format(path):
+    """
+    file_format picks the format from the file extension
+
+    Returns:
+    Tuple[str, bool]: the format and whether the file is gzipped
+    """
+    name = path.lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-3]
+    for extension, fmt in FORMATS.items():
+        if name.endswith(extension):
+            if compressed and fmt in ("parquet", "arrow"):
+                raise ValueError(f"{fmt} files are compressed already")
+            return fmt, compressed
+    raise ValueError(f"unknown file type {path}, expected one of "
+                     f"{', '.join(FORMATS)}")
+
+
+def open_text(path, mode, compressed):
+    if compressed:
+        # Level 6 is several times faster than gzip's default 9 and the
+        # files are barely bigger
+        return gzip.open(path, mode + "t", compresslevel=6, newline="")
+    return open(path, mode, newline="")
+
+
+def load_pyarrow():
+    """
+    load_pyarrow imports pyarrow, which only the Parquet and Arrow formats
+    need
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet and Arrow files need pyarrow "
+                         "(pip install pyarrow)") from None
+    return pyarrow
+
+
+def arrow_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()), ("temperature_degC", pa.float64()),
+        ("humidity_pcent", pa.float64()), ("datetime", pa.string()),
+        ("timestamp_ms", pa.int64()),
+    ])
+
+
+def to_record_batch(pa, schema, rows):
+    return pa.record_batch(
+        [pa.array(column, type=field.type)
+         for column, field in zip(zip(*rows), schema)], schema=schema)
+
+
+def batched(rows, size):
+    """
+    batched groups an iterable of rows into lists of at most `size`
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_csv(path, compressed, batches):
+    with open_text(path, "w", compressed) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for batch in batches:
+            writer.writerows(batch)
+
+
+def write_ndjson(path, compressed, batches):
+    # One json.dumps per row is most of the export time, so only the text
+    # goes through it; ids, readings and timestamps are plain numbers
+    line = ('{{"id": {}, "temperature_degC": {!r}, "humidity_pcent": {!r}, '
+            '"datetime": {}, "timestamp_ms": {}}}\n')
+    with open_text(path, "w", compressed) as f:
+        for batch in batches:
+            f.writelines(line.format(row_id, temp, hum, json.dumps(text), ms)
+                         for row_id, temp, hum, text, ms in batch)
+
+
+def write_parquet(path, batches):
+    pa = load_pyarrow()
+    schema = arrow_schema(pa)
+    with pa.parquet.ParquetWriter(path, schema,
+                                  compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(to_record_batch(pa, schema, batch))
+
+
+def write_arrow(path, batches):
+    pa = load_pyarrow()
+    schema = arrow_schema(pa)
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.OSFile(path, "wb") as sink, \
+            pa.ipc.new_file(sink, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(to_record_batch(pa, schema, batch))
+
+
+def read_csv(path, compressed, batch_size):
+    """
+    read_csv yields the rows of an exported CSV file as lists of
+    (temperature, humidity, datetime, timestamp_ms) tuples. The columns
+    are found by name in the header, and datetime may be missing or empty
+    """
+    with open_text(path, "r", compressed) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        temp, hum, ts = (header.index(name) for name in
+                         ("temperature_degC", "humidity_pcent",
+                          "timestamp_ms"))
+        dt = header.index("datetime") if "datetime" in header else None
+        for batch in batched(reader, batch_size):
+            yield [(float(row[temp]), float(row[hum]),
+                    row[dt] if dt is not None else "", int(row[ts]))
+                   for row in batch]
+
+
+def read_ndjson(path, compressed, batch_size):
+    with open_text(path, "r", compressed) as f:
+        for batch in batched((line for line in f if line.strip()),
+                             batch_size):
+            records = [json.loads(line) for line in batch]
+            yield [(float(record["temperature_degC"]),
+                    float(record["humidity_pcent"]),
+                    record.get("datetime") or "",
+                    int(record["timestamp_ms"]))
+                   for record in records]
+
+
+def from_record_batch(batch):
+    names = batch.schema.names
+    columns = [batch.column(names.index(name)).to_pylist()
+               for name in ("temperature_degC", "humidity_pcent",
+                            "timestamp_ms")]
+    if "datetime" in names:
+        texts = batch.column(names.index("datetime")).to_pylist()
+    else:
+        texts = [""] * batch.num_rows
+    return [(temp, hum, text or "", ts) for temp, hum, text, ts in
+            zip(columns[0], columns[1], texts, columns[2])]
+
+
+def read_parquet(path, batch_size):
+    pa = load_pyarrow()
+    for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size):
+        yield from_record_batch(batch)
+
+
+def read_arrow(path, batch_size):
+    pa = load_pyarrow()
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield from_record_batch(batch.slice(offset, batch_size))
+
+
+def export_rows(sensor_db, path, start=0, end=2**62, batch_size=50000):
+    """
+    export_rows writes the readings with start <= timestamp < end to
+    `path`, oldest first
+
+    Returns:
+    int: the number of rows written
+    """
+    fmt, compressed = file_format(path)
+    count = 0
+
+    def batches():
+        nonlocal count
+        for batch in batched(sensor_db.iter_range(start, end, batch_size),
+                             batch_size):
+            count += len(batch)
+            yield batch
+
+    if fmt == "csv":
+        write_csv(path, compressed, batches())
+    elif fmt == "ndjson":
+        write_ndjson(path, compressed, batches())
+    elif fmt == "parquet":
+        write_parquet(path, batches())
+    else:
+        write_arrow(path, batches())
+    return count
+
+
+def read_file(path, batch_size=50000):
+    """
+    read_file streams an exported file in any of the formats
+
+    Yields:
+    List[Tuple[float, float, str, int]]: batches of (temperature, humidity,
+    datetime, timestamp_ms) rows; datetime may be empty
+    """
+    fmt, compressed = file_format(path)
+    if fmt == "csv":
+        return read_csv(path, compressed, batch_size)
+    if fmt == "ndjson":
+        return read_ndjson(path, compressed, batch_size)
+    if fmt == "parquet":
+        return read_parquet(path, batch_size)
+    return read_arrow(path, batch_size)
+
+
+def import_rows(sensor_db, path, batch_size=50000):
+    """
+    import_rows appends the readings in `path` to the database, one
+    transaction per batch. Rows without datetime text get it from their
+    timestamp
+
+    Returns:
+    int: the number of rows stored
+    """
+    count = 0
+    for batch in read_file(path, batch_size):
+        rows = [row if row[2] else
+                (row[0], row[1], datetime.datetime.fromtimestamp(
+                    row[3] / 1000).strftime(sensor_db.datetime_format),
+                 row[3])
+                for row in batch]
+        count += sensor_db.insert_many(rows)
+    return count
+
+
+def parse_time(value):
+    """
+    parse_time accepts epoch milliseconds or an ISO datetime (local time
+    if it has no offset)
+    """
+    if value.isdigit():
+        return int(value)
+    return datetime.datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--storage", choices=sorted(STORAGE),
+                        default="sqlite")
+    common.add_argument("--batch-size", type=int, default=50000)
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser(
+        "export", parents=[common], help="write stored readings to a file")
+    export_parser.add_argument("db")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--start", type=parse_time, default=0,
+                               help="epoch ms or ISO datetime, inclusive")
+    export_parser.add_argument("--end", type=parse_time, default=2**62,
+                               help="epoch ms or ISO datetime, exclusive")
+    import_parser = commands.add_parser(
+        "import", parents=[common],
+        help="append the readings in a file to a database")
+    import_parser.add_argument("path")
+    import_parser.add_argument("db")
+    args = parser.parse_args(argv)
+
+    sensor_db = STORAGE[args.storage](args.db)
+    sensor_db.create_connection(wal=True)
+    sensor_db.create_sensor_table()
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            count = export_rows(sensor_db, args.path, args.start, args.end,
+                                args.batch_size)
+        else:
+            count = import_rows(sensor_db, args.path, args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        sensor_db.close_db()
+    elapsed = time.perf_counter() - started
+    print(f"{args.command}ed {count} rows in {elapsed:.2f} s "
+          f"({count / max(elapsed, 1e-9):.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,16 @@ let alarm_temp_crossed = false;
 let alarm_hum_crossed = false;
 let temp_stats = new Array(3);
 let hum_stats = new Array(3);
+let live = false;
+
+// Binary protocol (see server/protocol.py): 4 byte header of message type,
+// pad byte and uint16 record count, then little-endian records
+const BINARY_SUBPROTOCOL = "sensor.bin.v1";
+const MSG_DATA = 1;
+const MSG_DATAM = 2;
+const MSG_DATACALC = 3;
+const HEADER_SIZE = 4;
+const READING_SIZE = 16;
 
 const MIN_TEMP = -20;
 const MAX_TEMP = 120;
@@ -22,7 +32,10 @@ function open_websocket() {
   const ws_btn = document.querySelector("#ws-connect-btn");
 
   if (!connected){
-    ws = new WebSocket("ws://localhost:8888/ws/");
+    const use_binary = document.querySelector("#binary-proto").checked;
+    ws = new WebSocket("ws://localhost:8888/ws/",
+                       use_binary ? [BINARY_SUBPROTOCOL] : []);
+    ws.binaryType = "arraybuffer";
     status_msg.innerHTML = "Connecting...";
   } else {
     connected = false;
@@ -39,33 +52,28 @@ function open_websocket() {
     connected = true;
     enable_sensor_ui(true);
     ws_btn.innerHTML = "Disconnect Websocket";
+    send_alarm_levels();
   });
 
   ws.addEventListener("message", (event) => {
+    if (event.data instanceof ArrayBuffer) {
+      handle_binary_message(event.data);
+      return;
+    }
     console.log("Message from server ", event.data);
     const [msg_type, msg_val] = event.data.split(" ", 2);
     switch(msg_type) {
       case "data":
-        [latest_hum, latest_temp, latest_dt] = parse_humtemp_data(msg_val);
-        update_single_read_ui();
-        update_alarms();
+        on_data(parse_humtemp_data(msg_val));
         break;
       case "datam":
-        [latest_hum, latest_temp, latest_dt] = parse_humtemp_data(msg_val);
-        ten_reads[counter] = [latest_hum, latest_temp, latest_dt];
-        update_table_ui(counter);
-        update_counter();
-        update_alarms();
+        on_datam(parse_humtemp_data(msg_val));
         break;
       case "datacalc":
-        let res = parse_calc_data(msg_val);
-        temp_stats[0] = res[0][0];       
-        temp_stats[1] = res[0][1];       
-        temp_stats[2] = res[0][2];       
-        hum_stats[0] = res[1][0];       
-        hum_stats[1] = res[1][1];       
-        hum_stats[2] = res[1][2];       
-        update_stats_table();
+        on_datacalc(parse_calc_data(msg_val));
+        break;
+      case "alarm":
+        on_alarm(parse_alarm_data(msg_val));
         break;
     }    
   });
@@ -82,11 +90,83 @@ function open_websocket() {
   ws.addEventListener("close", (event) => {
     console.log("Closing ", event.data);
     connected = false;
+    set_live(false);
     status_msg.innerHTML = "Disconnected/Closed";
     enable_sensor_ui(false);
   });
 }
 
+function on_data(reading){
+  [latest_hum, latest_temp, latest_dt] = reading;
+  update_single_read_ui();
+}
+
+function on_datam(reading){
+  [latest_hum, latest_temp, latest_dt] = reading;
+  ten_reads[counter] = [latest_hum, latest_temp, latest_dt];
+  update_table_ui(counter);
+  update_counter();
+}
+
+function on_datacalc(res){
+  temp_stats[0] = res[0][0];
+  temp_stats[1] = res[0][1];
+  temp_stats[2] = res[0][2];
+  hum_stats[0] = res[1][0];
+  hum_stats[1] = res[1][1];
+  hum_stats[2] = res[1][2];
+  update_stats_table();
+}
+
+/**
+* Decodes a binary protocol frame and hands each record to the same
+* handlers as the text protocol, in order, as if each had arrived in its
+* own text frame
+* @param {ArrayBuffer} buffer - binary websocket frame
+*/
+function handle_binary_message(buffer){
+  const view = new DataView(buffer);
+  const msg_type = view.getUint8(0);
+  const count = view.getUint16(2, true);
+
+  if (msg_type === MSG_DATACALC) {
+    let values = [];
+    for (let i = 0; i < 6; i++) {
+      values.push(view.getFloat32(HEADER_SIZE + 4*i, true));
+    }
+    on_datacalc([values.slice(0, 3), values.slice(3)]);
+    return;
+  }
+
+  let readings = [];
+  for (let i = 0; i < count; i++) {
+    const offset = HEADER_SIZE + i*READING_SIZE;
+    readings.push([
+      view.getFloat32(offset, true),
+      view.getFloat32(offset + 4, true),
+      format_timestamp(Number(view.getBigInt64(offset + 8, true)))
+    ]);
+  }
+
+  if (msg_type === MSG_DATA) {
+    readings.forEach(on_data);
+  } else if (msg_type === MSG_DATAM) {
+    readings.forEach(on_datam);
+  }
+}
+
+/**
+* Formats epoch milliseconds like the text protocol's local ISO datetime
+* @param {number} ms - epoch milliseconds
+* @returns {string} yyyy-mm-ddThh:mm:ss
+*/
+function format_timestamp(ms){
+  const d = new Date(ms);
+  const pad = (n) => String(n).padStart(2, "0");
+  return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}` +
+    `T${pad(d.getHours())}:${pad(d.getMinutes())}:${pad(d.getSeconds())}`;
+}
+
 /**
 * Simple check to make sure we cannot send messages is the 
 * socket is not ready to send
@@ -144,6 +224,17 @@ function parse_calc_data(data_value){
   return results;
 }
 
+/**
+* Parses the data values of an alarm message sent by the server when one of
+* this client's alarm rules raises or clears
+* @param {string} data_value - name,raised|cleared,value,epoch ms string
+* @returns {Array} alarm - [name, raised (boolean), value]
+*/
+function parse_alarm_data(data_value){
+  const values = data_value.split(",");
+  return [values[0], values[1] === "raised", parseFloat(values[2])];
+}
+
 /**
 * Enables all the buttons that can request data. This needs to happen after
 * the websocket connection is successfully opened. Otherwise a websocket error
@@ -170,6 +261,26 @@ function update_single_read_ui(){
   temp_p.innerHTML = latest_temp.toFixed(2);
 }
 
+/**
+* Toggles the server-push subscription. While subscribed the server sends
+* 'data' messages on its own, which update the single read ui
+*/
+function toggle_live(){
+  if(!is_ws_open(ws)) return;
+  set_live(!live);
+  if(live){
+    ws.send("subscribe 1");
+  } else {
+    ws.send("unsubscribe");
+  }
+}
+
+function set_live(enable){
+  const live_btn = document.querySelector("#live-btn");
+  live = enable;
+  live_btn.innerHTML = live ? "Stop Live Stream" : "Start Live Stream";
+}
+
 function get_ten_reads(){
   request_data(true);
   console.log(ten_reads);
@@ -204,31 +315,37 @@ alarm_form.addEventListener("submit", (event) => {
   alarm_temp = Math.max(MIN_TEMP, Math.min(alarm_temp, MAX_TEMP));
   alarm_hum = document.getElementById("hum-alarm").value;
   alarm_hum = Math.max(MIN_HUM, Math.min(alarm_hum, MAX_HUM));
+  send_alarm_levels();
 });
 
-function check_temp_alarm(){
-  return latest_temp > alarm_temp;
-}
-
-function check_hum_alarm(){
-  return latest_hum > alarm_hum;
+/**
+* Sends the alarm levels to the server as alarm rules. The server checks
+* them against every reading it stores and sends an alarm message when
+* one is crossed
+*/
+function send_alarm_levels(){
+  if(!is_ws_open(ws)) return;
+  ws.send(`setalarm temp temp above ${alarm_temp}`);
+  ws.send(`setalarm hum hum above ${alarm_hum}`);
 }
 
 /**
-* Updates the alarm UI elements when an sensor data has crossed the 
-* threshold
+* Updates the alarm UI elements when the server reports that sensor data
+* has crossed the threshold
+* @param {Array} alarm - [name, raised, value] from parse_alarm_data
 */
-function update_alarms(){
+function on_alarm([name, raised, value]){
+  if(!raised) return;
   const alarm_temp_notif = document.querySelector("#temp-notif");
   const alarm_hum_notif = document.querySelector("#hum-notif")
 
-  if(check_temp_alarm() && !alarm_temp_crossed){
+  if(name === "temp" && !alarm_temp_crossed){
     alarm_temp_crossed = true;
-    alarm_temp_notif.innerHTML="ALARM AT ".concat(latest_temp.toFixed(2),"degC");
+    alarm_temp_notif.innerHTML="ALARM AT ".concat(value.toFixed(2),"degC");
   }
-  if(check_hum_alarm() && !alarm_hum_crossed){
+  if(name === "hum" && !alarm_hum_crossed){
     alarm_hum_crossed = true;
-    alarm_hum_notif.innerHTML="ALARM AT ".concat(latest_hum.toFixed(2),"%");
+    alarm_hum_notif.innerHTML="ALARM AT ".concat(value.toFixed(2),"%");
   }
 }
 
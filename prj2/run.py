@@ -1,9 +1,38 @@
+import argparse
+import socket
+import threading
+import time
 import webbrowser
 import server.server
 import os
 
+
+def open_when_listening(url, port, timeout_s=30):
+    """
+    open_when_listening opens `url` in a new browser tab once the server
+    accepts connections on `port`, so the page does not try to connect
+    before the server is up
+    """
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+        except OSError:
+            time.sleep(0.1)
+            continue
+        webbrowser.open(url, new=2)  # open in new tab
+        return
+    print(f"Server not listening on port {port}, not opening {url}")
+
+
+# The server parses the arguments; only the port is needed here
+parser = argparse.ArgumentParser(add_help=False)
+parser.add_argument("--port", type=int, default=8888)
+args, _ = parser.parse_known_args()
+
 cwd = os.getcwd()
 fp = "file://./client/prj2.html"
 url = os.path.join("file://", cwd, "client/prj2.html")
-webbrowser.open(url, new=2)  # open in new tab
+threading.Thread(target=open_when_listening, args=(url, args.port),
+                 daemon=True).start()
 server.server.main()
@@ -0,0 +1,227 @@
+"""
+Alarm rules evaluated over batches of readings
+
+Every rule watches one channel (temperature or humidity) of every sensor
+and turns it into an on/off alarm:
+
+    level:     the reading itself goes above (or below) `limit`
+    rate:      the change per second goes above (or below) `limit`
+    hysteresis once raised, the signal has to come back past
+               limit - hysteresis (limit + hysteresis for 'below') to clear
+    duration:  the condition has to hold for duration_ms before it raises
+
+AlarmEngine.evaluate takes a batch of readings for all sensors and works
+on (rules, sensors, samples) arrays at once, so the cost per batch is a
+fixed number of numpy operations however many rules, sensors and samples
+there are. Only the raised/cleared edges come back, as AlarmEvents
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+CHANNELS = ("temp", "hum")
+KINDS = ("level", "rate")
+DIRECTIONS = ("above", "below")
+
+AlarmEvent = namedtuple(
+    "AlarmEvent", ["rule", "sensor", "timestamp_ms", "value", "raised"])
+
+
+class AlarmRule:
+    """
+    AlarmRule describes one alarm; see the module docstring for the fields
+    """
+
+    def __init__(self, name, channel, limit, direction="above", kind="level",
+                 hysteresis=0.0, duration_ms=0):
+        if channel not in CHANNELS:
+            raise ValueError(f"channel must be one of {CHANNELS}")
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}")
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {DIRECTIONS}")
+        if hysteresis < 0 or duration_ms < 0:
+            raise ValueError("hysteresis and duration must not be negative")
+        self.name = name
+        self.channel = channel
+        self.limit = float(limit)
+        self.direction = direction
+        self.kind = kind
+        self.hysteresis = float(hysteresis)
+        self.duration_ms = int(duration_ms)
+
+
+class AlarmEngine:
+    """
+    AlarmEngine keeps a set of AlarmRules and their state for `sensors`
+    sensors between batches
+    """
+
+    def __init__(self, sensors=1):
+        self.sensors = sensors
+        self.rules = []
+        self.compile()
+        self.reset()
+
+    def add_rule(self, rule):
+        """
+        add_rule adds a rule, replacing any rule with the same name. The
+        new rule starts cleared
+        """
+        self.remove_rule(rule.name)
+        self.rules.append(rule)
+        self.compile()
+        new = np.zeros((1, self.sensors), dtype=bool)
+        self.triggered = np.concatenate((self.triggered, new))
+        self.active = np.concatenate((self.active, new))
+        self.run_start = np.concatenate(
+            (self.run_start, np.zeros((1, self.sensors), dtype=np.int64)))
+
+    def remove_rule(self, name):
+        """
+        remove_rule drops the named rule, if there is one
+
+        Returns:
+        bool: whether a rule was removed
+        """
+        for i, rule in enumerate(self.rules):
+            if rule.name == name:
+                del self.rules[i]
+                self.compile()
+                self.triggered = np.delete(self.triggered, i, axis=0)
+                self.active = np.delete(self.active, i, axis=0)
+                self.run_start = np.delete(self.run_start, i, axis=0)
+                return True
+        return False
+
+    def rearm(self, name):
+        """
+        rearm clears the named rule's state, so it raises again on the next
+        reading past its limit even if it never cleared
+        """
+        for i, rule in enumerate(self.rules):
+            if rule.name == name:
+                self.triggered[i] = False
+                self.active[i] = False
+
+    def set_limit(self, name, limit):
+        for rule in self.rules:
+            if rule.name == name:
+                rule.limit = float(limit)
+        self.compile()
+
+    def compile(self):
+        """
+        compile turns the rules into the per-rule arrays evaluate() uses.
+        'below' rules are evaluated as 'above' on the negated signal
+        """
+        rules = self.rules
+        # Index into the (temp, hum, temp rate, hum rate) signals
+        self.source = np.array(
+            [CHANNELS.index(r.channel) + len(CHANNELS) * KINDS.index(r.kind)
+             for r in rules], dtype=np.intp)
+        self.sign = np.array([1.0 if r.direction == "above" else -1.0
+                              for r in rules])
+        self.set_level = self.sign * np.array([r.limit for r in rules])
+        self.clear_level = self.set_level - np.array(
+            [r.hysteresis for r in rules])
+        self.duration = np.array([r.duration_ms for r in rules],
+                                 dtype=np.int64)
+
+    def reset(self):
+        """
+        reset clears every alarm and forgets the previous batch
+        """
+        shape = (len(self.rules), self.sensors)
+        # Past the hysteresis check, before the duration check
+        self.triggered = np.zeros(shape, dtype=bool)
+        self.active = np.zeros(shape, dtype=bool)
+        # Timestamp at which `triggered` last went on
+        self.run_start = np.zeros(shape, dtype=np.int64)
+        self.last_values = None
+        self.last_ms = None
+
+    def evaluate(self, temps, hums, stamps):
+        """
+        evaluate runs every rule over a batch of readings. temps and hums
+        are (sensors, samples) arrays (or (samples,) for a single sensor)
+        and stamps the epoch-ms time of each sample, shared by all sensors
+
+        Returns:
+        List[AlarmEvent]: raised and cleared edges, oldest first
+        """
+        values = np.stack((np.asarray(temps, dtype=np.float64),
+                           np.asarray(hums, dtype=np.float64)))
+        values = values.reshape(len(CHANNELS), self.sensors, -1)
+        stamps = np.asarray(stamps, dtype=np.int64).reshape(-1)
+        n = values.shape[2]
+        if n == 0:
+            return []
+
+        signals = values
+        if np.any(self.source >= len(CHANNELS)):
+            # Per-second change from the previous sample, carried over from
+            # the previous batch for the first one
+            if self.last_values is None:
+                prev_values = values[:, :, :1]
+                prev_ms = stamps[:1]
+            else:
+                prev_values = self.last_values[:, :, None]
+                prev_ms = np.array([self.last_ms])
+            dv = np.diff(np.concatenate((prev_values, values), axis=2),
+                         axis=2)
+            dt = np.diff(np.concatenate((prev_ms, stamps))).astype(np.float64)
+            rates = np.divide(dv * 1000, dt, out=np.zeros_like(dv),
+                              where=dt > 0)
+            signals = np.concatenate((values, rates))
+        self.last_values = values[:, :, -1].copy()
+        self.last_ms = int(stamps[-1])
+
+        if not self.rules:
+            return []
+
+        # (rules, sensors, samples), signed so every rule fires 'above'
+        signal = signals[self.source]
+        signal *= self.sign[:, None, None]
+
+        # Hysteresis: each sample sets, clears or keeps the state, so the
+        # state is the last set/clear seen, carried forward. Decisions are
+        # packed as 2 * sample + set so a running maximum finds the latest
+        # one, with the state from the previous batch as sample -1
+        sets = signal > self.set_level[:, None, None]
+        decided = sets | (signal < self.clear_level[:, None, None])
+        samples = np.arange(n, dtype=np.int32)
+        code = np.where(decided, 2 * samples + sets,
+                        self.triggered[:, :, None] - np.int32(2))
+        np.maximum.accumulate(code, axis=2, out=code)
+        triggered = (code & 1).astype(bool)
+
+        # Duration: how long `triggered` has been on at each sample
+        was = np.concatenate((self.triggered[:, :, None],
+                              triggered[:, :, :-1]), axis=2)
+        if self.duration.any():
+            start_idx = np.where(triggered & ~was, samples, np.int32(-1))
+            np.maximum.accumulate(start_idx, axis=2, out=start_idx)
+            run_start = np.where(start_idx >= 0,
+                                 stamps[np.maximum(start_idx, 0)],
+                                 self.run_start[:, :, None])
+            active = triggered & (stamps - run_start
+                                  >= self.duration[:, None, None])
+            prev_active = np.concatenate((self.active[:, :, None],
+                                          active[:, :, :-1]), axis=2)
+            self.run_start = run_start[:, :, -1].copy()
+        else:
+            active, prev_active = triggered, was
+
+        edges = np.nonzero(active != prev_active)
+
+        self.triggered = triggered[:, :, -1].copy()
+        self.active = active[:, :, -1].copy()
+
+        events = [AlarmEvent(self.rules[r].name, int(s), int(stamps[t]),
+                             float(signal[r, s, t] * self.sign[r]),
+                             bool(active[r, s, t]))
+                  for r, s, t in zip(*edges)]
+        events.sort(key=lambda event: event.timestamp_ms)
+        return events
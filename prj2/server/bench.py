@@ -0,0 +1,205 @@
+"""
+Benchmark suite for the sensor websocket server
+
+Run from the prj2 directory:
+
+    python -m server.bench --clients 500 --messages 20 --output bench.json
+
+The load test starts the Tornado app in-process on an ephemeral localhost
+port with a throwaway database, opens the requested number of websocket
+clients and has each one send a random mix of requests, waiting for each
+reply before sending the next. It reports overall throughput and
+p50/p95/p99 latency per message type. The microbenchmarks time the sensor,
+database and statistics hot paths on their own. Results are printed (and
+optionally written) as JSON so they can be compared between runs
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.websocket
+
+from . import db
+from . import pseudoSensor
+from . import server
+from . import stats
+
+DEFAULT_MIX = {"data req": 1, "datam req": 1, "calcstats": 1}
+
+
+def percentile(sorted_values, pct):
+    """
+    percentile returns the nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1,
+                      round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies):
+    """
+    summarize turns a list of latencies (seconds) into a dict of
+    millisecond statistics
+    """
+    latencies = sorted(latencies)
+    to_ms = 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * to_ms,
+        "p50_ms": percentile(latencies, 50) * to_ms,
+        "p95_ms": percentile(latencies, 95) * to_ms,
+        "p99_ms": percentile(latencies, 99) * to_ms,
+        "max_ms": latencies[-1] * to_ms,
+    }
+
+
+async def run_client(url, messages, mix, latencies, rng):
+    conn = await tornado.websocket.websocket_connect(url)
+    await conn.read_message()  # greeting
+
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    for kind in rng.choices(kinds, weights, k=messages):
+        start = time.perf_counter()
+        await conn.write_message(kind)
+        await conn.read_message()
+        latencies[kind].append(time.perf_counter() - start)
+
+    conn.close()
+
+
+async def run_load(clients, messages, mix, seed):
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    http_server = tornado.httpserver.HTTPServer(server.make_app())
+    http_server.add_sockets(sockets)
+    url = f"ws://127.0.0.1:{port}/ws/"
+
+    latencies = {kind: [] for kind in mix}
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_client(url, messages, mix, latencies,
+                   random.Random(rng.random()))
+        for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    http_server.stop()
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "clients": clients,
+        "messages_per_client": messages,
+        "elapsed_s": elapsed,
+        "throughput_msg_s": total / elapsed,
+        "types": {kind: summarize(values)
+                  for kind, values in latencies.items() if values},
+    }
+
+
+def time_op(func, number):
+    """
+    time_op runs func `number` times and reports the per-call cost
+    """
+    elapsed = timeit.timeit(func, number=number)
+    return {"ops": number, "us_per_op": elapsed / number * 1e6,
+            "ops_per_s": number / elapsed}
+
+
+def run_micro(tmpdir, scale):
+    results = {}
+
+    sensor = pseudoSensor.PseudoSensor(seed=0)
+    results["generate_values"] = time_op(sensor.generate_values, 10000 * scale)
+    batch = 1000
+    per_batch = time_op(lambda: sensor.generate_batch(batch), 100 * scale)
+    per_batch["readings_per_s"] = per_batch["ops_per_s"] * batch
+    results["generate_batch_1000"] = per_batch
+
+    sensor_db = db.PseudoSensorDb(os.path.join(tmpdir, "micro.db"))
+    sensor_db.create_connection()
+    sensor_db.create_sensor_table()
+    row = (21.5, 40.0, "2024-01-01T00:00:00")
+    results["insert_data"] = time_op(
+        lambda: sensor_db.insert_data(row), 200 * scale)
+    rows = [row] * batch
+    per_batch = time_op(lambda: sensor_db.insert_many(rows), 10 * scale)
+    per_batch["rows_per_s"] = per_batch["ops_per_s"] * batch
+    results["insert_many_1000"] = per_batch
+    results["get_latest_10"] = time_op(sensor_db.get_latest_10, 1000 * scale)
+    sensor_db.close_db()
+
+    engine = stats.SensorStats()
+    engine.seed((i % 50, i % 80) for i in range(engine.max_window))
+    results["stats_update"] = time_op(
+        lambda: engine.update(20.0, 50.0), 10000 * scale)
+    for window in (10, 1000, engine.max_window):
+        engine.stats(window)
+        results[f"stats_query_{window}"] = time_op(
+            lambda: engine.stats(window), 10000 * scale)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=20,
+                        help="messages sent by each client")
+    parser.add_argument("--mix", default=None,
+                        help="weights, e.g. 'data req=2,calcstats=1'")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiplier for microbenchmark iterations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="also write the JSON results here")
+    args = parser.parse_args(argv)
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        mix = {}
+        for part in args.mix.split(","):
+            kind, _, weight = part.partition("=")
+            mix[kind.strip()] = float(weight or 1)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        }
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if not args.skip_micro:
+            results["micro"] = run_micro(tmpdir, args.scale)
+
+        if not args.skip_load:
+            server.configure(os.path.join(tmpdir, "load.db"))
+            results["load"] = asyncio.run(run_load(
+                args.clients, args.messages, mix, args.seed))
+            server.WSHandler.service.close()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""
+Multi-process mode for the sensor server
+
+    python -m server.server --workers 4
+
+The listening socket is bound once and shared by `workers` forked
+websocket processes, so the kernel spreads connections across them. The
+sensor, the writing database connection and the rolling statistics stay
+in one extra hub process, so there is still exactly one producer, one
+writer and one set of statistics no matter how many workers there are.
+Workers talk to the hub over a unix socket with length-prefixed JSON
+messages:
+
+    worker -> hub:  read, calcstats (answered by id), rate, setalarm,
+                    clearalarm, shutdown
+    hub -> worker:  replies, 'readings' batches for the live stream, with
+                    the rate the hub streams at, and 'alarm' events for
+                    the worker's clients
+
+The hub runs the one Broadcaster tick at the fastest rate any worker asked
+for and sends each batch to a worker once; the worker then fans it out to
+its own subscribers. Range statistics and history pages are plain reads,
+so each worker answers them from its own reader connections
+
+Alarm rules are evaluated where the readings are stored, so every client's
+rules live in the hub's AlarmEngine, owned by (worker, client id)
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import time
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.process
+import tornado.tcpserver
+
+from . import alarms
+from . import db
+from . import server
+
+FRAME = struct.Struct(">I")
+
+
+def encode_message(message):
+    """
+    encode_message serializes a message with its length prefix
+
+    Returns:
+    bytes
+    """
+    body = json.dumps(message).encode()
+    return FRAME.pack(len(body)) + body
+
+
+async def read_message(stream):
+    """
+    read_message reads one length-prefixed message from the stream
+
+    Returns:
+    dict
+    """
+    size, = FRAME.unpack(await stream.read_bytes(FRAME.size))
+    return json.loads(await stream.read_bytes(size))
+
+
+class WorkerConnection:
+    """
+    WorkerConnection is the hub's end of one worker's unix socket. It
+    answers the worker's requests and is what the hub's Broadcaster
+    subscribes on the worker's behalf
+    """
+
+    def __init__(self, hub, stream):
+        self.hub = hub
+        self.stream = stream
+        # Worker client ids with alarm rules in the hub's service
+        self.alarm_owners = set()
+
+    def send(self, frame):
+        self.stream.write(frame)
+
+    def send_alarm(self, owner, event):
+        try:
+            self.send(encode_message(
+                {"op": "alarm", "owner": owner, "event": event}))
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    async def serve(self):
+        try:
+            while True:
+                message = await read_message(self.stream)
+                # Requests are answered concurrently; the service still
+                # orders the inserts on its single writer thread
+                tornado.ioloop.IOLoop.current().spawn_callback(
+                    self.handle, message)
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            self.hub.broadcaster.unsubscribe(self)
+            for owner in self.alarm_owners:
+                self.hub.service.remove_alarms((self, owner))
+
+    async def handle(self, message):
+        service = self.hub.service
+        match message:
+            case {"op": "read", "id": request_id}:
+                reply = {"id": request_id, "reading": await service.read()}
+            case {"op": "calcstats", "id": request_id, "window": window}:
+                try:
+                    calcs = await service.cache.result(
+                        ("datacalc", window),
+                        lambda: service.calc_stats(window))
+                    reply = {"id": request_id, "calcs": calcs}
+                except ValueError as e:
+                    reply = {"id": request_id, "error": str(e)}
+            case {"op": "rate", "hz": rate_hz}:
+                if rate_hz > 0:
+                    self.hub.broadcaster.subscribe(self, rate_hz)
+                else:
+                    self.hub.broadcaster.unsubscribe(self)
+                return
+            case {"op": "setalarm", "owner": owner, "name": name,
+                  "fields": fields}:
+                service.add_alarm(
+                    (self, owner), name,
+                    lambda event: self.send_alarm(owner, event), **fields)
+                self.alarm_owners.add(owner)
+                return
+            case {"op": "clearalarm", "owner": owner, "name": name}:
+                if name is None:
+                    service.remove_alarms((self, owner))
+                    self.alarm_owners.discard(owner)
+                else:
+                    service.remove_alarm((self, owner), name)
+                return
+            case {"op": "shutdown"}:
+                service.shutdown()
+                return
+            case _:
+                return
+        try:
+            self.send(encode_message(reply))
+        except tornado.iostream.StreamClosedError:
+            pass
+
+
+class HubBroadcaster(server.Broadcaster):
+    """
+    HubBroadcaster ticks like the single-process Broadcaster, but its
+    subscribers are workers: each batch is encoded once and sent to every
+    worker that has stream subscribers
+    """
+
+    def publish(self, hums, temps, stamps, strnows, stream_hz=None):
+        # Workers thin the stream for their own subscribers, which needs
+        # the rate the hub actually produces, not their local fastest
+        frame = encode_message({"op": "readings", "hums": hums,
+                                "temps": temps, "stamps": stamps,
+                                "strnows": strnows,
+                                "rate_hz": stream_hz or self.rate_hz})
+        for worker in list(self.subscribers):
+            try:
+                worker.send(frame)
+            except tornado.iostream.StreamClosedError:
+                self.unsubscribe(worker)
+
+
+class Hub(tornado.tcpserver.TCPServer):
+    """
+    Hub serves the worker processes from the one SensorService
+    """
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+        self.broadcaster = HubBroadcaster(service)
+
+    async def handle_stream(self, stream, address):
+        await WorkerConnection(self, stream).serve()
+
+
+class RemoteSensorService:
+    """
+    RemoteSensorService stands in for SensorService inside a worker.
+    Readings and rolling statistics come from the hub; range statistics
+    and history pages are read from the database directly
+    """
+
+    connect_timeout = 10
+    retry_seconds = 0.05
+
+    def __init__(self, path, db_name, storage="sqlite"):
+        self.path = path
+        self.sensor_db = db.AsyncPseudoSensorDb(
+            db_name, db_class=server.STORAGE[storage])
+        self.stream = None
+        self.pending = {}
+        self.next_id = 0
+        self.started = None
+        self.on_readings = None
+        # Client id -> alarm listener, for the events the hub sends back
+        self.alarm_listeners = {}
+        # Readings are stored by the hub, so there is no local version
+        # to cache on; see StatsCache
+        self.version = None
+        self.cache = server.StatsCache(self)
+
+    def start(self):
+        """
+        start connects to the hub once. Every call returns the same
+        awaitable
+        """
+        if self.started is None:
+            self.started = asyncio.ensure_future(self._connect())
+        return self.started
+
+    async def _connect(self):
+        # The hub only listens once its database is ready, so keep trying
+        # until then
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            stream = tornado.iostream.IOStream(
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+            try:
+                await stream.connect(self.path)
+                break
+            except tornado.iostream.StreamClosedError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(self.retry_seconds)
+        self.stream = stream
+        tornado.ioloop.IOLoop.current().spawn_callback(self.read_replies)
+
+    async def read_replies(self):
+        try:
+            while True:
+                message = await read_message(self.stream)
+                if "id" in message:
+                    future = self.pending.pop(message["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif message.get("op") == "readings" and self.on_readings:
+                    self.on_readings(message["hums"], message["temps"],
+                                     message["stamps"], message["strnows"],
+                                     message["rate_hz"])
+                elif message.get("op") == "alarm":
+                    listener = self.alarm_listeners.get(message["owner"])
+                    if listener is not None:
+                        listener(alarms.AlarmEvent(*message["event"]))
+        except tornado.iostream.StreamClosedError:
+            pass
+
+        # Without the hub there are no readings to serve, so the worker
+        # stops too
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(tornado.iostream.StreamClosedError())
+        self.pending.clear()
+        tornado.ioloop.IOLoop.current().stop()
+
+    async def request(self, op, **fields):
+        """
+        request sends a request to the hub and waits for its reply
+
+        Returns:
+        dict
+        """
+        await self.start()
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = future
+        self.stream.write(encode_message(
+            {"op": op, "id": self.next_id, **fields}))
+        reply = await future
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return reply
+
+    async def read(self):
+        reply = await self.request("read")
+        return tuple(reply["reading"])
+
+    async def calc_stats(self, window=None):
+        reply = await self.request("calcstats", window=window)
+        return reply["calcs"]
+
+    async def range_stats(self, start, end):
+        return await self.sensor_db.get_stats(start, end)
+
+    async def get_page(self, start, end, after, limit):
+        return await self.sensor_db.get_page(start, end, after, limit)
+
+    def set_rate(self, rate_hz):
+        self.stream.write(encode_message({"op": "rate", "hz": rate_hz}))
+
+    def add_alarm(self, owner, name, listener, **fields):
+        # Checked here, so a bad rule fails for the client, not in the hub
+        alarms.AlarmRule(name, **fields)
+        self.alarm_listeners[id(owner)] = listener
+        self.stream.write(encode_message(
+            {"op": "setalarm", "owner": id(owner), "name": name,
+             "fields": fields}))
+
+    def remove_alarm(self, owner, name):
+        self.stream.write(encode_message(
+            {"op": "clearalarm", "owner": id(owner), "name": name}))
+
+    def remove_alarms(self, owner):
+        if self.alarm_listeners.pop(id(owner), None) is not None:
+            self.remove_alarm(owner, None)
+
+    def shutdown(self):
+        self.stream.write(encode_message({"op": "shutdown"}))
+
+    def close(self):
+        self.sensor_db.close_db()
+        if self.stream is not None:
+            self.stream.close()
+
+
+class RelayBroadcaster(server.Broadcaster):
+    """
+    RelayBroadcaster is a worker's Broadcaster. It never ticks itself:
+    it asks the hub for the fastest rate its own subscribers want and
+    publishes the batches the hub sends back, thinned against the rate the
+    hub streams at, which other workers' subscribers may have raised
+    """
+
+    def update_rate(self):
+        rate_hz = max(self.subscribers.values(), default=0)
+        if rate_hz != self.rate_hz:
+            self.rate_hz = rate_hz
+            self.service.set_rate(rate_hz)
+
+
+def run_hub(path, db_name, storage, retention):
+    service = server.SensorService(db_name, storage=storage,
+                                   retention=retention)
+    hub = Hub(service)
+
+    async def start():
+        await service.start()
+        hub.add_socket(tornado.netutil.bind_unix_socket(path))
+
+    loop = tornado.ioloop.IOLoop.current()
+    loop.run_sync(start)
+    loop.start()
+    service.close()
+
+
+def run_worker(sockets, path, db_name, storage):
+    service = RemoteSensorService(path, db_name, storage)
+    broadcaster = RelayBroadcaster(service)
+    service.on_readings = broadcaster.publish
+    server.WSHandler.service = service
+    server.WSHandler.broadcaster = broadcaster
+
+    loop = tornado.ioloop.IOLoop.current()
+    loop.run_sync(service.start)
+    http_server = tornado.httpserver.HTTPServer(server.make_app())
+    http_server.add_sockets(sockets)
+    loop.start()
+    service.close()
+
+
+def serve(workers, port, db_name, storage="sqlite", retention=None):
+    """
+    serve runs the hub and `workers` websocket processes until a client
+    sends 'shutdown'. It has to be called before any IOLoop is created.
+    The hub owns the database, so it also enforces `retention`
+    """
+    sockets = tornado.netutil.bind_sockets(port, address="localhost")
+    sock_dir = tempfile.mkdtemp(prefix="sensor-hub-")
+    path = os.path.join(sock_dir, "hub.sock")
+
+    hub_pid = os.fork()
+    if hub_pid == 0:
+        for sock in sockets:
+            sock.close()
+        try:
+            run_hub(path, db_name, storage, retention)
+        finally:
+            os._exit(0)
+
+    print(f"Starting a server on localhost:{port} with {workers} workers")
+    parent = os.getpid()
+    try:
+        tornado.process.fork_processes(workers)
+        run_worker(sockets, path, db_name, storage)
+    finally:
+        # fork_processes returns in the workers and exits in the parent
+        # once they are all gone. Its os.wait() may already have reaped
+        # the hub
+        if os.getpid() == parent:
+            try:
+                os.kill(hub_pid, signal.SIGTERM)
+                os.waitpid(hub_pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            shutil.rmtree(sock_dir, ignore_errors=True)
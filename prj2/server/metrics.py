@@ -0,0 +1,152 @@
+"""
+Minimal in-process metrics for the sensor server, exposed in the
+Prometheus text format
+
+Recording a sample is a dict lookup and an add (plus a bisect for
+histograms); all formatting is deferred to render(), which only runs when
+/metrics is scraped
+"""
+
+import bisect
+import math
+
+# Seconds, from sub-millisecond handler work up to a stalled disk
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Counter is a monotonically increasing count, optionally split by labels
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name + format_labels(self.label_names, label_values), \
+                value
+
+
+class Gauge(Counter):
+    """
+    Gauge is a value that goes up and down. It can also be backed by a
+    function, which is then only called when the metrics are rendered
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self.func = func
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        if self.func is not None:
+            yield self.name, self.func()
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    """
+    Histogram counts observations into fixed buckets and keeps their sum,
+    which is enough for Prometheus to estimate percentiles
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # One count per bucket plus +Inf, then the running sum
+            series = self.series[label_values] = \
+                [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield self.name + "_bucket" + format_labels(
+                    self.label_names, label_values, le), cumulative
+            labels = format_labels(self.label_names, label_values)
+            yield self.name + "_sum" + labels, series[-1]
+            yield self.name + "_count" + labels, cumulative
+
+
+class Registry:
+    """
+    Registry holds the metrics of one process and renders them
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """
+        render formats every metric in the Prometheus text exposition format
+
+        Returns:
+        str
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
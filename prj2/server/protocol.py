@@ -0,0 +1,72 @@
+"""
+Binary websocket protocol for the sensor server
+
+Clients opt in by offering the SUBPROTOCOL websocket subprotocol when they
+connect; everyone else keeps the text protocol. Every binary frame is a
+4 byte header followed by `count` fixed-width little-endian records:
+
+    header:  uint8 message type, 1 pad byte, uint16 record count
+    reading: float32 humidity, float32 temperature, int64 epoch ms
+    stats:   float32 min/max/avg temperature, min/max/avg humidity
+"""
+
+import struct
+import numpy as np
+
+SUBPROTOCOL = "sensor.bin.v1"
+
+MSG_DATA = 1
+MSG_DATAM = 2
+MSG_DATACALC = 3
+MSG_DATARANGE = 4
+MSG_HISTORY = 5
+
+HEADER = struct.Struct("<BxH")
+STATS = struct.Struct("<6f")
+READING = np.dtype([("hum", "<f4"), ("temp", "<f4"), ("ts", "<i8")])
+
+# The count is a uint16, so one frame carries at most this many records
+MAX_RECORDS = 0xFFFF
+
+
+def encode_readings(msg_type, hums, temps, timestamps):
+    """
+    encode_readings packs parallel humidity, temperature and epoch-ms
+    sequences into one frame
+
+    Returns:
+    bytes
+    """
+    records = np.empty(len(hums), dtype=READING)
+    records["hum"] = hums
+    records["temp"] = temps
+    records["ts"] = timestamps
+    return HEADER.pack(msg_type, len(records)) + records.tobytes()
+
+
+def encode_stats(msg_type, calcs):
+    """
+    encode_stats packs [(min, max, avg) of temperature, (min, max, avg) of
+    humidity] into one frame
+
+    Returns:
+    bytes
+    """
+    (min_temp, max_temp, avg_temp), (min_hum, max_hum, avg_hum) = calcs
+    return HEADER.pack(msg_type, 1) + STATS.pack(
+        min_temp, max_temp, avg_temp, min_hum, max_hum, avg_hum)
+
+
+def decode(frame):
+    """
+    decode splits a frame into its message type and records, as a numpy
+    structured array for readings or a tuple of six floats for stats
+
+    Returns:
+    Tuple[int, ndarray | Tuple[float, ...]]
+    """
+    msg_type, count = HEADER.unpack_from(frame)
+    if msg_type in (MSG_DATACALC, MSG_DATARANGE):
+        return msg_type, STATS.unpack_from(frame, HEADER.size)
+    return msg_type, np.frombuffer(frame, dtype=READING, count=count,
+                                   offset=HEADER.size)
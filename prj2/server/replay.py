@@ -0,0 +1,342 @@
+"""
+Replay of recorded readings through the websocket server
+
+Run from the prj2 directory:
+
+    python -m server.server --replay recorded.db --speed 10 --db replay.db
+
+ReplaySensor stands in for PseudoSensor: instead of random values it hands
+out the readings stored in a PseudoSensorDb file, a column store directory
+or a file written by server.transfer, oldest first. ReplayBroadcaster
+takes the place of Broadcaster and sets the pace: each reading is stored
+and pushed to subscribers when its turn comes, at the recorded cadence
+(--speed 1), N times faster (--speed N) or as fast as the server can store
+them (--speed 0). The replayed readings keep their recorded spacing and
+are shifted to start when the replay does, so alarm rates and statistics
+see the same intervals production did.
+
+A prefetch thread reads the recording batch_size rows at a time into a
+bounded queue, so the database or file is read ahead of the broadcast
+instead of in its path. Stalls count the times the replay was due more
+readings than had been prefetched; anything but 0 means replay I/O held
+the broadcast back
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import tornado.ioloop
+
+from . import colstore
+from . import db
+from . import metrics
+from . import protocol
+from . import server
+from . import transfer
+
+REPLAYED = metrics.REGISTRY.counter(
+    "sensor_replay_readings_total", "Recorded readings replayed")
+STALLS = metrics.REGISTRY.counter(
+    "sensor_replay_stalls_total",
+    "Times the replay was due readings that were not prefetched yet")
+
+
+def read_recording(source, batch_size):
+    """
+    read_recording streams a recording oldest first: a file written by
+    server.transfer, a column store directory or a PseudoSensorDb file.
+    The recording is only read, never created or migrated
+
+    Yields:
+    Tuple[ndarray, ndarray, ndarray]: epoch-ms timestamps, temperatures
+    and humidities of each batch
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"no recording at {source}")
+    try:
+        batches = transfer.read_file(source, batch_size)
+    except ValueError:
+        batches = None
+    if batches is not None:
+        for rows in batches:
+            temps, hums, _, stamps = zip(*rows)
+            yield (np.array(stamps, dtype=np.int64), np.array(temps),
+                   np.array(hums))
+        return
+
+    if os.path.isdir(source):
+        if not os.path.exists(os.path.join(source, "meta.json")):
+            raise ValueError(f"{source} is not a column store")
+        sensor_db = colstore.ColumnStoreDb(source)
+        sensor_db.create_connection()
+    else:
+        sensor_db = db.PseudoSensorDb(source)
+        sensor_db.create_connection(read_only=True)
+        version = sensor_db.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < db.SCHEMA_VERSION:
+            sensor_db.close_db()
+            raise ValueError(f"{source} has an older schema; open it with "
+                             "the server once to migrate it")
+    try:
+        for rows in transfer.batched(
+                sensor_db.iter_range(0, 2**62, batch_size), batch_size):
+            _, temps, hums, _, stamps = zip(*rows)
+            yield (np.array(stamps, dtype=np.int64), np.array(temps),
+                   np.array(hums))
+    finally:
+        sensor_db.close_db()
+
+
+class ReplaySensor:
+    """
+    ReplaySensor hands out the readings of a recording through the
+    PseudoSensor interface. speed is the speed-up over the recorded
+    cadence; None replays as fast as possible
+    """
+
+    def __init__(self, source, speed=1.0, batch_size=10000, prefetch=4):
+        self.source = source
+        self.speed = speed
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self.prefetch, daemon=True)
+        # Prefetched readings not handed out yet
+        self.stamps = np.empty(0, dtype=np.int64)
+        self.temps = np.empty(0)
+        self.hums = np.empty(0)
+        self.exhausted = False
+        # The replay clock starts with the first reading that is handed out
+        self.started = None
+        self.started_ms = 0
+        self.first_ms = 0
+        self.last_ms = 0
+        self.replayed = 0
+        self.stalls = 0
+        self.humVal = 0.0
+        self.tempVal = 0.0
+
+    def start(self):
+        self.thread.start()
+
+    def prefetch(self):
+        try:
+            for batch in read_recording(self.source, self.batch_size):
+                self.queue.put(batch)
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    async def wait_ready(self):
+        """
+        wait_ready waits for the first prefetched batch on an executor
+        thread, so opening the recording does not hold up the IOLoop
+        """
+        if not len(self.stamps):
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.fill, True)
+
+    def fill(self, block=False):
+        """
+        fill appends the next prefetched batch to the readings not handed
+        out yet
+
+        Returns:
+        bool: whether a batch was added
+        """
+        if self.exhausted:
+            return False
+        try:
+            batch = self.queue.get(block)
+        except queue.Empty:
+            return False
+        if batch is None:
+            self.exhausted = True
+            return False
+        if isinstance(batch, Exception):
+            self.exhausted = True
+            raise batch
+        self.stamps, self.temps, self.hums = (
+            np.concatenate((old, new)) for old, new in
+            zip((self.stamps, self.temps, self.hums), batch))
+        return True
+
+    @property
+    def finished(self):
+        return self.exhausted and not len(self.stamps)
+
+    def recorded_now(self):
+        """
+        recorded_now is the point in the recording the replay clock has
+        reached, in recorded epoch milliseconds
+        """
+        if self.speed is None:
+            return float("inf")
+        if self.started is None:
+            return float("-inf")
+        return self.first_ms \
+            + (time.monotonic() - self.started) * 1000 * self.speed
+
+    def due(self):
+        """
+        due counts the readings whose turn has come. Once the clock has
+        started, running out of prefetched readings while more are due
+        counts as a stall
+
+        Returns:
+        int
+        """
+        if self.started is None:
+            return min(1, len(self.stamps))
+
+        target = self.recorded_now()
+        while not self.exhausted:
+            if self.speed is None:
+                # Flat out, a batch at hand is enough
+                wanted = len(self.stamps) < self.batch_size
+                stalled = not len(self.stamps)
+            else:
+                wanted = not len(self.stamps) or self.stamps[-1] <= target
+                stalled = True
+            if not wanted:
+                break
+            if not self.fill():
+                if stalled and not self.exhausted:
+                    self.stalls += 1
+                    STALLS.inc()
+                break
+        if self.speed is None:
+            return len(self.stamps)
+        return int(np.searchsorted(self.stamps, target, "right"))
+
+    def wait_s(self):
+        """
+        wait_s is the time until the next reading is due
+
+        Returns:
+        float: seconds, 0 if one is due or the replay runs flat out
+        """
+        if self.speed is None or self.started is None \
+                or not len(self.stamps):
+            return 0.0
+        return max(0.0, (self.stamps[0] - self.recorded_now())
+                   / 1000 / self.speed)
+
+    def generate_batch(self, n, start_ms=None, period_ms=1000):
+        """
+        generate_batch hands out the next n recorded readings. start_ms and
+        period_ms are ignored: the timestamps are the recorded ones, shifted
+        to start when the replay started
+
+        Returns:
+        Tuple[ndarray, ndarray, ndarray]: humidity, temperature (float64)
+        and epoch-millisecond timestamps (int64)
+        """
+        while len(self.stamps) < n and self.fill(block=True):
+            pass
+        stamps, temps, hums = (self.stamps[:n], self.temps[:n],
+                               self.hums[:n])
+        self.stamps, self.temps, self.hums = (self.stamps[n:],
+                                              self.temps[n:], self.hums[n:])
+        if not len(stamps):
+            return hums, temps, stamps
+        if self.started is None:
+            self.started = time.monotonic()
+            self.started_ms = int(time.time() * 1000)
+            self.first_ms = int(stamps[0])
+
+        self.replayed += len(stamps)
+        REPLAYED.inc(len(stamps))
+        self.last_ms = int(stamps[-1])
+        self.humVal = float(hums[-1])
+        self.tempVal = float(temps[-1])
+        return hums, temps, stamps - self.first_ms + self.started_ms
+
+    def generate_values(self):
+        """
+        generate_values returns the latest replayed reading, like reading
+        the sensor's current value. Before the replay starts that is the
+        first recorded reading, once it has been prefetched
+
+        Returns:
+        Tuple[float, float]: humidity, temperature
+        """
+        if self.started is None and len(self.stamps):
+            return float(self.hums[0]), float(self.temps[0])
+        return self.humVal, self.tempVal
+
+    def report(self):
+        """
+        report describes the progress of the replay
+
+        Returns:
+        dict: readings replayed, seconds since the start, the achieved
+        readings per second and speed-up over the recording, and stalls
+        """
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "replayed": self.replayed,
+            "elapsed_s": round(elapsed, 3),
+            "rate_hz": round(self.replayed / elapsed, 1) if elapsed else 0.0,
+            "speedup": round((self.last_ms - self.first_ms) / 1000 / elapsed,
+                             2) if elapsed else 0.0,
+            "stalls": self.stalls,
+        }
+
+
+class ReplayBroadcaster(server.Broadcaster):
+    """
+    ReplayBroadcaster stores and pushes the recorded readings when they are
+    due, at most protocol.MAX_RECORDS per batch, instead of generating them
+    at the fastest subscriber's rate; a subscriber's rate counts in
+    recorded time. It prints a report every report_s seconds and once the
+    recording is done
+    """
+
+    report_s = 10
+
+    def update_rate(self):
+        # The recording sets the pace, not the subscribers
+        pass
+
+    def start(self):
+        self.service.sensor.start()
+        asyncio.ensure_future(self.run())
+
+    async def run(self):
+        await self.service.start()
+        sensor = self.service.sensor
+        await sensor.wait_ready()
+        tick_s = 1 / self.max_tick_hz
+        next_report = time.monotonic() + self.report_s
+        while not sensor.finished:
+            count = min(sensor.due(), protocol.MAX_RECORDS)
+            if count:
+                readings = await self.service.read_batch(count, 0)
+                self.publish(*readings)
+            else:
+                await asyncio.sleep(min(sensor.wait_s(), tick_s) or tick_s)
+            if time.monotonic() >= next_report:
+                next_report += self.report_s
+                print(f"Replay: {sensor.report()}")
+        print(f"Replay finished: {sensor.report()}")
+
+
+def replay(service, source, speed=1.0, batch_size=10000):
+    """
+    replay makes `service` replay `source` instead of generating readings.
+    speed 0 replays as fast as possible. The replay starts with the IOLoop
+
+    Returns:
+    ReplayBroadcaster: to use in place of the service's Broadcaster
+    """
+    service.sensor = ReplaySensor(source, speed or None, batch_size)
+    # The output database should hold exactly the recording, so a client's
+    # 'data req' gets the latest replayed reading instead of storing one
+    service.record_reads = False
+    broadcaster = ReplayBroadcaster(service)
+    tornado.ioloop.IOLoop.current().add_callback(broadcaster.start)
+    return broadcaster
@@ -4,77 +4,966 @@ import tornado.ioloop
 import tornado.web
 import tornado.httpserver
 from . import pseudoSensor
+import argparse
+import asyncio
+import collections
 import datetime
+import functools
+import json
+import os
+import time
+from . import alarms
+from . import colstore
 from . import db
+from . import metrics
+from . import protocol
+from . import stats
+
+# Message types get their own label; anything else is counted as unknown
+MESSAGE_TYPES = ("data", "datam", "shutdown", "calcstats", "rangestats",
+                 "subscribe", "unsubscribe", "setalarm", "clearalarm")
+
+MESSAGES = metrics.REGISTRY.counter(
+    "sensor_ws_messages_total", "Websocket messages received, by type",
+    labels=("type",))
+MESSAGE_SECONDS = metrics.REGISTRY.histogram(
+    "sensor_ws_message_seconds", "Time to handle a websocket message",
+    labels=("type",))
+DB_WRITE_SECONDS = metrics.REGISTRY.histogram(
+    "sensor_db_write_seconds",
+    "Time to insert and commit readings, including the writer queue")
+STATS_SECONDS = metrics.REGISTRY.histogram(
+    "sensor_stats_query_seconds", "Time to answer a statistics query",
+    labels=("kind",))
+ALARM_SECONDS = metrics.REGISTRY.histogram(
+    "sensor_alarm_eval_seconds",
+    "Time to evaluate every alarm rule over a batch of readings")
+RETENTION_SECONDS = metrics.REGISTRY.histogram(
+    "sensor_retention_chunk_seconds",
+    "Time the writer spends expiring one chunk of old readings")
+SEND_DROPPED = metrics.REGISTRY.counter(
+    "sensor_ws_send_dropped_total",
+    "Outbound messages discarded for slow clients, by policy",
+    labels=("policy",))
+SLOW_CLOSED = metrics.REGISTRY.counter(
+    "sensor_ws_slow_closed_total",
+    "Websockets closed for staying over the send queue high-water mark")
+
+# Storage backends with the PseudoSensorDb interface, for --storage
+STORAGE = {"sqlite": db.PseudoSensorDb, "columnar": colstore.ColumnStoreDb}
+
+# What a full send queue does: drop the oldest queued message, or also keep
+# at most one queued stream frame, overwritten by each newer one
+SEND_POLICIES = ("drop-oldest", "coalesce")
+
+
+def discard_result(future):
+    if not future.cancelled():
+        future.exception()
+
+
+def stats_frame(kind, calcs, binary):
+    """
+    stats_frame serializes a 'datacalc' or 'datarange' reply
+
+    Returns:
+    bytes
+    """
+    if calcs is None:
+        calcs = [(0, 0, 0), (0, 0, 0)]
+    if binary:
+        msg_type = {"datacalc": protocol.MSG_DATACALC,
+                    "datarange": protocol.MSG_DATARANGE}[kind]
+        return protocol.encode_stats(msg_type, calcs)
+    (min_temp, max_temp, avg_temp), (min_hum, max_hum, avg_hum) = calcs
+    return (f"{kind} {min_temp},{max_temp},{avg_temp},"
+            f"{min_hum},{max_hum},{avg_hum}").encode()
+
+
+class StatsCache:
+    """
+    StatsCache shares statistics results, and the frames they are sent as,
+    between clients until the service stores its next reading
+
+    Results are keyed on (kind, arguments) and kept for the service's
+    current `version`, which advances with every stored reading, so an
+    insert invalidates everything at once. Concurrent requests for the same
+    key wait on the one computation already in flight. A service without a
+    version (a worker of the multi-process server, which does not see
+    every insert) gets the single-flight part only
+    """
+
+    max_entries = 1024
+
+    def __init__(self, service):
+        self.service = service
+        self.version = None
+        self.results = {}
+        self.frames = {}
+
+    def sync(self):
+        version = self.service.version
+        if version != self.version or len(self.results) >= self.max_entries:
+            self.results.clear()
+            self.frames.clear()
+            self.version = version
+
+    def result(self, key, compute):
+        """
+        result returns the awaitable result for key, starting compute()
+        only if no request for the same key and version is cached or in
+        flight
+
+        Returns:
+        Future
+        """
+        self.sync()
+        future = self.results.get(key)
+        if future is None:
+            future = self.results[key] = asyncio.ensure_future(compute())
+            future.add_done_callback(
+                lambda done: self.settled(key, done))
+        return future
+
+    def settled(self, key, future):
+        # Failures are not kept, and without a version a result cannot be
+        # reused once it has been handed out
+        failed = future.cancelled() or future.exception() is not None
+        if (failed or self.service.version is None) \
+                and self.results.get(key) is future:
+            del self.results[key]
+
+    def frame(self, key, future, binary):
+        """
+        frame serializes a finished result from result() in either
+        protocol, once per version
+
+        Returns:
+        bytes
+        """
+        if self.results.get(key) is not future:
+            # Superseded by an insert while it was awaited
+            return stats_frame(key[0], future.result(), binary)
+        frame = self.frames.get((key, binary))
+        if frame is None:
+            frame = stats_frame(key[0], future.result(), binary)
+            self.frames[(key, binary)] = frame
+        return frame
+
+
+class SensorService:
+    """
+    SensorService owns the sensor, the database and the rolling statistics.
+    Every reading is generated, persisted and counted here exactly once,
+    whether one client asked for it or it was produced for the stream
+    """
+
+    def __init__(self, db_name, sensor=None, storage="sqlite",
+                 retention=None):
+        self.sensor = sensor or pseudoSensor.PseudoSensor()
+        self.sensor_db = db.AsyncPseudoSensorDb(
+            db_name, db_class=STORAGE[storage])
+        # Enforces a db.RetentionPolicy once started, if one is given
+        self.retention = Retention(self, retention) if retention else None
+        self.sensor_stats = stats.SensorStats()
+        self.started = None
+        # Id of the latest stored reading, for StatsCache
+        self.version = 0
+        self.cache = StatsCache(self)
+        # Every client's alarm rules, named (owner, name), and the callback
+        # each owner gets its events through
+        self.alarms = alarms.AlarmEngine()
+        self.alarm_listeners = {}
+        # False while something else, such as a replay, decides what is
+        # stored; read then answers with the latest stored reading
+        self.record_reads = True
+
+    def start(self):
+        """
+        start opens the database and seeds the rolling statistics once.
+        Every call returns the same awaitable
+        """
+        if self.started is None:
+            self.started = asyncio.ensure_future(self._start())
+        return self.started
+
+    async def _start(self):
+        await self.sensor_db.start()
+        # Read on the writer thread so the snapshot is ordered with inserts:
+        # anything committed before it is in the rows, anything after it is
+        # pushed by read/read_batch once seed() has reset the engine
+        rows = await self.sensor_db.run_write(
+            "get_latest", self.sensor_stats.max_window)
+        self.sensor_stats.seed((row[1], row[2]) for row in reversed(rows))
+        self.version = rows[0][0] if rows else 0
+        if self.retention is not None:
+            self.retention.start()
+
+    async def read(self):
+        """
+        read generates one reading, stores it and adds it to the statistics.
+        Without record_reads it stores nothing and returns the latest
+        stored reading instead
+
+        Returns:
+        Tuple[float, float, str, int]: humidity, temperature, ISO datetime
+        and epoch milliseconds
+        """
+        if not self.record_reads:
+            return await self.latest()
+        hum, temp = self.sensor.generate_values()
+        now = datetime.datetime.now()
+        strnow = now.strftime("%Y-%m-%dT%H:%M:%S")
+        timestamp_ms = int(now.timestamp() * 1000)
+        db_data = (temp, hum, strnow, timestamp_ms)
+        started = time.perf_counter()
+        await self.sensor_db.insert_data(db_data)
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+        self.sensor_stats.update(temp, hum)
+        self.version += 1
+        self.check_alarms([temp], [hum], [timestamp_ms])
+        return hum, temp, strnow, timestamp_ms
+
+    async def latest(self):
+        """
+        latest returns the latest stored reading, or the sensor's current
+        values at the current time if nothing is stored yet
+
+        Returns:
+        Tuple[float, float, str, int]: as read
+        """
+        await self.start()
+        rows = await self.sensor_db.get_latest(1)
+        if rows:
+            _, temp, hum, strnow, timestamp_ms = rows[0]
+            return hum, temp, strnow, timestamp_ms
+        hum, temp = self.sensor.generate_values()
+        now = datetime.datetime.now()
+        return (hum, temp, now.strftime("%Y-%m-%dT%H:%M:%S"),
+                int(now.timestamp() * 1000))
+
+    async def read_batch(self, count, period_ms):
+        """
+        read_batch generates `count` readings spaced period_ms apart and
+        ending now, stores them in one transaction and adds them to the
+        statistics
+
+        Returns:
+        Tuple[list, list, list, list]: humidities, temperatures, epoch
+        milliseconds and ISO datetimes
+        """
+        start_ms = time.time() * 1000 - (count - 1) * period_ms
+        hums, temps, stamps = self.sensor.generate_batch(
+            count, start_ms=int(start_ms), period_ms=period_ms)
+        hums, temps, stamps = hums.tolist(), temps.tolist(), stamps.tolist()
+        strnows = [datetime.datetime.fromtimestamp(ms / 1000)
+                   .strftime("%Y-%m-%dT%H:%M:%S") for ms in stamps]
+
+        started = time.perf_counter()
+        await self.sensor_db.insert_many(zip(temps, hums, strnows, stamps))
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+        for hum, temp in zip(hums, temps):
+            self.sensor_stats.update(temp, hum)
+        self.version += count
+        self.check_alarms(temps, hums, stamps)
+        return hums, temps, stamps, strnows
+
+    async def calc_stats(self, window=None):
+        return self.sensor_stats.stats(window)
+
+    async def range_stats(self, start, end):
+        return await self.sensor_db.get_stats(start, end)
+
+    async def get_page(self, start, end, after, limit):
+        await self.start()
+        return await self.sensor_db.get_page(start, end, after, limit)
+
+    def add_alarm(self, owner, name, listener, **fields):
+        """
+        add_alarm adds or replaces `owner`'s alarm rule `name`, made from
+        the AlarmRule fields. Its events go to listener(event) with just
+        `name` as the rule. Raises ValueError for invalid fields
+        """
+        self.alarms.add_rule(alarms.AlarmRule((owner, name), **fields))
+        self.alarm_listeners[owner] = listener
+
+    def remove_alarm(self, owner, name):
+        self.alarms.remove_rule((owner, name))
+
+    def remove_alarms(self, owner):
+        """
+        remove_alarms drops every rule of `owner`, e.g. a closed connection
+        """
+        if self.alarm_listeners.pop(owner, None) is None:
+            return
+        for rule in list(self.alarms.rules):
+            if rule.name[0] == owner:
+                self.alarms.remove_rule(rule.name)
+
+    def check_alarms(self, temps, hums, stamps):
+        """
+        check_alarms runs every client's rules over newly stored readings
+        in one pass and hands each event to the rule owner's listener
+        """
+        started = time.perf_counter()
+        events = self.alarms.evaluate(temps, hums, stamps)
+        ALARM_SECONDS.observe(time.perf_counter() - started)
+        for event in events:
+            owner, name = event.rule
+            # A listener may have dropped its owner's rules for an earlier
+            # event, when its connection was closing
+            listener = self.alarm_listeners.get(owner)
+            if listener is not None:
+                listener(event._replace(rule=name))
+
+    def shutdown(self):
+        tornado.ioloop.IOLoop.current().stop()
+
+    def close(self):
+        self.sensor_db.close_db()
+
+
+class Retention:
+    """
+    Retention expires old readings according to a db.RetentionPolicy, one
+    pass every interval_s. Each chunk is a separate call on the writer
+    thread, so inserts queued behind it wait for one chunk, not for the
+    whole pass
+    """
+
+    def __init__(self, service, policy):
+        self.service = service
+        self.policy = policy
+        self.callback = None
+
+    def start(self):
+        self.callback = tornado.ioloop.PeriodicCallback(
+            self.run, self.policy.interval_s * 1000)
+        self.callback.start()
+
+    async def run(self):
+        """
+        run expires everything that is due, archiving it first if the
+        policy has an archive directory, then gives the freed space back
+        """
+        policy = self.policy
+        sensor_db = self.service.sensor_db
+        archive = None
+        if policy.archive_dir:
+            archive = db.RowArchive(policy.archive_dir)
+        try:
+            while True:
+                started = time.perf_counter()
+                count = await sensor_db.run_write(
+                    "expire_chunk", policy.max_age_ms, policy.max_rows,
+                    policy.chunk_rows, archive)
+                RETENTION_SECONDS.observe(time.perf_counter() - started)
+                if not count:
+                    break
+            while await sensor_db.run_write("incremental_vacuum",
+                                            policy.chunk_rows):
+                pass
+        finally:
+            if archive is not None:
+                archive.close()
+
+
+class Broadcaster:
+    """
+    Broadcaster pushes readings to every subscribed client from a single
+    PeriodicCallback
+
+    Each tick generates the readings that are due, serializes each frame
+    once, writes the same bytes to every subscriber and persists the
+    readings once, so the cost per tick does not depend on how many clients
+    are listening. The stream rate is the fastest rate any subscriber asked
+    for; slower subscribers get every reading that falls due at their own
+    rate, judged by the readings' timestamps. Above max_tick_hz a tick
+    carries several readings, which binary subscribers get as a single
+    frame
+    """
+
+    max_rate_hz = 1000
+    max_tick_hz = 50
+
+    def __init__(self, service):
+        self.service = service
+        self.subscribers = {}
+        # Epoch ms from which each slower subscriber's next reading is due
+        self.next_due = {}
+        self.rate_hz = 0
+        self.callback = None
+        self.started = 0.0
+        self.produced = 0
+
+    def subscribe(self, client, rate_hz):
+        self.subscribers[client] = min(rate_hz, self.max_rate_hz)
+        self.next_due.setdefault(client, 0)
+        self.update_rate()
+
+    def unsubscribe(self, client):
+        self.next_due.pop(client, None)
+        if self.subscribers.pop(client, None) is not None:
+            self.update_rate()
+
+    def update_rate(self):
+        """
+        update_rate restarts the PeriodicCallback when the fastest
+        subscriber rate changes, and stops it once nobody is subscribed
+        """
+        rate_hz = max(self.subscribers.values(), default=0)
+        if rate_hz == self.rate_hz:
+            return
+
+        self.rate_hz = rate_hz
+        if self.callback is not None:
+            self.callback.stop()
+            self.callback = None
+        if rate_hz > 0:
+            self.started = time.monotonic()
+            self.produced = 0
+            self.callback = tornado.ioloop.PeriodicCallback(
+                self.tick, 1000 / min(rate_hz, self.max_tick_hz))
+            self.callback.start()
+
+    async def tick(self):
+        # Readings due are worked out from the elapsed time, so the stream
+        # keeps its rate even when a tick fires late
+        elapsed = time.monotonic() - self.started
+        count = int(elapsed * self.rate_hz) + 1 - self.produced
+        if count <= 0:
+            return
+        count = min(count, protocol.MAX_RECORDS)
+        self.produced += count
+
+        readings = await self.service.read_batch(count, 1000 / self.rate_hz)
+        self.publish(*readings)
+
+    def decimate(self, client, stamps, stream_hz):
+        """
+        decimate picks the readings of a batch that are due for a
+        subscriber slower than the stream_hz stream: the first at or after
+        its next due time, which then moves on by the subscriber's period.
+        A stream_hz of 0 means the stream rate is unknown, so every
+        subscriber is decimated
+
+        Returns:
+        List[int]: indices into the batch, or None for all of them
+        """
+        rate_hz = self.subscribers[client]
+        if stream_hz and rate_hz >= stream_hz:
+            return None
+        period_ms = 1000 / rate_hz
+        due = self.next_due[client]
+        picked = []
+        for i, ms in enumerate(stamps):
+            if ms >= due:
+                picked.append(i)
+                due += period_ms
+                if due <= ms:
+                    # Fell a whole period behind, after a pause or a rate
+                    # change: start again from this reading
+                    due = ms + period_ms
+        self.next_due[client] = due
+        return picked
+
+    def publish(self, hums, temps, stamps, strnows, stream_hz=None):
+        """
+        publish writes a batch of readings to every subscriber, encoding
+        each frame at most once per protocol for the subscribers that take
+        every reading, and separately for slower ones. stream_hz is the
+        rate the batch was produced at, this broadcaster's own by default
+        """
+        if stream_hz is None:
+            stream_hz = self.rate_hz
+        text_frames = None
+        binary_frame = None
+        for client in list(self.subscribers):
+            try:
+                picked = self.decimate(client, stamps, stream_hz)
+                if picked is not None:
+                    if not picked:
+                        continue
+                    if client.binary:
+                        client.send(protocol.encode_readings(
+                            protocol.MSG_DATA, [hums[i] for i in picked],
+                            [temps[i] for i in picked],
+                            [stamps[i] for i in picked]),
+                            binary=True, latest=True)
+                    else:
+                        for i in picked:
+                            client.send(
+                                f'data {hums[i]},{temps[i]},{strnows[i]}'
+                                .encode(), latest=True)
+                elif client.binary:
+                    if binary_frame is None:
+                        binary_frame = protocol.encode_readings(
+                            protocol.MSG_DATA, hums, temps, stamps)
+                    client.send(binary_frame, binary=True, latest=True)
+                else:
+                    if text_frames is None:
+                        text_frames = [
+                            f'data {hum},{temp},{strnow}'.encode()
+                            for hum, temp, strnow in zip(hums, temps, strnows)]
+                    for frame in text_frames:
+                        client.send(frame, latest=True)
+            except tornado.websocket.WebSocketClosedError:
+                self.unsubscribe(client)
 
 
 class WSHandler(tornado.websocket.WebSocketHandler):
-    sensor = pseudoSensor.PseudoSensor()
-    sensor_db = db.PseudoSensorDb("prj2_db.db")
-
-    def open(self):
-        print("new connection")
-        self.write_message("Hello World")
-        self.sensor_db.create_connection()
-        self.sensor_db.create_sensor_table()
-
-    def on_message(self, message):
-        print("msg received:", message)
-        match message:
-            case "data req":
-                self.send_humtemp_val(False)
-            case "datam req":
-                self.send_humtemp_val(True)
-            case "shutdown":
-                tornado.ioloop.IOLoop.instance().stop()
-            case "calcstats":
-                self.send_calculate_stats()
+    service = SensorService("prj2_db.db")
+    broadcaster = Broadcaster(service)
+    clients = set()
+
+    # Outbound queue per connection, see send()
+    send_policy = "drop-oldest"
+    send_queue_size = 256
+    high_water = 192
+    high_water_seconds = 10
+    write_buffer_bytes = 64 * 1024
+
+    def initialize(self):
+        self.outbox = collections.deque()
+        self.latest_entry = None
+        self.last_write = None
+        # Bytes written to the websocket but not yet accepted by the socket
+        self.pending_bytes = 0
+        self.draining = False
+        self.over_since = None
+
+    async def open(self):
+        self.clients.add(self)
+        self.send("Hello World")
+        await self.service.start()
+
+    async def on_message(self, message):
+        # Tornado runs this coroutine per connection, so a slow database
+        # call only delays the next message from this client, not others
+        started = time.perf_counter()
+        words = message.split()
+        kind = words[0] if words and words[0] in MESSAGE_TYPES else "unknown"
+        MESSAGES.inc(kind)
+        try:
+            await self.handle_message(words)
+        finally:
+            MESSAGE_SECONDS.observe(time.perf_counter() - started, kind)
+
+    async def handle_message(self, words):
+        match words:
+            case ["data", "req"]:
+                await self.send_humtemp_val(False)
+            case ["datam", "req"]:
+                await self.send_humtemp_val(True)
+            case ["shutdown"]:
+                self.service.shutdown()
+            case ["calcstats"]:
+                await self.send_calculate_stats()
+            case ["calcstats", window] if window.isdigit():
+                await self.send_calculate_stats(int(window))
+            case ["rangestats", start, end]:
+                await self.send_range_stats(start, end)
+            case ["subscribe", rate_hz]:
+                self.subscribe(rate_hz)
+            case ["unsubscribe"]:
+                self.broadcaster.unsubscribe(self)
+            case ["setalarm", name, channel, direction, limit, *options]:
+                self.set_alarm(name, channel, direction, limit, options)
+            case ["clearalarm", name]:
+                self.service.remove_alarm(self, name)
             case _:
-                print(message)
-                self.write_message("Unrecognized message")
+                self.send("Unrecognized message")
 
     def on_close(self):
-        print("connection closed")
+        self.clients.discard(self)
+        self.broadcaster.unsubscribe(self)
+        self.service.remove_alarms(self)
+        self.outbox.clear()
+        self.latest_entry = None
+
+    def send(self, message, binary=False, latest=False):
+        """
+        send writes a message through this connection's bounded queue.
+        While Tornado's write buffer holds less than write_buffer_bytes the
+        message goes straight out; past that it waits in the queue, which
+        never holds more than send_queue_size messages. With the coalesce
+        policy a `latest` (stream) message overwrites the stream message
+        still waiting in the queue instead of adding another. A client
+        that stays over high_water queued messages for high_water_seconds
+        is disconnected
+        """
+        if self.ws_connection is None or self.ws_connection.is_closing():
+            raise tornado.websocket.WebSocketClosedError()
+
+        if (not self.outbox and not self.draining
+                and self.pending_bytes <= self.write_buffer_bytes):
+            self.write_now(message, binary)
+            return
+
+        if latest and self.send_policy == "coalesce":
+            if self.latest_entry is not None:
+                self.latest_entry[:] = [message, binary]
+                SEND_DROPPED.inc(self.send_policy)
+                return
+        if len(self.outbox) >= self.send_queue_size:
+            if self.outbox.popleft() is self.latest_entry:
+                self.latest_entry = None
+            SEND_DROPPED.inc(self.send_policy)
+        entry = [message, binary]
+        if latest:
+            self.latest_entry = entry
+        self.outbox.append(entry)
+
+        if len(self.outbox) < self.high_water:
+            self.over_since = None
+        elif self.over_since is None:
+            self.over_since = time.monotonic()
+        elif time.monotonic() - self.over_since > self.high_water_seconds:
+            SLOW_CLOSED.inc()
+            self.close(1008, "Client too slow")
+            return
+
+        if not self.draining:
+            self.draining = True
+            tornado.ioloop.IOLoop.current().spawn_callback(self.drain)
+
+    def write_now(self, message, binary):
+        size = len(message if isinstance(message, bytes)
+                   else message.encode())
+        self.last_write = self.write_message(message, binary=binary)
+        # The write resolves once the socket has taken the message, or
+        # fails with the connection
+        self.pending_bytes += size
+        self.last_write.add_done_callback(
+            functools.partial(self.written, size))
+
+    def written(self, size, future):
+        self.pending_bytes -= size
+        # Nobody awaits most writes, and closing a slow client fails all of
+        # its buffered ones at once
+        discard_result(future)
+
+    async def drain(self):
+        """
+        drain moves queued messages into Tornado's write buffer, waiting
+        for the buffer to flush whenever it is over write_buffer_bytes
+        """
+        try:
+            while self.outbox:
+                if self.pending_bytes > self.write_buffer_bytes:
+                    await self.last_write
+                    continue
+                entry = self.outbox.popleft()
+                if entry is self.latest_entry:
+                    self.latest_entry = None
+                self.write_now(*entry)
+        except tornado.websocket.WebSocketClosedError:
+            self.outbox.clear()
+            self.latest_entry = None
+        finally:
+            self.draining = False
+            self.over_since = None
 
     def check_origin(self, origin):
         return True
 
-    def send_humtemp_val(self, for_multiple):
-        hum, temp = self.sensor.generate_values()
-        now = datetime.datetime.now()
-        strnow = now.strftime("%Y-%m-%dT%H:%M:%S")
-        db_data = (temp, hum, strnow)
-        self.sensor_db.insert_data(db_data)
-        if not for_multiple:
-            self.write_message(f'data {hum},{temp},{strnow}')
+    def select_subprotocol(self, subprotocols):
+        """
+        select_subprotocol opts the client into the binary protocol when it
+        offers it; otherwise the connection stays on the text protocol
+        """
+        if protocol.SUBPROTOCOL in subprotocols:
+            return protocol.SUBPROTOCOL
+        return None
+
+    @property
+    def binary(self):
+        return self.selected_subprotocol == protocol.SUBPROTOCOL
+
+    async def send_humtemp_val(self, for_multiple):
+        hum, temp, strnow, timestamp_ms = await self.service.read()
+        if self.binary:
+            msg_type = (protocol.MSG_DATAM if for_multiple
+                        else protocol.MSG_DATA)
+            self.send(protocol.encode_readings(
+                msg_type, [hum], [temp], [timestamp_ms]), binary=True)
+        elif not for_multiple:
+            self.send(f'data {hum},{temp},{strnow}')
         else:
-            self.write_message(f'datam {hum},{temp},{strnow}')
+            self.send(f'datam {hum},{temp},{strnow}')
+
+    def subscribe(self, rate_hz):
+        """
+        subscribe registers this client for pushed 'data' frames at
+        'subscribe <rate_hz>' readings per second
+        """
+        try:
+            rate_hz = float(rate_hz)
+        except ValueError:
+            rate_hz = 0
+        if not 0 < rate_hz < float("inf"):
+            self.send(f"Invalid rate: {rate_hz}")
+            return
+        self.broadcaster.subscribe(self, rate_hz)
+
+    def set_alarm(self, name, channel, direction, limit, options):
+        """
+        set_alarm answers 'setalarm <name> <temp|hum> <above|below> <limit>
+        [rate] [hysteresis=<h>] [for=<ms>]'. The rule watches every reading
+        the server stores, not just the ones sent to this client, and each
+        time it raises or clears the client gets
+        'alarm <name>,<raised|cleared>,<value>,<epoch ms>'
+        """
+        try:
+            fields = {"channel": channel, "direction": direction,
+                      "limit": float(limit)}
+            for option in options:
+                key, _, value = option.partition("=")
+                match key:
+                    case "rate":
+                        fields["kind"] = "rate"
+                    case "hysteresis":
+                        fields["hysteresis"] = float(value)
+                    case "for":
+                        fields["duration_ms"] = int(value)
+                    case _:
+                        raise ValueError(f"unknown option {option}")
+            self.service.add_alarm(self, name, self.send_alarm, **fields)
+        except ValueError as e:
+            self.send(f"Invalid alarm: {e}")
+
+    def send_alarm(self, event):
+        state = "raised" if event.raised else "cleared"
+        try:
+            self.send(f'alarm {event.rule},{state},{event.value},'
+                      f'{event.timestamp_ms}')
+        except tornado.websocket.WebSocketClosedError:
+            # Closing, e.g. for being too slow, but on_close has not run
+            # yet; the event must not fail whoever stored the reading
+            self.service.remove_alarms(self)
+
+    async def send_calculate_stats(self, window=None):
+        """
+        send_calculate_stats answers from the in-memory rolling statistics,
+        so it never touches the database and costs the same for any window
+        """
+        key = ("datacalc", window)
+        started = time.perf_counter()
+        result = self.service.cache.result(
+            key, lambda: self.service.calc_stats(window))
+        try:
+            await result
+        except ValueError as e:
+            self.send(f"Invalid window: {e}")
+            return
+        STATS_SECONDS.observe(time.perf_counter() - started, "rolling")
+        self.send(self.service.cache.frame(key, result, self.binary),
+                  binary=self.binary)
+
+    async def send_range_stats(self, start, end):
+        """
+        send_range_stats answers 'rangestats <start> <end>' (ISO datetimes,
+        end exclusive) from the rollup tables, so the cost does not grow
+        with the length of the range
+        """
+        try:
+            start = datetime.datetime.fromisoformat(start)
+            end = datetime.datetime.fromisoformat(end)
+        except ValueError as e:
+            self.send(f"Invalid range: {e}")
+            return
+
+        key = ("datarange", start, end)
+        started = time.perf_counter()
+        result = self.service.cache.result(
+            key, lambda: self.service.range_stats(start, end))
+        await result
+        STATS_SECONDS.observe(time.perf_counter() - started, "range")
+        self.send(self.service.cache.frame(key, result, self.binary),
+                  binary=self.binary)
+
+
+class HistoryHandler(tornado.web.RequestHandler):
+    """
+    HistoryHandler serves the stored readings one page at a time:
+
+        GET /history?start=<t>&end=<t>&after=<cursor>&limit=<n>
+
+    start and end are epoch milliseconds or ISO datetimes (end exclusive).
+    The response holds the rows and a 'next' cursor to pass back as
+    'after', or null on the last page. Pages use keyset pagination, so
+    walking millions of rows never loads them all or scans with OFFSET
+
+    With format=bin the page is a binary protocol frame of readings and the
+    cursor comes back in the X-Next-Cursor header
+    """
+    max_limit = 10000
+
+    def set_default_headers(self):
+        # The client page is opened from file://, same as check_origin
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Expose-Headers", "X-Next-Cursor")
+
+    def parse_time(self, name, default):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        if value.isdigit():
+            return int(value)
+        return datetime.datetime.fromisoformat(value)
+
+    async def get(self):
+        try:
+            start = self.parse_time("start", 0)
+            end = self.parse_time("end", 2**62)
+            limit = int(self.get_argument("limit", "1000"))
+            after = self.get_argument("after", None)
+            if after is not None:
+                after_ms, after_id = after.split(":")
+                after = (int(after_ms), int(after_id))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+        limit = max(1, min(limit, self.max_limit))
+
+        rows = await WSHandler.service.get_page(start, end, after, limit)
+        cursor = None
+        if len(rows) == limit:
+            cursor = f"{rows[-1][4]}:{rows[-1][0]}"
+
+        if self.get_argument("format", "json") == "bin":
+            self.set_header("Content-Type", "application/octet-stream")
+            if cursor is not None:
+                self.set_header("X-Next-Cursor", cursor)
+            self.write(protocol.encode_readings(
+                protocol.MSG_HISTORY, [row[2] for row in rows],
+                [row[1] for row in rows], [row[4] or 0 for row in rows]))
+            return
+
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"rows": rows, "next": cursor}))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    MetricsHandler serves the process metrics in the Prometheus text format
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.REGISTRY.render())
+
+
+metrics.REGISTRY.gauge(
+    "sensor_ws_open_connections", "Open websocket connections",
+    func=lambda: len(WSHandler.clients))
+metrics.REGISTRY.gauge(
+    "sensor_ws_subscribers", "Websocket clients subscribed to the stream",
+    func=lambda: len(WSHandler.broadcaster.subscribers))
+metrics.REGISTRY.gauge(
+    "sensor_ws_send_queue_depth",
+    "Messages waiting in websocket send queues",
+    func=lambda: sum(len(client.outbox) for client in WSHandler.clients))
+metrics.REGISTRY.gauge(
+    "sensor_ws_send_queue_max_depth",
+    "Longest websocket send queue",
+    func=lambda: max((len(client.outbox) for client in WSHandler.clients),
+                     default=0))
+metrics.REGISTRY.gauge(
+    "sensor_ws_pending_outbound_bytes",
+    "Bytes written to websockets but not yet sent",
+    func=lambda: sum(client.pending_bytes for client in WSHandler.clients))
+
+
+def configure(db_name, storage="sqlite", retention=None):
+    """
+    configure points the handlers at a different database file, or column
+    store directory, with fresh rolling statistics and a fresh broadcaster
+    to match
+    """
+    WSHandler.service = SensorService(db_name, WSHandler.service.sensor,
+                                      storage, retention)
+    WSHandler.broadcaster = Broadcaster(WSHandler.service)
+
+
+def make_app():
+    return tornado.web.Application([
+        (r'/ws/', WSHandler),
+        (r'/history', HistoryHandler),
+        (r'/metrics', MetricsHandler),
+    ])
 
-    def send_calculate_stats(self):
-        data_rows = self.sensor_db.get_latest_10()
 
-        # Start from '1' index because index 0 is the primary key column
-        temps = [row[2] for row in data_rows]
-        hums = [row[1] for row in data_rows]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sensor websocket server")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--db", default=None,
+                        help="database file, or directory for columnar "
+                        "storage (default prj2_db.db or prj2_db.cols)")
+    parser.add_argument("--storage", choices=sorted(STORAGE),
+                        default="sqlite",
+                        help="sqlite, or the memory-mapped column store for "
+                        "high-rate ingest")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="websocket worker processes; more than one "
+                        "adds a separate sensor/database hub process")
+    parser.add_argument("--send-policy", choices=SEND_POLICIES,
+                        default=WSHandler.send_policy,
+                        help="what a slow client's full send queue drops")
+    parser.add_argument("--send-queue-size", type=int,
+                        default=WSHandler.send_queue_size)
+    parser.add_argument("--replay", metavar="SOURCE", default=None,
+                        help="replay the readings recorded in a database, "
+                        "column store or exported file instead of "
+                        "generating them")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed-up over the recorded cadence; "
+                        "0 replays as fast as possible")
+    parser.add_argument("--keep-days", type=float, default=None,
+                        help="delete readings older than this")
+    parser.add_argument("--keep-rows", type=int, default=None,
+                        help="delete all but the newest KEEP_ROWS readings")
+    parser.add_argument("--archive-dir", default=None,
+                        help="append deleted readings to gzipped CSV files "
+                        "here first")
+    args = parser.parse_args(argv)
+    if args.db is None:
+        args.db = "prj2_db.db" if args.storage == "sqlite" else "prj2_db.cols"
+    retention = None
+    if args.keep_days is not None or args.keep_rows is not None:
+        retention = db.RetentionPolicy(
+            max_age_ms=None if args.keep_days is None
+            else int(args.keep_days * 86400 * 1000),
+            max_rows=args.keep_rows, archive_dir=args.archive_dir)
 
-        min_temp = min(temps)
-        min_hum = min(hums)
-        max_temp = max(temps)
-        max_hum = max(hums)
-        avg_temp = sum(temps)/len(temps)
-        avg_hum = sum(hums)/len(hums)
+    WSHandler.send_policy = args.send_policy
+    WSHandler.send_queue_size = args.send_queue_size
+    WSHandler.high_water = max(1, args.send_queue_size * 3 // 4)
 
-        self.write_message(f"datacalc {min_temp},{max_temp},{
-                           avg_temp},{min_hum},{max_hum},{avg_hum}")
+    if args.replay is not None and args.workers > 1:
+        parser.error("--replay runs in a single process, without --workers")
+    if args.replay is not None and \
+            os.path.abspath(args.replay) == os.path.abspath(args.db):
+        parser.error("--replay needs a different --db to store into")
+    if args.replay is not None and not os.path.exists(args.replay):
+        parser.error(f"--replay source {args.replay} does not exist")
 
+    if args.workers > 1:
+        from . import hub
+        hub.serve(args.workers, args.port, args.db, args.storage, retention)
+        return
 
-def main():
-    application = tornado.web.Application([(r'/ws/', WSHandler)])
+    configure(args.db, args.storage, retention)
+    if args.replay is not None:
+        from . import replay
+        WSHandler.broadcaster = replay.replay(
+            WSHandler.service, args.replay, args.speed)
+    application = make_app()
     http_server = tornado.httpserver.HTTPServer(application)
-    http_server.listen(8888, address="localhost")
+    http_server.listen(args.port, address="localhost")
     # my_ip = socket.gethostbyname(socket.gethostname())
-    print("Starting a server on localhost:8888")
+    print(f"Starting a server on localhost:{args.port}")
     tornado.ioloop.IOLoop.instance().start()
+    WSHandler.service.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from server import alarms
+
+# Exactly at the limit does not raise and exactly at the clear level does
+# not clear; the alarm stays up everywhere between the two
+TEMPS = [40.0, 50.0, 50.5, 46.0, 45.0, 44.9, 49.0, 51.0, 50.0, 44.0]
+EDGES = [(2, True), (5, False), (7, True), (9, False)]
+
+
+def edges(events):
+    return [(event.timestamp_ms, event.raised) for event in events]
+
+
+@pytest.mark.parametrize("split", [0, 1, 3, 5, 10])
+def test_hysteresis_edges(split):
+    engine = alarms.AlarmEngine()
+    engine.add_rule(alarms.AlarmRule("hot", "temp", 50, hysteresis=5))
+    stamps = list(range(len(TEMPS)))
+    hums = [0.0] * len(TEMPS)
+
+    # However the readings are split into batches, the edges are the same
+    events = engine.evaluate(TEMPS[:split], hums[:split], stamps[:split]) + \
+        engine.evaluate(TEMPS[split:], hums[split:], stamps[split:])
+    assert edges(events) == EDGES
+    assert [event.value for event in events] == \
+        [TEMPS[ms] for ms, _ in EDGES]
+
+
+def test_below_mirrors_above():
+    engine = alarms.AlarmEngine()
+    engine.add_rule(alarms.AlarmRule("cold", "temp", -50, direction="below",
+                                     hysteresis=5))
+    temps = [-value for value in TEMPS]
+    events = engine.evaluate(temps, [0.0] * len(temps), range(len(temps)))
+    assert edges(events) == EDGES
+
+
+def test_sensors_are_independent():
+    engine = alarms.AlarmEngine(sensors=2)
+    engine.add_rule(alarms.AlarmRule("hot", "temp", 50, hysteresis=5))
+    temps = np.array([TEMPS, TEMPS[::-1]])
+    events = engine.evaluate(temps, np.zeros_like(temps), range(len(TEMPS)))
+    assert [(e.sensor, e.timestamp_ms, e.raised) for e in events
+            if e.sensor == 0] == [(0, ms, raised) for ms, raised in EDGES]
+    # The reversed run raises at 51.0 and 50.5, clears at 44.9 and 40.0
+    assert [(e.timestamp_ms, e.raised) for e in events if e.sensor == 1] == \
+        [(2, True), (4, False), (7, True), (9, False)]
+
+
+def test_duration_delays_the_raise():
+    engine = alarms.AlarmEngine()
+    engine.add_rule(alarms.AlarmRule("hot", "temp", 50, hysteresis=5,
+                                     duration_ms=2000))
+    stamps = [i * 1000 for i in range(len(TEMPS))]
+    events = engine.evaluate(TEMPS, [0.0] * len(TEMPS), stamps)
+    # Raised from 2 s to 5 s, so it holds long enough once, at 4 s; the
+    # second run is cleared after 2 s and never raises
+    assert edges(events) == [(4000, True), (5000, False)]
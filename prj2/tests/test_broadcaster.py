@@ -0,0 +1,69 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+from server import server
+
+
+def decimated(rates, batches, stream_hz):
+    """
+    decimated subscribes a client per rate and runs every batch of
+    timestamps through decimate, returning the timestamps each client got
+    """
+    async def run():
+        # subscribe starts the broadcast tick, which needs a running loop;
+        # nothing here awaits, so it never fires
+        broadcaster = server.Broadcaster(service=None)
+        for client, rate_hz in rates.items():
+            broadcaster.subscribe(client, rate_hz)
+        got = {client: [] for client in rates}
+        for stamps in batches:
+            for client in rates:
+                picked = broadcaster.decimate(client, stamps, stream_hz)
+                got[client].extend(
+                    stamps if picked is None else [stamps[i] for i in picked])
+        for client in rates:
+            broadcaster.unsubscribe(client)
+        return got
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("stream_hz", [100, 0])
+def test_each_client_gets_its_own_rate(stream_hz):
+    # Three seconds of a 100 Hz stream, two readings per tick
+    stamps = [1700000000000 + i * 10 for i in range(300)]
+    batches = [stamps[i:i + 2] for i in range(0, len(stamps), 2)]
+    rates = {"slow": 1, "mid": 8, "fast": 100}
+
+    got = decimated(rates, batches, stream_hz)
+
+    assert len(got["slow"]) == 3
+    assert len(got["mid"]) == 24
+    assert got["fast"] == stamps
+    # Each pick is the first reading at or after its slot on the client's
+    # own period grid, so the rate holds on average without drifting
+    for client, rate_hz in rates.items():
+        for k, ms in enumerate(got[client]):
+            slot = stamps[0] + k * 1000 / rate_hz
+            assert slot <= ms < slot + 10
+
+
+def test_faster_client_takes_every_reading():
+    stamps = [1700000000000 + i * 100 for i in range(20)]
+    got = decimated({"client": 50}, [stamps], stream_hz=10)
+    assert got["client"] == stamps
+
+
+def test_client_restarts_after_a_gap():
+    before = [1700000000000 + i * 100 for i in range(20)]
+    # A pause of a minute, then readings resume off the old period grid
+    after = [before[-1] + 60000 + 37 + i * 100 for i in range(20)]
+    got = decimated({"client": 1}, [before, after], stream_hz=10)
+    assert got["client"] == [before[0], before[10], after[0], after[10]]
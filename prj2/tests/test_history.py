@@ -0,0 +1,40 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import pytest
+
+from server import server
+
+
+@pytest.mark.parametrize("storage", sorted(server.STORAGE))
+@pytest.mark.parametrize("limit", [1, 3, 4, 1000])
+def test_pages_walk_tied_timestamps_once(tmp_path, storage, limit):
+    sensor_db = server.STORAGE[storage](str(tmp_path / "sensor"))
+    sensor_db.create_connection()
+    sensor_db.create_sensor_table()
+    # Runs of readings that share a timestamp, longer than a page, so pages
+    # start and end in the middle of a run
+    stamps = [1700000000000 + 1000 * (i // 5) for i in range(23)]
+    sensor_db.insert_many([(float(i), 50.0, "", ms)
+                           for i, ms in enumerate(stamps)])
+
+    start, end = stamps[2], stamps[-1]
+    seen = []
+    after = None
+    while True:
+        page = sensor_db.get_page(start, end, after, limit)
+        assert len(page) <= limit
+        seen.extend(page)
+        if len(page) < limit:
+            break
+        after = (page[-1][4], page[-1][0])
+
+    expected = [i + 1 for i, ms in enumerate(stamps) if start <= ms < end]
+    assert [row[0] for row in seen] == expected
+    assert [row[1] for row in seen] == [float(i - 1) for i in expected]
+    assert [(row[4], row[0]) for row in seen] == \
+        sorted((row[4], row[0]) for row in seen)
+    sensor_db.close_db()
@@ -0,0 +1,49 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import struct
+
+import numpy as np
+import pytest
+
+from server import protocol
+
+
+@pytest.mark.parametrize("count", [0, 1, 50, protocol.MAX_RECORDS])
+def test_readings_round_trip(count):
+    rng = np.random.default_rng(count)
+    hums = rng.uniform(0, 100, count)
+    temps = rng.uniform(-20, 90, count)
+    stamps = 1700000000000 + np.arange(count, dtype=np.int64) * 7
+
+    frame = protocol.encode_readings(protocol.MSG_DATAM, hums, temps, stamps)
+    assert len(frame) == protocol.HEADER.size + \
+        count * protocol.READING.itemsize
+
+    msg_type, records = protocol.decode(frame)
+    assert msg_type == protocol.MSG_DATAM
+    assert len(records) == count
+    # Values travel as float32, timestamps exactly
+    assert records["hum"].tolist() == hums.astype(np.float32).tolist()
+    assert records["temp"].tolist() == temps.astype(np.float32).tolist()
+    assert records["ts"].tolist() == stamps.tolist()
+
+
+def test_more_than_max_records_do_not_fit():
+    count = protocol.MAX_RECORDS + 1
+    with pytest.raises(struct.error):
+        protocol.encode_readings(protocol.MSG_DATA, np.zeros(count),
+                                 np.zeros(count), np.zeros(count))
+
+
+@pytest.mark.parametrize("msg_type",
+                         [protocol.MSG_DATACALC, protocol.MSG_DATARANGE])
+def test_stats_round_trip(msg_type):
+    calcs = [(-12.5, 88.25, 40.125), (0.5, 99.75, 50.0)]
+    frame = protocol.encode_stats(msg_type, calcs)
+    assert frame[0] == msg_type
+    assert protocol.decode(frame) == (
+        msg_type, tuple(calcs[0]) + tuple(calcs[1]))
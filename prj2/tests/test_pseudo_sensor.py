@@ -0,0 +1,43 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from server import pseudoSensor
+
+
+@pytest.mark.parametrize("n", [1, 7, 18, 100])
+def test_batch_matches_single_reads(n):
+    single = pseudoSensor.PseudoSensor(seed=42)
+    batched = pseudoSensor.PseudoSensor(seed=42)
+    # Start both mid-cycle, so the cursors have to wrap inside the batch
+    for _ in range(5):
+        single.generate_values()
+        batched.generate_values()
+
+    expected = [single.generate_values() for _ in range(n)]
+    hums, temps, stamps = batched.generate_batch(n, start_ms=1000,
+                                                 period_ms=250)
+
+    assert hums.tolist() == [hum for hum, _ in expected]
+    assert temps.tolist() == [temp for _, temp in expected]
+    assert stamps.tolist() == [1000 + i * 250 for i in range(n)]
+    assert (batched.h_range_index, batched.t_range_index) == \
+        (single.h_range_index, single.t_range_index)
+    assert (batched.humVal, batched.tempVal) == \
+        (single.humVal, single.tempVal)
+    # And the generators are left in step for whatever comes next
+    assert batched.generate_values() == single.generate_values()
+
+
+def test_empty_batch_leaves_sensor_alone():
+    sensor = pseudoSensor.PseudoSensor(seed=1)
+    hums, temps, stamps = sensor.generate_batch(0)
+    assert len(hums) == len(temps) == len(stamps) == 0
+    assert stamps.dtype == np.int64
+    assert sensor.generate_values() == \
+        pseudoSensor.PseudoSensor(seed=1).generate_values()
@@ -0,0 +1,44 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import time
+
+from server import db
+
+
+def raw_stats(sensor_db):
+    return sensor_db.conn.execute("""
+    SELECT min(temperature_degC), max(temperature_degC),
+        avg(temperature_degC), count(*)
+    FROM sensor_data
+    """).fetchone()
+
+
+def test_expiry_keeps_stats_in_step_with_raw_rows(tmp_path):
+    sensor_db = db.PseudoSensorDb(str(tmp_path / "sensor.db"))
+    sensor_db.create_connection()
+    sensor_db.create_sensor_table()
+    now_ms = int(time.time() * 1000)
+    start_ms = now_ms - 5000 * 1000
+    # One reading a second, so the expiry cuts through minute, hour and
+    # possibly day buckets; the coldest reading is the first to go
+    sensor_db.insert_many(
+        [(-50.0 if i == 0 else 40.0 + i % 30, 50.0, "", start_ms + i * 1000)
+         for i in range(5000)])
+
+    while sensor_db.expire_chunk(max_age_ms=now_ms - start_ms - 3001 * 1000,
+                                 limit=1000):
+        pass
+
+    temp_min, temp_max, temp_avg, count = raw_stats(sensor_db)
+    assert 0 < count < 2000
+    for start, end in ((start_ms - 86400 * 1000, now_ms + 86400 * 1000),
+                       (0, 2**50)):
+        temps, _ = sensor_db.get_stats(start, end)
+        assert temps[0] == temp_min
+        assert temps[1] == temp_max
+        assert abs(temps[2] - temp_avg) < 1e-9
+    sensor_db.close_db()
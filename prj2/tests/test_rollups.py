@@ -0,0 +1,71 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import random
+
+from server import db
+
+DAY_MS = 86400 * 1000
+
+
+def brute_force(readings, start, end):
+    # get_stats resolves its bounds to the second
+    lo = start // 1000 * 1000
+    hi = end // 1000 * 1000
+    inside = [(temp, hum) for temp, hum, ms in readings if lo <= ms < hi]
+    if not inside:
+        return None
+    temps = [temp for temp, _ in inside]
+    hums = [hum for _, hum in inside]
+    return [(min(temps), max(temps), sum(temps) / len(temps)),
+            (min(hums), max(hums), sum(hums) / len(hums))]
+
+
+def test_range_stats_match_raw_aggregate(tmp_path):
+    rng = random.Random(3)
+    sensor_db = db.PseudoSensorDb(str(tmp_path / "sensor.db"))
+    sensor_db.create_connection()
+    sensor_db.create_sensor_table()
+
+    # Three days of readings at uneven gaps, so buckets at every level are
+    # partly filled, empty or shared by several batches
+    first_ms = 1700000000000 - 1700000000000 % DAY_MS + 1234
+    readings = []
+    ms = first_ms
+    while ms < first_ms + 3 * DAY_MS:
+        readings.append((round(rng.uniform(-20, 90), 3),
+                         round(rng.uniform(0, 90), 3), ms))
+        ms += rng.choice([250, 1000, 59000, 61000, 3600 * 1000])
+    for i in range(0, len(readings), 97):
+        batch = readings[i:i + 97]
+        if len(batch) == 1:
+            temp, hum, ms = batch[0]
+            sensor_db.insert_data((temp, hum, "", ms))
+        else:
+            sensor_db.insert_many([(temp, hum, "", ms)
+                                   for temp, hum, ms in batch])
+
+    last_ms = readings[-1][2]
+    ranges = [(0, 2**50), (first_ms, last_ms + 1), (first_ms, last_ms),
+              (first_ms + DAY_MS, first_ms + 2 * DAY_MS),
+              (first_ms - 1234 + DAY_MS, first_ms - 1234 + 2 * DAY_MS),
+              (first_ms + 60000, first_ms + 120000),
+              (last_ms + 1000, last_ms + 2000)]
+    for _ in range(200):
+        start, end = sorted(rng.randrange(first_ms - 60000, last_ms + 60000)
+                            for _ in range(2))
+        ranges.append((start, end))
+
+    for start, end in ranges:
+        expected = brute_force(readings, start, end)
+        actual = sensor_db.get_stats(start, end)
+        if expected is None:
+            assert actual is None
+            continue
+        for got, want in zip(actual, expected):
+            assert got[:2] == want[:2]
+            assert abs(got[2] - want[2]) < 1e-9
+    sensor_db.close_db()
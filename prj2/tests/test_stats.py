@@ -0,0 +1,66 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import random
+
+import pytest
+
+from server import stats
+
+
+def brute_force(values):
+    return min(values), max(values), sum(values) / len(values)
+
+
+def assert_close(actual, expected):
+    assert actual[0] == expected[0]
+    assert actual[1] == expected[1]
+    assert abs(actual[2] - expected[2]) < 1e-9
+
+
+@pytest.mark.parametrize("size", [1, 3, 10, 64])
+def test_rolling_window_matches_brute_force(size):
+    rng = random.Random(size)
+    window = stats.RollingWindow(size)
+    assert window.stats() is None
+    values = []
+    # Long enough for the periodic rebuild of the running sum to run
+    for _ in range(size * 64 * 2 + 5):
+        # Repeats, so ties in the min/max deques are exercised too
+        value = rng.choice([rng.uniform(-50, 50), 0.0, 10.0])
+        values.append(value)
+        window.push(value)
+        assert_close(window.stats(), brute_force(values[-size:]))
+
+
+def test_sensor_stats_windows_follow_updates():
+    rng = random.Random(7)
+    rows = [(rng.uniform(-20, 90), rng.uniform(0, 90)) for _ in range(50)]
+    engine = stats.SensorStats(default_window=10, max_window=200,
+                               max_windows=2)
+    engine.seed(rows)
+
+    for step in range(300):
+        temp, hum = rng.uniform(-20, 90), rng.uniform(0, 90)
+        engine.update(temp, hum)
+        rows.append((temp, hum))
+        # Cycling through three sizes with room for two keeps evicting and
+        # rebuilding windows from the history
+        for size in (None, 5 + step % 3, 200):
+            latest = rows[-(size or 10):]
+            temps, hums = engine.stats(size)
+            assert_close(temps, brute_force([t for t, _ in latest]))
+            assert_close(hums, brute_force([h for _, h in latest]))
+
+
+def test_sensor_stats_bounds():
+    engine = stats.SensorStats(max_window=100)
+    assert engine.stats() is None
+    engine.update(20.0, 40.0)
+    assert engine.stats(100) == [(20.0, 20.0, 20.0), (40.0, 40.0, 40.0)]
+    for size in (0, 101):
+        with pytest.raises(ValueError):
+            engine.stats(size)
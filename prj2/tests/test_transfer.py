@@ -0,0 +1,38 @@
+"""
+Run from the prj2 directory:
+
+    python -m pytest tests
+"""
+
+import datetime
+import json
+
+import pytest
+
+from server import transfer
+
+
+@pytest.mark.parametrize("storage", sorted(transfer.STORAGE))
+@pytest.mark.parametrize("name", ["readings.csv", "readings.ndjson"])
+def test_import_fills_in_missing_datetimes(tmp_path, storage, name):
+    stamps = [1700000000000 + i * 1000 for i in range(5)]
+    path = tmp_path / name
+    if name.endswith(".csv"):
+        path.write_text("temperature_degC,humidity_pcent,timestamp_ms\n" +
+                        "".join(f"20.5,40.0,{ms}\n" for ms in stamps))
+    else:
+        path.write_text("".join(json.dumps({
+            "temperature_degC": 20.5, "humidity_pcent": 40.0,
+            "timestamp_ms": ms}) + "\n" for ms in stamps))
+
+    sensor_db = transfer.STORAGE[storage](str(tmp_path / "imported"))
+    sensor_db.create_connection()
+    sensor_db.create_sensor_table()
+    assert transfer.import_rows(sensor_db, str(path)) == len(stamps)
+
+    rows = list(sensor_db.iter_range(0, 2**62))
+    assert [row[4] for row in rows] == stamps
+    assert [row[3] for row in rows] == [
+        datetime.datetime.fromtimestamp(ms / 1000)
+        .strftime(sensor_db.datetime_format) for ms in stamps]
+    sensor_db.close_db()